@@ -0,0 +1,47 @@
+"""add_updated_at_to_movies
+
+Revision ID: 3d9c5b7e2a41
+Revises: afe071935407
+Create Date: 2026-10-18 14:05:12.482913
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d9c5b7e2a41'
+down_revision: Union[str, None] = 'afe071935407'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Lets catalog.py refresh its snapshot with only the rows changed since the last one
+    op.add_column(
+        'movies',
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+    )
+    op.create_index('ix_movies_updated_at', 'movies', ['updated_at'], unique=False)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION set_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at = CURRENT_TIMESTAMP;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER movies_set_updated_at
+        BEFORE UPDATE ON movies
+        FOR EACH ROW EXECUTE FUNCTION set_updated_at()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS movies_set_updated_at ON movies")
+    op.execute("DROP FUNCTION IF EXISTS set_updated_at()")
+    op.drop_index('ix_movies_updated_at', table_name='movies')
+    op.drop_column('movies', 'updated_at')
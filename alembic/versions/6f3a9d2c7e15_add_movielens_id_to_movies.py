@@ -0,0 +1,32 @@
+"""add_movielens_id_to_movies
+
+Revision ID: 6f3a9d2c7e15
+Revises: 9e2f47c1b8d5
+Create Date: 2026-10-18 20:31:47.109254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '6f3a9d2c7e15'
+down_revision: Union[str, None] = '9e2f47c1b8d5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Stable MovieLens key and source row hash, so import_movielens_data.py
+    # can upsert only new or changed movies instead of truncating the table
+    op.add_column('movies', sa.Column('movielens_id', sa.Integer(), nullable=True))
+    op.add_column('movies', sa.Column('content_hash', sa.String(length=32), nullable=True))
+    op.create_index('ix_movies_movielens_id', 'movies', ['movielens_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_movies_movielens_id', table_name='movies')
+    op.drop_column('movies', 'content_hash')
+    op.drop_column('movies', 'movielens_id')
@@ -0,0 +1,36 @@
+"""add_user_profiles_table
+
+Revision ID: 9e2f47c1b8d5
+Revises: c4a81f26d0b3
+Create Date: 2026-10-18 16:48:03.775120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e2f47c1b8d5'
+down_revision: Union[str, None] = 'c4a81f26d0b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Sparse TF-IDF taste profile per user, maintained by profiles.py
+    op.create_table(
+        'user_profiles',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('model_version', sa.Integer(), nullable=False),
+        sa.Column('liked_ids', sa.LargeBinary(), nullable=False),
+        sa.Column('terms', sa.LargeBinary(), nullable=False),
+        sa.Column('weights', sa.LargeBinary(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', name='user_profiles_pkey'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('user_profiles')
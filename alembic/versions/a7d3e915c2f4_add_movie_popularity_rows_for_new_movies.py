@@ -0,0 +1,51 @@
+"""add_movie_popularity_rows_for_new_movies
+
+Revision ID: a7d3e915c2f4
+Revises: 6f3a9d2c7e15
+Create Date: 2026-10-18 22:12:05.481736
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7d3e915c2f4'
+down_revision: Union[str, None] = '6f3a9d2c7e15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Every movie gets a movie_popularity row when it is inserted, so the
+    # popular list (an index scan of movie_popularity) also covers movies
+    # nobody has liked yet
+    op.execute("""
+        CREATE OR REPLACE FUNCTION add_movie_popularity() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO movie_popularity (movie_id)
+            SELECT id FROM new_movies ORDER BY id
+            ON CONFLICT (movie_id) DO NOTHING;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER movies_add_popularity
+        AFTER INSERT ON movies REFERENCING NEW TABLE AS new_movies
+        FOR EACH STATEMENT EXECUTE FUNCTION add_movie_popularity()
+    """)
+
+    # Movies inserted since movie_popularity was created
+    op.execute("""
+        INSERT INTO movie_popularity (movie_id)
+        SELECT id FROM movies
+        WHERE NOT EXISTS (SELECT 1 FROM movie_popularity WHERE movie_popularity.movie_id = movies.id)
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS movies_add_popularity ON movies")
+    op.execute("DROP FUNCTION IF EXISTS add_movie_popularity()")
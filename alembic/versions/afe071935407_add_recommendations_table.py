@@ -0,0 +1,38 @@
+"""add_recommendations_table
+
+Revision ID: afe071935407
+Revises: bf231e5ab767
+Create Date: 2026-10-18 09:12:40.113254
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'afe071935407'
+down_revision: Union[str, None] = 'bf231e5ab767'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Precomputed top-N recommendations written by get_recommendations.py --batch
+    op.create_table(
+        'recommendations',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('rank', sa.SmallInteger(), nullable=False),
+        sa.Column('movie_id', sa.Integer(), sa.ForeignKey('movies.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('score', sa.Float(), nullable=False),
+        sa.Column('model_version', sa.Integer(), nullable=True),
+        sa.Column('computed_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'rank', name='recommendations_pkey'),
+    )
+    op.create_index('ix_recommendations_computed_at', 'recommendations', ['computed_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_recommendations_computed_at', table_name='recommendations')
+    op.drop_table('recommendations')
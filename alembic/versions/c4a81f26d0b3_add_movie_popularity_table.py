@@ -0,0 +1,102 @@
+"""add_movie_popularity_table
+
+Revision ID: c4a81f26d0b3
+Revises: 3d9c5b7e2a41
+Create Date: 2026-10-18 15:31:47.209164
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4a81f26d0b3'
+down_revision: Union[str, None] = '3d9c5b7e2a41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Like counts per movie, so "most liked" is an index scan instead of a GROUP BY
+    op.create_table(
+        'movie_popularity',
+        sa.Column('movie_id', sa.Integer(), sa.ForeignKey('movies.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('like_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('trending_score', sa.Float(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('movie_id', name='movie_popularity_pkey'),
+    )
+    op.create_index('ix_movie_popularity_like_count', 'movie_popularity',
+                    [sa.text('like_count DESC'), 'movie_id'], unique=False)
+    op.create_index('ix_movie_popularity_trending_score', 'movie_popularity',
+                    [sa.text('trending_score DESC'), 'movie_id'], unique=False)
+
+    # Statement-level triggers apply one grouped delta per statement, so bulk
+    # imports into user_interactions don't pay a counter update per row
+    op.execute("""
+        CREATE OR REPLACE FUNCTION count_movie_likes() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                INSERT INTO movie_popularity (movie_id, like_count)
+                SELECT movie_id, COUNT(*) FROM new_rows WHERE liked
+                GROUP BY movie_id ORDER BY movie_id
+                ON CONFLICT (movie_id)
+                DO UPDATE SET like_count = movie_popularity.like_count + EXCLUDED.like_count;
+            ELSIF TG_OP = 'UPDATE' THEN
+                INSERT INTO movie_popularity (movie_id, like_count)
+                SELECT movie_id, SUM(delta) FROM (
+                    SELECT movie_id, 1 AS delta FROM new_rows WHERE liked
+                    UNION ALL
+                    SELECT movie_id, -1 AS delta FROM old_rows WHERE liked
+                ) AS changes
+                GROUP BY movie_id HAVING SUM(delta) <> 0 ORDER BY movie_id
+                ON CONFLICT (movie_id)
+                DO UPDATE SET like_count = movie_popularity.like_count + EXCLUDED.like_count;
+            ELSE
+                UPDATE movie_popularity
+                SET like_count = movie_popularity.like_count - removed.likes
+                FROM (
+                    SELECT movie_id, COUNT(*) AS likes FROM old_rows WHERE liked GROUP BY movie_id
+                ) AS removed
+                WHERE movie_popularity.movie_id = removed.movie_id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER user_interactions_count_likes_insert
+        AFTER INSERT ON user_interactions REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION count_movie_likes()
+    """)
+    op.execute("""
+        CREATE TRIGGER user_interactions_count_likes_update
+        AFTER UPDATE ON user_interactions REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION count_movie_likes()
+    """)
+    op.execute("""
+        CREATE TRIGGER user_interactions_count_likes_delete
+        AFTER DELETE ON user_interactions REFERENCING OLD TABLE AS old_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION count_movie_likes()
+    """)
+
+    # Backfill, same as `python popularity.py backfill`
+    op.execute("""
+        INSERT INTO movie_popularity (movie_id, like_count)
+        SELECT movies.id, COUNT(user_interactions.movie_id)
+        FROM movies
+        LEFT JOIN user_interactions
+            ON user_interactions.movie_id = movies.id AND user_interactions.liked = TRUE
+        GROUP BY movies.id
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS user_interactions_count_likes_delete ON user_interactions")
+    op.execute("DROP TRIGGER IF EXISTS user_interactions_count_likes_update ON user_interactions")
+    op.execute("DROP TRIGGER IF EXISTS user_interactions_count_likes_insert ON user_interactions")
+    op.execute("DROP FUNCTION IF EXISTS count_movie_likes()")
+    op.drop_index('ix_movie_popularity_trending_score', table_name='movie_popularity')
+    op.drop_index('ix_movie_popularity_like_count', table_name='movie_popularity')
+    op.drop_table('movie_popularity')
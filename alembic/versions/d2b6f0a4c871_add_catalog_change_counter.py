@@ -0,0 +1,77 @@
+"""add_catalog_change_counter
+
+Revision ID: d2b6f0a4c871
+Revises: a7d3e915c2f4
+Create Date: 2026-10-18 23:41:19.305622
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2b6f0a4c871'
+down_revision: Union[str, None] = 'a7d3e915c2f4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # updated_at is the writing transaction's start time, so a long transaction
+    # committing after a shorter one can leave max(updated_at) unchanged and
+    # catalog.py never sees its rows. Instead every statement writing movies
+    # takes the next value of a one-row counter; the row lock serialises
+    # catalog writers, so counter values follow commit order, and the rows
+    # written carry the value in change_id.
+    op.create_table(
+        'catalog_version',
+        sa.Column('id', sa.Boolean(), server_default=sa.text('TRUE'), nullable=False),
+        sa.Column('version', sa.BigInteger(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('id', name='catalog_version_pkey'),
+        sa.CheckConstraint('id', name='catalog_version_single_row'),
+    )
+    op.execute("INSERT INTO catalog_version (id, version) VALUES (TRUE, 0)")
+    op.add_column('movies', sa.Column('change_id', sa.BigInteger(), server_default='0', nullable=False))
+    op.create_index('ix_movies_change_id', 'movies', ['change_id'], unique=False)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+        DECLARE
+            next_version BIGINT;
+        BEGIN
+            UPDATE catalog_version SET version = version + 1 RETURNING version INTO next_version;
+            PERFORM set_config('catalog.change_id', next_version::text, true);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION set_change_id() RETURNS trigger AS $$
+        BEGIN
+            NEW.change_id = current_setting('catalog.change_id')::BIGINT;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER movies_bump_catalog_version
+        BEFORE INSERT OR UPDATE OR DELETE OR TRUNCATE ON movies
+        FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version()
+    """)
+    op.execute("""
+        CREATE TRIGGER movies_set_change_id
+        BEFORE INSERT OR UPDATE ON movies
+        FOR EACH ROW EXECUTE FUNCTION set_change_id()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS movies_set_change_id ON movies")
+    op.execute("DROP TRIGGER IF EXISTS movies_bump_catalog_version ON movies")
+    op.execute("DROP FUNCTION IF EXISTS set_change_id()")
+    op.execute("DROP FUNCTION IF EXISTS bump_catalog_version()")
+    op.drop_index('ix_movies_change_id', table_name='movies')
+    op.drop_column('movies', 'change_id')
+    op.drop_table('catalog_version')
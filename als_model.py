@@ -0,0 +1,287 @@
+"""Implicit-feedback matrix factorisation trained with alternating least squares.
+
+Likes and watch-later marks in user_interactions are treated as implicit
+feedback (Hu, Koren & Volinsky): every observed pair has preference 1 and
+confidence 1 + alpha * strength, every other pair preference 0 and
+confidence 1. Each half-step solves the regularised least-squares problem
+of every user (then every movie) exactly, one block of rows at a time,
+with the blocks spread over a thread pool; the heavy lifting is BLAS
+matrix products and batched np.linalg.solve calls, which release the GIL.
+
+The user and movie factors are stored as a memory-mapped artifact under
+models/als. Serving a user is one (movies x factors) @ (factors,) product
+followed by argpartition. Users unknown to the model, or whose set of
+liked movies changed since training (told apart by a hash of the liked
+ids stored with the factors), are folded in from their liked movies
+with a single factors x factors solve. Watch-later marks only enter the
+trained factors, so a change to them is picked up by the next training
+run (model_rebuilder.py retrains when user_interactions changes).
+
+Usage:
+    python als_model.py --factors 64 --iterations 15 --workers 4
+"""
+import argparse
+import hashlib
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import database
+import model_store
+from scoring import RowIndex, lookup_rows, rank
+
+ALS_MODEL_DIR = os.path.join(model_store.MODEL_DIR, "als")
+
+DEFAULT_FACTORS = 64
+DEFAULT_ITERATIONS = 15
+DEFAULT_REGULARIZATION = 0.1
+DEFAULT_ALPHA = 40.0
+DEFAULT_BLOCK_SIZE = 1024
+# Strength of a watch-later mark relative to a like
+WATCH_LATER_WEIGHT = 0.5
+
+
+def likes_hash(movie_ids):
+    """64-bit hash of a set of liked movie ids, independent of their order"""
+    movie_ids = np.unique(np.asarray(movie_ids, dtype=np.int64))
+    digest = hashlib.blake2b(movie_ids.tobytes(), digest_size=8).digest()
+    return np.uint64(int.from_bytes(digest, "little"))
+
+
+def stream_interactions(itersize=100000):
+    """Yield (user_id, movie_id, strength) for liked or watch-later interactions"""
+    conn = database.connect()
+    try:
+        cur = conn.cursor(name="als_interactions")
+        cur.itersize = itersize
+        cur.execute("""
+            SELECT user_id, movie_id, liked, watch_later
+            FROM user_interactions
+            WHERE liked = TRUE OR watch_later = TRUE
+        """)
+        for user_id, movie_id, liked, watch_later in cur:
+            yield user_id, movie_id, (1.0 if liked else 0.0) + (WATCH_LATER_WEIGHT if watch_later else 0.0)
+        cur.close()
+    finally:
+        conn.close()
+
+
+def interaction_matrix(interactions):
+    """Users x movies CSR of interaction strengths, with its user and movie ids
+
+    Also returns a hash of each user's liked movie ids (likes_hash), used
+    at serving time to tell whether a stored user factor is still current.
+    """
+    users, movies, strengths = [], [], []
+    for user_id, movie_id, strength in interactions:
+        users.append(user_id)
+        movies.append(movie_id)
+        strengths.append(strength)
+    users = np.asarray(users, dtype=np.int64)
+    movies = np.asarray(movies, dtype=np.int64)
+    strengths = np.asarray(strengths, dtype=np.float32)
+
+    from scipy import sparse
+
+    user_ids, user_rows = np.unique(users, return_inverse=True)
+    movie_ids, movie_cols = np.unique(movies, return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (strengths, (user_rows, movie_cols)), shape=(len(user_ids), len(movie_ids))
+    )
+    like_hashes = np.empty(len(user_ids), dtype=np.uint64)
+    for row in range(len(user_ids)):
+        start, stop = matrix.indptr[row], matrix.indptr[row + 1]
+        cols = matrix.indices[start:stop][matrix.data[start:stop] >= 1]
+        like_hashes[row] = likes_hash(movie_ids[cols])
+    return matrix, user_ids, movie_ids, like_hashes
+
+
+def solve_rows(confidence, fixed, gram, regularization, start, stop):
+    """Least-squares factors of rows start..stop given the other side's factors
+
+    confidence holds alpha * strength for the observed pairs (CSR).
+    """
+    n_factors = fixed.shape[1]
+    lhs = np.empty((stop - start, n_factors, n_factors))
+    rhs = np.empty((stop - start, n_factors))
+    base = gram + regularization * np.eye(n_factors)
+    indptr, indices, data = confidence.indptr, confidence.indices, confidence.data
+    for i, row in enumerate(range(start, stop)):
+        cols = indices[indptr[row]:indptr[row + 1]]
+        weights = data[indptr[row]:indptr[row + 1]]
+        factors = fixed[cols]
+        lhs[i] = base + (factors.T * weights) @ factors
+        rhs[i] = factors.T @ (1.0 + weights)
+    return np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+
+
+def als_step(confidence, fixed, regularization, block_size, executor):
+    """Recompute every row's factors with the other side held fixed"""
+    gram = fixed.T @ fixed
+    solved = np.empty((confidence.shape[0], fixed.shape[1]))
+    starts = range(0, confidence.shape[0], block_size)
+
+    def solve_block(start):
+        stop = min(start + block_size, confidence.shape[0])
+        solved[start:stop] = solve_rows(confidence, fixed, gram, regularization, start, stop)
+
+    list(executor.map(solve_block, starts))
+    return solved
+
+
+def factorize(matrix, factors=DEFAULT_FACTORS, iterations=DEFAULT_ITERATIONS,
+              regularization=DEFAULT_REGULARIZATION, alpha=DEFAULT_ALPHA,
+              block_size=DEFAULT_BLOCK_SIZE, workers=1, seed=0):
+    """User and movie factors of a users x movies strength matrix"""
+    from scipy import sparse
+
+    confidence = sparse.csr_matrix(matrix, dtype=np.float64) * alpha
+    confidence_t = confidence.T.tocsr()
+    rng = np.random.default_rng(seed)
+    user_factors = np.zeros((matrix.shape[0], factors))
+    item_factors = rng.normal(scale=0.01, size=(matrix.shape[1], factors))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in range(iterations):
+            user_factors = als_step(confidence, item_factors, regularization, block_size, executor)
+            item_factors = als_step(confidence_t, user_factors, regularization, block_size, executor)
+    return user_factors.astype(np.float32), item_factors.astype(np.float32)
+
+
+def train(interactions, factors=DEFAULT_FACTORS, iterations=DEFAULT_ITERATIONS,
+          regularization=DEFAULT_REGULARIZATION, alpha=DEFAULT_ALPHA,
+          block_size=DEFAULT_BLOCK_SIZE, workers=1, model_dir=ALS_MODEL_DIR):
+    """Factorise the interactions and publish the factors as an artifact"""
+    matrix, user_ids, movie_ids, like_hashes = interaction_matrix(interactions)
+    user_factors, item_factors = factorize(
+        matrix, factors, iterations, regularization, alpha, block_size, workers
+    )
+    arrays = {
+        "movie_ids": movie_ids,
+        "item_factors": item_factors,
+        "user_ids": user_ids,
+        "user_factors": user_factors,
+        "user_like_hashes": like_hashes,
+        "item_gram": item_factors.T.astype(np.float64) @ item_factors.astype(np.float64),
+    }
+    manifest = {
+        "kind": "als",
+        "n_movies": len(movie_ids),
+        "n_users": len(user_ids),
+        "params": {
+            "factors": factors,
+            "iterations": iterations,
+            "regularization": regularization,
+            "alpha": alpha,
+            "watch_later_weight": WATCH_LATER_WEIGHT,
+        },
+    }
+    return model_store.write_artifact(arrays, manifest, root=model_dir)
+
+
+class ALSEngine:
+    """Scores the catalog with a user's latent factor vector
+
+    Exposes the same interface as scoring.ScoringEngine, so it can be
+    blended with the neighbourhood models.
+    """
+
+    def __init__(self, artifact):
+        self.version = artifact.version
+        self.movie_ids = artifact.movie_ids
+        self.row_of = RowIndex(self.movie_ids)
+        self.n_movies = len(self.movie_ids)
+        self.item_factors = artifact.array("item_factors")
+        self.user_ids = artifact.array("user_ids")
+        self.user_factors = artifact.array("user_factors")
+        # Artifacts from before the hashes were stored always fold users in
+        self.user_like_hashes = artifact.array("user_like_hashes") if artifact.has("user_like_hashes") else None
+        self.item_gram = np.asarray(artifact.array("item_gram"))
+        params = artifact.manifest.get("params", {})
+        self.alpha = params.get("alpha", DEFAULT_ALPHA)
+        self.regularization = params.get("regularization", DEFAULT_REGULARIZATION)
+
+    def rows_for(self, movie_ids):
+        return lookup_rows(self.row_of, movie_ids)
+
+    def stored_factor(self, user_id, liked_movie_ids):
+        """The trained factor of a user, if the user's liked movies are unchanged since"""
+        if user_id is None or self.user_like_hashes is None or len(self.user_ids) == 0:
+            return None
+        position = int(np.searchsorted(self.user_ids, user_id))
+        if position == len(self.user_ids) or self.user_ids[position] != user_id:
+            return None
+        if self.user_like_hashes[position] != likes_hash(liked_movie_ids):
+            return None
+        return np.asarray(self.user_factors[position], dtype=np.float64)
+
+    def fold_in(self, rows, weights):
+        """Factor of a user who liked the given movie rows"""
+        factors = np.asarray(self.item_factors[rows], dtype=np.float64)
+        confidence = self.alpha * weights
+        lhs = self.item_gram + (factors.T * confidence) @ factors
+        lhs += self.regularization * np.eye(len(lhs))
+        return np.linalg.solve(lhs, factors.T @ (1.0 + confidence))
+
+    def catalog_scores(self, liked_movie_ids, weights=None, user_id=None):
+        """Predicted preference for every movie, or None if nothing is known"""
+        uniform = weights is None or np.all(np.asarray(weights) == 1)
+        factor = self.stored_factor(user_id, liked_movie_ids) if uniform else None
+        if factor is None:
+            rows, positions = self.rows_for(liked_movie_ids)
+            if len(rows) == 0:
+                return None
+            if weights is None:
+                row_weights = np.ones(len(rows))
+            else:
+                row_weights = np.asarray(weights, dtype=np.float64)[positions]
+            factor = self.fold_in(rows, row_weights)
+        return np.asarray(self.item_factors @ factor.astype(np.float32), dtype=np.float64)
+
+    def score(self, liked_movie_ids, n=10, weights=None, exclude_ids=(), user_id=None):
+        """Top n (movie_id, score) pairs, excluding liked movies and exclude_ids"""
+        scores = self.catalog_scores(liked_movie_ids, weights, user_id)
+        if scores is None:
+            return []
+        return rank(self, scores, liked_movie_ids, n, exclude_ids)
+
+
+def load_engine(model_dir=ALS_MODEL_DIR):
+    return ALSEngine(model_store.load_artifact(model_dir))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the implicit-feedback ALS model")
+    parser.add_argument("--factors", type=int, default=DEFAULT_FACTORS)
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--regularization", type=float, default=DEFAULT_REGULARIZATION)
+    parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA,
+                        help="Confidence gained per unit of interaction strength")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE,
+                        help="Users or movies solved per block")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Threads solving blocks in parallel")
+    parser.add_argument("--model-dir", default=ALS_MODEL_DIR)
+    args = parser.parse_args(argv)
+
+    try:
+        version = train(
+            stream_interactions(),
+            factors=args.factors,
+            iterations=args.iterations,
+            regularization=args.regularization,
+            alpha=args.alpha,
+            block_size=args.block_size,
+            workers=args.workers,
+            model_dir=args.model_dir,
+        )
+    except Exception as e:
+        print(f"Error training ALS model: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Saved ALS model version {version} to '{args.model_dir}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Approximate nearest-neighbour index over the content vectors.
+
+The exact top-K index still compares every movie with every other movie,
+O(N^2). For large catalogs this module builds the same CSR neighbour
+index approximately:
+
+1. TF-IDF rows are projected to a few hundred dimensions with
+   TruncatedSVD and L2-normalised.
+2. The projected vectors are clustered with spherical k-means into
+   n_lists inverted lists (IVF).
+3. Each movie is compared only with the members of the n_probe lists whose
+   centroids are closest to it, keeping its best rerank * K candidates
+   in an N x (rerank * K) shortlist that is merged one list at a time.
+4. The shortlisted pairs are rescored with the exact TF-IDF cosine, one
+   block of rows at a time, and pruned to K.
+
+Memory is O(N * K * rerank) for the shortlist plus one block of pairs.
+
+n_lists and n_probe trade speed for recall; measure_recall() compares a
+sample of rows against the exact index.
+"""
+import numpy as np
+from scipy import sparse
+
+from neighbors import DEFAULT_TOP_K, assemble_index, rows_top_k
+
+DEFAULT_COMPONENTS = 128
+DEFAULT_PROBES = 8
+DEFAULT_RERANK = 4
+DEFAULT_KMEANS_ITERATIONS = 10
+DEFAULT_RECALL_SAMPLE = 500
+
+# Rows assigned to centroids per dense block during clustering
+ASSIGN_BLOCK_ROWS = 65536
+# Rows whose shortlisted pairs are rescored together
+RERANK_BLOCK_ROWS = 4096
+
+
+def default_n_lists(n_rows):
+    """Roughly sqrt(N) lists, the usual IVF starting point"""
+    return max(1, int(np.sqrt(n_rows)))
+
+
+def project(tfidf_matrix, n_components=DEFAULT_COMPONENTS, seed=0):
+    """L2-normalised TruncatedSVD projection of the TF-IDF rows"""
+    from sklearn.decomposition import TruncatedSVD
+
+    n_components = min(n_components, tfidf_matrix.shape[1] - 1, tfidf_matrix.shape[0] - 1)
+    if n_components < 1:
+        vectors = np.asarray(sparse.csr_matrix(tfidf_matrix).toarray(), dtype=np.float32)
+    else:
+        svd = TruncatedSVD(n_components=n_components, random_state=seed)
+        vectors = svd.fit_transform(tfidf_matrix).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def nearest_centroids(vectors, centroids, n=1):
+    """Positions of the n most similar centroids of every vector"""
+    n = min(n, len(centroids))
+    result = np.empty((len(vectors), n), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+        similarities = vectors[start:start + ASSIGN_BLOCK_ROWS] @ centroids.T
+        if n == 1:
+            result[start:start + ASSIGN_BLOCK_ROWS, 0] = similarities.argmax(axis=1)
+        else:
+            result[start:start + ASSIGN_BLOCK_ROWS] = np.argpartition(-similarities, n - 1, axis=1)[:, :n]
+    return result
+
+
+def spherical_kmeans(vectors, n_clusters, iterations=DEFAULT_KMEANS_ITERATIONS, seed=0):
+    """Unit-norm centroids and the cluster of every vector"""
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = nearest_centroids(vectors, centroids)[:, 0]
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        # Empty clusters keep their previous centroid
+        filled = norms[:, 0] > 0
+        centroids[filled] = sums[filled] / norms[filled]
+    return centroids, nearest_centroids(vectors, centroids)[:, 0]
+
+
+def exact_scores(tfidf_matrix, rows, cols):
+    """Cosine similarity of the given row pairs of L2-normalised TF-IDF"""
+    return np.asarray(tfidf_matrix[rows].multiply(tfidf_matrix[cols]).sum(axis=1)).ravel()
+
+
+def shortlist(vectors, centroids, labels, probes, n_candidates):
+    """Best n_candidates members of its probed lists for every row, by projected cosine
+
+    Returns (cols, scores) arrays of shape (N, n_candidates), merged list
+    by list so memory stays O(N * n_candidates); unused slots hold col -1.
+    """
+    n_rows = len(vectors)
+    cand_cols = np.full((n_rows, n_candidates), -1, dtype=np.int64)
+    cand_scores = np.full((n_rows, n_candidates), -np.inf, dtype=np.float32)
+
+    # Members of every list, and the movies probing every list
+    members = np.argsort(labels, kind="stable")
+    member_starts = np.searchsorted(labels[members], np.arange(len(centroids) + 1))
+    probe_rows = np.repeat(np.arange(n_rows), probes.shape[1])
+    probe_lists = probes.ravel()
+    by_list = np.argsort(probe_lists, kind="stable")
+    probe_starts = np.searchsorted(probe_lists[by_list], np.arange(len(centroids) + 1))
+
+    for c in range(len(centroids)):
+        list_members = members[member_starts[c]:member_starts[c + 1]]
+        # A row probes each list at most once, so queries are unique
+        queries = probe_rows[by_list[probe_starts[c]:probe_starts[c + 1]]]
+        if len(list_members) == 0 or len(queries) == 0:
+            continue
+        similarities = vectors[queries] @ vectors[list_members].T
+        similarities[queries[:, None] == list_members[None, :]] = -np.inf
+        keep = min(n_candidates, len(list_members))
+        if keep < len(list_members):
+            cols = np.argpartition(-similarities, keep - 1, axis=1)[:, :keep]
+        else:
+            cols = np.tile(np.arange(len(list_members)), (len(queries), 1))
+        # Lists are disjoint, so merging never sees a candidate twice
+        merged_scores = np.concatenate(
+            [cand_scores[queries], np.take_along_axis(similarities, cols, axis=1)], axis=1
+        )
+        merged_cols = np.concatenate([cand_cols[queries], list_members[cols]], axis=1)
+        best = np.argpartition(-merged_scores, n_candidates - 1, axis=1)[:, :n_candidates]
+        cand_scores[queries] = np.take_along_axis(merged_scores, best, axis=1)
+        cand_cols[queries] = np.take_along_axis(merged_cols, best, axis=1)
+    cand_cols[~np.isfinite(cand_scores)] = -1
+    return cand_cols, cand_scores
+
+
+def rescore(tfidf_matrix, cand_cols, k, block_rows=RERANK_BLOCK_ROWS):
+    """Top-k index of the shortlisted pairs rescored with the exact cosine
+
+    Pairs are scored one block of rows at a time, so at most
+    block_rows * n_candidates of them are materialised at once.
+    """
+    n_rows, n_candidates = cand_cols.shape
+    k = min(k, n_candidates)
+    all_rows, all_cols, all_scores = [], [], []
+    for start in range(0, n_rows, block_rows):
+        cols = cand_cols[start:start + block_rows]
+        rows = np.broadcast_to(np.arange(start, start + len(cols))[:, None], cols.shape)
+        valid = cols >= 0
+        scores = np.full(cols.shape, -np.inf, dtype=np.float32)
+        scores[valid] = exact_scores(tfidf_matrix, rows[valid], cols[valid])
+        if k < n_candidates:
+            best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            rows, cols, scores = (np.take_along_axis(array, best, axis=1) for array in (rows, cols, scores))
+        keep = scores > 0
+        all_rows.append(rows[keep])
+        all_cols.append(cols[keep])
+        all_scores.append(scores[keep])
+    return assemble_index(all_rows, all_cols, all_scores, n_rows)
+
+
+def ann_neighbors(tfidf_matrix, k=DEFAULT_TOP_K, n_components=DEFAULT_COMPONENTS, n_lists=None,
+                  n_probe=DEFAULT_PROBES, rerank=DEFAULT_RERANK, seed=0):
+    """Approximate top-k cosine neighbour index of L2-normalised TF-IDF rows
+
+    Returns a CSR matrix in the same layout as neighbors.top_k_neighbors.
+    """
+    tfidf_matrix = sparse.csr_matrix(tfidf_matrix)
+    n_rows = tfidf_matrix.shape[0]
+    if n_rows < 2:
+        return assemble_index([], [], [], n_rows)
+
+    vectors = project(tfidf_matrix, n_components, seed)
+    centroids, labels = spherical_kmeans(vectors, n_lists or default_n_lists(n_rows), seed=seed)
+    probes = nearest_centroids(vectors, centroids, n_probe)
+    cand_cols, _ = shortlist(vectors, centroids, labels, probes, min(k * rerank, n_rows - 1))
+    return rescore(tfidf_matrix, cand_cols, k)
+
+
+def measure_recall(tfidf_matrix, index, k=DEFAULT_TOP_K, sample=DEFAULT_RECALL_SAMPLE, seed=0):
+    """Share of the exact top-k neighbours of sampled rows found by the index"""
+    tfidf_matrix = sparse.csr_matrix(tfidf_matrix)
+    n_rows = tfidf_matrix.shape[0]
+    rng = np.random.default_rng(seed)
+    sampled = np.sort(rng.choice(n_rows, min(sample, n_rows), replace=False))
+
+    found = expected = 0
+    for rows, cols, _ in rows_top_k(tfidf_matrix, sampled, k):
+        for row in np.unique(rows):
+            exact = set(cols[rows == row].tolist())
+            approx = set(index.indices[index.indptr[row]:index.indptr[row + 1]].tolist())
+            found += len(exact & approx)
+            expected += len(exact)
+    return found / expected if expected else 1.0
@@ -0,0 +1,312 @@
+"""Batch job precomputing recommendations for every user.
+
+Liked movies are streamed from user_interactions with a server-side
+cursor and grouped into chunks of users. With the plain content model
+each chunk is scored with one sparse product, (users x movies) @
+(movies x movies), already-liked movies are dropped and the top N per
+user are bulk-written into the recommendations table with COPY. When
+the serving engine blends in the collaborative or ALS models or scores
+against user profiles (CF_BLEND_WEIGHT, ALS_BLEND_WEIGHT,
+CONTENT_SCORING), each user is scored through that same engine instead,
+so precomputed and live results agree. Chunks are scored in a process
+pool whose workers memory-map the published model artifacts.
+
+A user may like a movie between the read of their likes and the write
+of their rows; server.js then deletes rows the batch has not written
+yet. So after each chunk is committed its users' likes are read again,
+and the rows of users whose likes changed are deleted. A like committed
+after that check makes server.js delete the (by then visible) rows
+itself.
+
+Run with:
+    python get_recommendations.py --batch --workers 4
+"""
+import argparse
+import io
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+import database
+import model_store
+from neighbors import merge_top_k
+from scoring import ScoringEngine, recency_weights
+
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_TOP_N = 10
+
+# Scorer shared with pool workers, loaded once per worker process
+_worker_scorer = None
+
+
+LIKES_ORDER = "ORDER BY user_id, created_at DESC NULLS LAST, id DESC"
+
+
+def stream_liked_movies(conn, chunk_size=DEFAULT_CHUNK_SIZE, itersize=50000):
+    """Yield (user_ids, liked movie id lists) for chunks of users
+
+    Each user's likes are ordered from most to least recent.
+    """
+    cur = conn.cursor(name="batch_liked_movies")
+    cur.itersize = itersize
+    cur.execute(f"""
+        SELECT user_id, movie_id
+        FROM user_interactions
+        WHERE liked = TRUE
+        {LIKES_ORDER}
+    """)
+
+    user_ids, liked = [], []
+    for user_id, movie_id in cur:
+        if not user_ids or user_ids[-1] != user_id:
+            if len(user_ids) == chunk_size:
+                yield user_ids, liked
+                user_ids, liked = [], []
+            user_ids.append(user_id)
+            liked.append([])
+        liked[-1].append(movie_id)
+    if user_ids:
+        yield user_ids, liked
+    cur.close()
+
+
+def user_matrix(model, liked, half_life=None):
+    """Sparse users x movies matrix of (recency-weighted) likes"""
+    counts = [len(movie_ids) for movie_ids in liked]
+    rows = np.repeat(np.arange(len(liked)), counts)
+    cols = model.row_of.find([movie_id for movie_ids in liked for movie_id in movie_ids])
+    weights = np.concatenate([recency_weights(count, half_life) for count in counts] or [np.empty(0)])
+    known = cols >= 0
+    rows, cols, weights = rows[known], cols[known], weights[known]
+    return sparse.csr_matrix(
+        (weights, (rows, cols)), shape=(len(liked), len(model.movie_ids)), dtype=np.float64
+    )
+
+
+def csr_similarity(model):
+    """The model's similarity as a SciPy CSR matrix; a dense one is converted"""
+    similarity = model.similarity
+    if hasattr(similarity, "tocsr"):
+        return similarity.tocsr()
+    return sparse.csr_matrix(similarity)
+
+
+class BatchScorer:
+    """The serving engine of a model directory, prepared for scoring chunks
+
+    similarity is only set when the engine is the plain content model,
+    which is scored with one sparse product per chunk.
+    """
+
+    def __init__(self, model, engine):
+        self.model = model
+        self.engine = engine
+        self.similarity = csr_similarity(model) if type(engine) is ScoringEngine else None
+
+    @classmethod
+    def load(cls, model_dir=model_store.MODEL_DIR):
+        from get_recommendations import build_engine
+
+        model = model_store.load_artifact(model_dir).similarity_model()
+        return cls(model, build_engine(model, model_dir=model_dir))
+
+    def score_chunk(self, user_ids, liked, n=DEFAULT_TOP_N, half_life=None):
+        if self.similarity is not None:
+            return score_chunk(self.model, user_ids, liked, n, half_life, self.similarity)
+        return score_chunk_with_engine(self.engine, user_ids, liked, n, half_life)
+
+
+def score_chunk_with_engine(engine, user_ids, liked, n=DEFAULT_TOP_N, half_life=None):
+    """Top-n (user_id, rank, movie_id, score) rows, scoring one user at a time"""
+    out_users, ranks, movie_ids, scores = [], [], [], []
+    for user_id, liked_ids in zip(user_ids, liked):
+        weights = recency_weights(len(liked_ids), half_life)
+        scored = engine.score(liked_ids, n=n, weights=weights, user_id=int(user_id))
+        for rank, (movie_id, score) in enumerate(scored, start=1):
+            out_users.append(user_id)
+            ranks.append(rank)
+            movie_ids.append(movie_id)
+            scores.append(score)
+    return (
+        np.asarray(out_users, dtype=np.int64),
+        np.asarray(ranks, dtype=np.int64),
+        np.asarray(movie_ids, dtype=np.int64),
+        np.asarray(scores, dtype=np.float64),
+    )
+
+
+def score_chunk(model, user_ids, liked, n=DEFAULT_TOP_N, half_life=None, similarity=None):
+    """Top-n (user_id, rank, movie_id, score) rows for a chunk of users
+
+    similarity is the model's CSR similarity, when already converted.
+    """
+    users = user_matrix(model, liked, half_life)
+    if similarity is None:
+        similarity = csr_similarity(model)
+    scores = (users @ similarity).tocsr()
+
+    # Drop already-liked movies and non-positive scores
+    scores = scores - scores.multiply(users.astype(bool))
+    scores.data[scores.data <= 0] = 0
+    scores.eliminate_zeros()
+
+    coo = scores.tocoo()
+    rows, cols, values = merge_top_k(coo.row, coo.col, coo.data * model.scale, n)
+    ranks = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    return (
+        np.asarray(user_ids, dtype=np.int64)[rows],
+        ranks + 1,
+        np.asarray(model.movie_ids, dtype=np.int64)[cols],
+        values,
+    )
+
+
+def _init_worker(model_dir):
+    global _worker_scorer
+    _worker_scorer = BatchScorer.load(model_dir)
+
+
+def _worker_chunk(task):
+    user_ids, liked, n, half_life = task
+    return _worker_scorer.score_chunk(user_ids, liked, n, half_life)
+
+
+def current_likes(cur, user_ids):
+    """Liked movie ids of each user as stream_liked_movies reads them"""
+    cur.execute(f"""
+        SELECT user_id, movie_id
+        FROM user_interactions
+        WHERE liked = TRUE AND user_id = ANY(%s)
+        {LIKES_ORDER}
+    """, [[int(user_id) for user_id in user_ids]])
+    liked = {int(user_id): [] for user_id in user_ids}
+    for user_id, movie_id in cur.fetchall():
+        liked[user_id].append(movie_id)
+    return liked
+
+
+def changed_users(cur, user_ids, liked):
+    """Users whose likes no longer match the ones their rows were scored from"""
+    current = current_likes(cur, user_ids)
+    return sorted(
+        int(user_id) for user_id, movie_ids in zip(user_ids, liked)
+        if current[int(user_id)] != list(movie_ids)
+    )
+
+
+def write_chunk(conn, result, model_version, user_ids, liked):
+    """Replace the stored recommendations of a chunk's users
+
+    liked holds the like lists the chunk was scored from; rows of users
+    whose likes changed meanwhile are deleted again. Returns the number
+    of rows kept.
+    """
+    result_users, ranks, movie_ids, scores = result
+    buffer = io.StringIO()
+    for user_id, rank, movie_id, score in zip(result_users, ranks, movie_ids, scores):
+        buffer.write(f"{user_id},{rank},{movie_id},{score:.6f},{model_version}\n")
+    buffer.seek(0)
+
+    with conn.cursor() as cur:
+        cur.execute(
+            "DELETE FROM recommendations WHERE user_id = ANY(%s)",
+            [sorted(set(int(u) for u in result_users))],
+        )
+        cur.copy_expert(
+            "COPY recommendations (user_id, rank, movie_id, score, model_version) "
+            "FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    conn.commit()
+
+    # Checked after the commit, so server.js sees the rows of later likes
+    with conn.cursor() as cur:
+        changed = changed_users(cur, user_ids, liked)
+        if changed:
+            cur.execute("DELETE FROM recommendations WHERE user_id = ANY(%s)", [changed])
+    conn.commit()
+    return len(result_users) - int(np.isin(result_users, changed).sum())
+
+
+def run_batch(model_dir=model_store.MODEL_DIR, chunk_size=DEFAULT_CHUNK_SIZE, workers=1,
+              n=DEFAULT_TOP_N, half_life=None):
+    """Recompute and store recommendations for all users with likes"""
+    model_version = model_store.current_version(model_dir)
+    if model_version is None:
+        raise FileNotFoundError(f"No model artifact published in '{model_dir}'")
+
+    read_conn = database.connect()
+    write_conn = database.connect()
+    try:
+        with write_conn.cursor() as cur:
+            cur.execute("SELECT CURRENT_TIMESTAMP")
+            started_at = cur.fetchone()[0]
+        write_conn.commit()
+
+        tasks = (
+            (user_ids, liked, n, half_life)
+            for user_ids, liked in stream_liked_movies(read_conn, chunk_size)
+        )
+        n_users = n_rows = 0
+        if workers > 1:
+            with ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker, initargs=(model_dir,)
+            ) as executor:
+                # Submit a bounded window of chunks so memory stays flat
+                pending = []
+                for task in tasks:
+                    pending.append((task, executor.submit(_worker_chunk, task)))
+                    n_users += len(task[0])
+                    if len(pending) >= 2 * workers:
+                        (user_ids, liked, _, _), future = pending.pop(0)
+                        n_rows += write_chunk(write_conn, future.result(), model_version, user_ids, liked)
+                for (user_ids, liked, _, _), future in pending:
+                    n_rows += write_chunk(write_conn, future.result(), model_version, user_ids, liked)
+        else:
+            scorer = BatchScorer.load(model_dir)
+            for user_ids, liked, _, _ in tasks:
+                result = scorer.score_chunk(user_ids, liked, n, half_life)
+                n_rows += write_chunk(write_conn, result, model_version, user_ids, liked)
+                n_users += len(user_ids)
+
+        # Users who no longer like anything keep no stale recommendations
+        with write_conn.cursor() as cur:
+            cur.execute("DELETE FROM recommendations WHERE computed_at < %s", [started_at])
+        write_conn.commit()
+        return n_users, n_rows
+    finally:
+        read_conn.close()
+        write_conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Precompute recommendations for all users")
+    parser.add_argument("--model-dir", default=model_store.MODEL_DIR)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Users scored per sparse product")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Processes scoring user chunks")
+    parser.add_argument("--top-n", type=int, default=DEFAULT_TOP_N)
+    args = parser.parse_args(argv)
+
+    from get_recommendations import RECENCY_HALF_LIFE
+
+    try:
+        n_users, n_rows = run_batch(
+            model_dir=args.model_dir,
+            chunk_size=args.chunk_size,
+            workers=args.workers,
+            n=args.top_n,
+            half_life=RECENCY_HALF_LIFE,
+        )
+    except Exception as e:
+        print(f"Error in batch recommendations: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Stored {n_rows} recommendations for {n_users} users")
+
+
+if __name__ == "__main__":
+    main()
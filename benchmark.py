@@ -0,0 +1,403 @@
+"""Benchmarks for training and serving on synthetic data.
+
+Generates a synthetic catalog (Zipf-distributed words grouped in topics)
+and an interaction log with skewed movie popularity and user activity,
+then measures for every catalog size:
+
+    train           wall time, peak RSS and artifact size of train_model.train
+    cold_start      time for a fresh interpreter to import the serving code,
+                    open the artifact and return a first recommendation
+    latency         p50/p95/p99 of ScoringEngine.score over sampled users
+    throughput      recommendations per second with --threads threads
+
+Everything runs locally against in-memory data; no database is needed.
+Results are written as JSON; --compare exits non-zero when a run is
+slower or larger than a previous one by more than --tolerance.
+
+--startup-budget checks the serving entry points on their own: a fresh
+interpreter must import them within the budget and without loading any
+of the training-only libraries (pandas, scikit-learn, SciPy).
+
+Usage:
+    python benchmark.py --sizes 10000 100000 --output bench.json
+    python benchmark.py --sizes 10000 --compare bench.json
+    python benchmark.py --startup-only --startup-budget 0.5
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import multiprocessing
+import numpy as np
+
+from neighbors import DEFAULT_TOP_K
+
+DEFAULT_SIZES = [10000]
+DEFAULT_USERS = 5000
+DEFAULT_LIKES_PER_USER = 20
+DEFAULT_REQUESTS = 1000
+DEFAULT_TOLERANCE = 0.2
+
+# Entry points the backend starts per request or as the service, and the
+# libraries only training needs, which must not be imported by them
+SERVING_MODULES = ("get_recommendations", "recommendation_service")
+TRAINING_ONLY_MODULES = ("pandas", "sklearn", "scipy")
+DEFAULT_STARTUP_REPEATS = 5
+
+GENRES = ["Action", "Adventure", "Animation", "Comedy", "Crime", "Documentary", "Drama",
+          "Fantasy", "Horror", "Mystery", "Romance", "Sci-Fi", "Thriller", "Western"]
+
+# Metrics where a higher value is a regression, and where a lower one is
+LOWER_IS_BETTER = ("train_seconds", "train_peak_rss_mb", "artifact_mb", "cold_start_seconds",
+                   "latency_p50_ms", "latency_p95_ms", "latency_p99_ms")
+HIGHER_IS_BETTER = ("throughput_rps",)
+
+
+def synthetic_catalog(n_movies, vocabulary_size=20000, n_topics=200, words_per_movie=30, seed=0):
+    """DataFrame of movies shaped like the movies table
+
+    Each movie draws its description from one topic; word frequencies
+    within a topic follow a Zipf law, so similarities are realistically
+    skewed rather than uniform.
+    """
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    topic_words = rng.integers(0, vocabulary_size, size=(n_topics, 500))
+    word_rank = np.minimum(rng.zipf(1.3, size=(n_movies, words_per_movie)), 500) - 1
+    topics = rng.integers(0, n_topics, size=n_movies)
+    words = topic_words[topics[:, None], word_rank]
+    descriptions = [" ".join(f"w{word}" for word in row) for row in words]
+
+    return pd.DataFrame({
+        "id": np.arange(1, n_movies + 1),
+        "title": [f"Movie {i}" for i in range(1, n_movies + 1)],
+        "description": descriptions,
+        "genre": [GENRES[g] for g in rng.integers(0, len(GENRES), size=n_movies)],
+        "rating": rng.integers(1, 11, size=n_movies),
+        "release_year": rng.integers(1950, 2025, size=n_movies),
+        "poster_url": "https://via.placeholder.com/500x750.png",
+    })
+
+
+def synthetic_interactions(n_users, n_movies, likes_per_user=DEFAULT_LIKES_PER_USER, seed=0):
+    """(user_ids, movie_ids) of likes with Zipf movie popularity and lognormal user activity
+
+    Each user likes a movie at most once, most recent like first.
+    """
+    rng = np.random.default_rng(seed)
+    activity = np.maximum(1, rng.lognormal(np.log(likes_per_user), 1.0, size=n_users).astype(np.int64))
+    activity = np.minimum(activity, n_movies)
+    # Popularity rank r is liked with probability proportional to 1 / r
+    popularity = 1.0 / np.arange(1, n_movies + 1)
+    popularity /= popularity.sum()
+    movie_of_rank = rng.permutation(n_movies) + 1
+
+    users, movies = [], []
+    for user, n_likes in enumerate(activity, start=1):
+        ranks = rng.choice(n_movies, size=n_likes * 2, p=popularity)
+        liked = movie_of_rank[np.unique(ranks)[:n_likes]]
+        rng.shuffle(liked)
+        users.append(np.full(len(liked), user))
+        movies.append(liked)
+    return np.concatenate(users), np.concatenate(movies)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def directory_mb(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+    return total / 1024 / 1024
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000) if len(samples) else 0.0
+
+
+def _train_stage(catalog_path, model_dir, options):
+    """Run in a fresh process so peak RSS covers training only"""
+    import contextlib
+    import io
+
+    import pandas as pd
+    from train_model import train
+
+    movies = pd.read_pickle(catalog_path)
+    baseline_rss = peak_rss_mb()
+    start = time.perf_counter()
+    # train() prints progress; keep the benchmark output machine-readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        version = train(movies, model_dir=model_dir, **options)
+    seconds = time.perf_counter() - start
+    return {
+        "train_seconds": seconds,
+        "train_peak_rss_mb": peak_rss_mb(),
+        "train_baseline_rss_mb": baseline_rss,
+        "version": version,
+    }
+
+
+# Run with "python -c" so the timings include every import of the serving path
+COLD_START_PROBE = """
+import time
+start = time.perf_counter()
+import json, resource, sys
+import model_store
+from scoring import ScoringEngine
+imported = time.perf_counter()
+engine = ScoringEngine(model_store.load_artifact(sys.argv[1]).similarity_model())
+loaded = time.perf_counter()
+engine.score([int(m) for m in sys.argv[2].split(",") if m], n=10)
+scored = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "load_seconds": loaded - imported,
+    "first_score_seconds": scored - loaded,
+    "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+
+def measure_cold_start(model_dir, liked_movie_ids):
+    """Wall time of a fresh interpreter serving its first recommendation"""
+    command = [sys.executable, "-c", COLD_START_PROBE, model_dir,
+               ",".join(str(int(m)) for m in liked_movie_ids)]
+    start = time.perf_counter()
+    output = subprocess.run(command, check=True, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    seconds = time.perf_counter() - start
+    probe = json.loads(output.strip().splitlines()[-1])
+    return {
+        "cold_start_seconds": seconds,
+        "cold_start_import_seconds": probe["import_seconds"],
+        "cold_start_load_seconds": probe["load_seconds"],
+        "cold_start_first_score_seconds": probe["first_score_seconds"],
+        "serving_peak_rss_mb": probe["peak_rss_kb"] / (1024 * 1024 if sys.platform == "darwin" else 1024),
+    }
+
+
+STARTUP_PROBE = """
+import time
+start = time.perf_counter()
+import importlib, json, sys
+for name in sys.argv[1].split(","):
+    importlib.import_module(name)
+seconds = time.perf_counter() - start
+print(json.dumps({
+    "import_seconds": seconds,
+    "modules": sorted({name.split(".")[0] for name in sys.modules}),
+}))
+"""
+
+
+def measure_startup(modules=SERVING_MODULES, repeats=DEFAULT_STARTUP_REPEATS):
+    """Best-of-repeats time for a fresh interpreter to import the serving modules
+
+    Also lists the training-only libraries that the import pulled in.
+    """
+    command = [sys.executable, "-c", STARTUP_PROBE, ",".join(modules)]
+    timings, loaded = [], set()
+    for _ in range(repeats):
+        output = subprocess.run(command, check=True, capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        probe = json.loads(output.strip().splitlines()[-1])
+        timings.append(probe["import_seconds"])
+        loaded |= set(probe["modules"]) & set(TRAINING_ONLY_MODULES)
+    return {
+        "startup_import_seconds": min(timings),
+        "startup_training_modules": sorted(loaded),
+    }
+
+
+def check_startup(result, budget_seconds):
+    """Reasons the serving startup misses its budget, if any"""
+    problems = []
+    if result["startup_import_seconds"] > budget_seconds:
+        problems.append(f"importing {', '.join(SERVING_MODULES)} took "
+                        f"{result['startup_import_seconds']:.3f}s (budget {budget_seconds:.3f}s)")
+    if result["startup_training_modules"]:
+        problems.append(f"serving imports {', '.join(result['startup_training_modules'])}")
+    return problems
+
+
+def measure_serving(model_dir, user_ids, movie_ids, n_requests, threads, seed=0):
+    """Latency percentiles and throughput of scoring sampled users' likes"""
+    import model_store
+    from scoring import ScoringEngine
+
+    engine = ScoringEngine(model_store.load_artifact(model_dir).similarity_model())
+    starts = np.flatnonzero(np.r_[True, user_ids[1:] != user_ids[:-1]])
+    stops = np.r_[starts[1:], len(user_ids)]
+    rng = np.random.default_rng(seed)
+    picks = rng.integers(0, len(starts), size=n_requests)
+    requests = [movie_ids[starts[p]:stops[p]].tolist() for p in picks]
+
+    def timed(liked):
+        start = time.perf_counter()
+        engine.score(liked, n=10)
+        return time.perf_counter() - start
+
+    # Warm the page cache so latency reflects steady-state serving
+    for liked in requests[:10]:
+        engine.score(liked, n=10)
+    latencies = np.array([timed(liked) for liked in requests])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(timed, requests))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "latency_p50_ms": percentile_ms(latencies, 50),
+        "latency_p95_ms": percentile_ms(latencies, 95),
+        "latency_p99_ms": percentile_ms(latencies, 99),
+        "latency_mean_ms": float(latencies.mean() * 1000),
+        "throughput_rps": len(requests) / elapsed if elapsed else 0.0,
+        "mean_likes_per_request": float(np.mean([len(liked) for liked in requests])),
+    }
+
+
+def run_size(n_movies, args, work_dir):
+    """All measurements for one catalog size"""
+    catalog = synthetic_catalog(n_movies, seed=args.seed)
+    catalog_path = os.path.join(work_dir, f"catalog_{n_movies}.pkl")
+    catalog.to_pickle(catalog_path)
+    user_ids, movie_ids = synthetic_interactions(args.users, n_movies, args.likes_per_user, args.seed)
+    del catalog
+
+    model_dir = os.path.join(work_dir, f"model_{n_movies}")
+    options = {
+        "top_k": args.top_k,
+        "workers": args.workers,
+        "neighbors": args.neighbors,
+        "precision": args.precision,
+        "recall_sample": 0,
+    }
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        result = executor.submit(_train_stage, catalog_path, model_dir, options).result()
+
+    result.update(n_movies=n_movies, n_users=args.users, n_likes=len(user_ids))
+    result["artifact_mb"] = directory_mb(model_dir)
+    result.update(measure_cold_start(model_dir, movie_ids[:args.likes_per_user]))
+    result.update(measure_serving(model_dir, user_ids, movie_ids, args.requests, args.threads, args.seed))
+    return result
+
+
+def environment():
+    """Description of the machine and code a run was made on"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(current, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Regressions of current against baseline, as readable messages"""
+    previous = {result["n_movies"]: result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        before = previous.get(result["n_movies"])
+        if before is None:
+            continue
+        for metric in LOWER_IS_BETTER + HIGHER_IS_BETTER:
+            if metric not in result or not before.get(metric):
+                continue
+            ratio = result[metric] / before[metric]
+            worse = ratio > 1 + tolerance if metric in LOWER_IS_BETTER else ratio < 1 - tolerance
+            status = "REGRESSION" if worse else "ok"
+            print(f"{result['n_movies']:>9} {metric:<22} {before[metric]:>12.3f} -> "
+                  f"{result[metric]:>12.3f} ({ratio - 1:+.1%}) {status}", file=sys.stderr)
+            if worse:
+                regressions.append(f"{metric} at {result['n_movies']} movies: {ratio - 1:+.1%}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark training and serving on synthetic data")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Catalog sizes to benchmark")
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS)
+    parser.add_argument("--likes-per-user", type=int, default=DEFAULT_LIKES_PER_USER,
+                        help="Median likes per user")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument("--neighbors", choices=["exact", "ann"], default="exact")
+    parser.add_argument("--precision", default="float32")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Processes used by training")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS,
+                        help="Recommendations timed per catalog size")
+    parser.add_argument("--threads", type=int, default=4,
+                        help="Concurrent requests in the throughput measurement")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", help="Keep catalogs and models here instead of a temporary directory")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare with an earlier results file")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed relative slowdown before --compare fails")
+    parser.add_argument("--startup-budget", type=float, metavar="SECONDS",
+                        help="Fail if importing the serving entry points takes longer "
+                             "or loads pandas, scikit-learn or SciPy")
+    parser.add_argument("--startup-repeats", type=int, default=DEFAULT_STARTUP_REPEATS,
+                        help="Fresh interpreters timed for the startup check; the fastest counts")
+    parser.add_argument("--startup-only", action="store_true",
+                        help="Only measure serving startup, skip training and serving benchmarks")
+    args = parser.parse_args(argv)
+
+    results = []
+    if not args.startup_only:
+        with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+            for n_movies in args.sizes:
+                print(f"Benchmarking {n_movies} movies...", file=sys.stderr)
+                results.append(run_size(n_movies, args, work_dir))
+    startup = measure_startup(repeats=args.startup_repeats)
+
+    report = {"environment": environment(), "params": {
+        key: value for key, value in vars(args).items()
+        if key not in ("output", "compare", "work_dir")
+    }, "startup": startup, "results": results}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            print("Regressions: " + "; ".join(regressions), file=sys.stderr)
+            sys.exit(1)
+
+    if args.startup_budget is not None:
+        problems = check_startup(startup, args.startup_budget)
+        if problems:
+            print("Startup budget exceeded: " + "; ".join(problems), file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
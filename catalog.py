@@ -0,0 +1,315 @@
+"""Columnar snapshot of the movies table.
+
+Serving needs the catalog only to turn ~10 recommended ids into response
+rows, so instead of reading the whole table per request the catalog is
+kept as a snapshot: one array per column, with text columns stored as a
+UTF-8 blob plus offsets so a snapshot saved to disk can be memory-mapped
+and only the requested rows are ever decoded.
+
+A snapshot remembers the table's state when it was taken (row count,
+max(id) and the catalog_version counter, which every statement writing
+movies bumps in commit order and stamps on the rows it writes as
+change_id). refresh() compares that with the database with one query
+and, when it differs, fetches only the rows with a newer change_id and
+drops deleted ids.
+
+    data/catalog/
+        state.json                      state the snapshot reflects
+        ids.npy                         movie ids, ascending
+        rating.npy, release_year.npy    numeric columns
+        title_data.npy, title_offsets.npy, ...
+                                        text columns
+        <column>_null.npy               NULL mask, when a column has NULLs
+"""
+import json
+import os
+import shutil
+
+import numpy as np
+
+import database
+
+CATALOG_DIR = os.environ.get("CATALOG_DIR", os.path.join("data", "catalog"))
+
+COLUMNS = ["id", "title", "description", "genre", "rating", "release_year", "poster_url"]
+TEXT_COLUMNS = ["title", "description", "genre", "poster_url"]
+NUMERIC_COLUMNS = ["rating", "release_year"]
+
+def table_state(cur):
+    """Cheap fingerprint of the movies table: count, max(id) and catalog version"""
+    database.execute(cur, "catalog_state")
+    count, max_id, change_id = cur.fetchone()
+    return {
+        "count": int(count),
+        "max_id": int(max_id) if max_id is not None else None,
+        # None where no trigger maintains the counter (SQLite)
+        "change_id": int(change_id) if change_id is not None else None,
+    }
+
+
+def _encode_text(values):
+    """UTF-8 blob, offsets and NULL mask of a text column"""
+    nulls = np.array([value is None for value in values], dtype=bool)
+    encoded = [b"" if value is None else str(value).encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return data, offsets, nulls
+
+
+def _encode_numeric(values):
+    nulls = np.array([value is None for value in values], dtype=bool)
+    return np.array([0 if value is None else int(value) for value in values], dtype=np.int64), nulls
+
+
+def _patched_nulls(nulls, n_rows, positions, values):
+    """NULL mask with the given rows replaced, or None if nothing is NULL"""
+    new_nulls = np.array([value is None for value in values], dtype=bool)
+    if nulls is None and not new_nulls.any():
+        return None
+    patched = np.zeros(n_rows, dtype=bool) if nulls is None else np.array(nulls)
+    patched[positions] = new_nulls
+    return patched if patched.any() else None
+
+
+def _patch_text(data, offsets, positions, values):
+    """Blob and offsets of a text column with the rows at (sorted) positions replaced
+
+    Only the replaced values are encoded; the rest of the blob is copied
+    over in slices.
+    """
+    encoded = [b"" if value is None else str(value).encode("utf-8") for value in values]
+    lengths = np.diff(offsets)
+    lengths[positions] = [len(value) for value in encoded]
+    new_offsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+
+    pieces, start = [], 0
+    for position, value in zip(positions, encoded):
+        pieces.append(data[offsets[start]:offsets[position]])
+        pieces.append(np.frombuffer(value, dtype=np.uint8))
+        start = position + 1
+    pieces.append(data[offsets[start]:offsets[-1]])
+    return np.concatenate(pieces), new_offsets
+
+
+class CatalogSnapshot:
+    """Read-only columnar copy of the movies table"""
+
+    def __init__(self, arrays, state=None):
+        self.arrays = arrays
+        self.state = state or {}
+        self.ids = arrays["ids"]
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def empty(self):
+        return len(self.ids) == 0
+
+    @classmethod
+    def from_rows(cls, rows, state=None):
+        """Snapshot of (id, title, description, genre, rating, release_year, poster_url) rows"""
+        rows = sorted(rows, key=lambda row: row[0])
+        columns = list(zip(*rows)) if rows else [[] for _ in COLUMNS]
+        values = dict(zip(COLUMNS, columns))
+        arrays = {"ids": np.array(values["id"], dtype=np.int64)}
+        for name in TEXT_COLUMNS:
+            arrays[f"{name}_data"], arrays[f"{name}_offsets"], nulls = _encode_text(values[name])
+            if nulls.any():
+                arrays[f"{name}_null"] = nulls
+        for name in NUMERIC_COLUMNS:
+            arrays[name], nulls = _encode_numeric(values[name])
+            if nulls.any():
+                arrays[f"{name}_null"] = nulls
+        return cls(arrays, state)
+
+    @classmethod
+    def load(cls, path=CATALOG_DIR):
+        """Open a saved snapshot with every column memory-mapped"""
+        with open(os.path.join(path, "state.json"), encoding="utf-8") as f:
+            state = json.load(f)
+        arrays = {}
+        for name in os.listdir(path):
+            if name.endswith(".npy"):
+                arrays[name[:-4]] = np.load(os.path.join(path, name), mmap_mode="r")
+        return cls(arrays, state)
+
+    def save(self, path=CATALOG_DIR):
+        """Write the snapshot, replacing any previous one at path"""
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        tmp_dir = f"{path}.tmp-{os.getpid()}"
+        os.makedirs(tmp_dir)
+        try:
+            for name, array in self.arrays.items():
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(array))
+            with open(os.path.join(tmp_dir, "state.json"), "w", encoding="utf-8") as f:
+                json.dump(self.state, f)
+            old_dir = f"{path}.old-{os.getpid()}"
+            if os.path.exists(path):
+                os.rename(path, old_dir)
+            os.rename(tmp_dir, path)
+            shutil.rmtree(old_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+    def _value(self, name, row):
+        nulls = self.arrays.get(f"{name}_null")
+        if nulls is not None and nulls[row]:
+            return None
+        if name in NUMERIC_COLUMNS:
+            return int(self.arrays[name][row])
+        offsets = self.arrays[f"{name}_offsets"]
+        return bytes(self.arrays[f"{name}_data"][offsets[row]:offsets[row + 1]]).decode("utf-8")
+
+    def rows_of(self, movie_ids):
+        """Snapshot rows of the given ids, in order; unknown ids are dropped"""
+        movie_ids = np.asarray(movie_ids, dtype=np.int64).reshape(-1)
+        if self.empty or not len(movie_ids):
+            return np.empty(0, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, movie_ids), len(self.ids) - 1)
+        return positions[self.ids[positions] == movie_ids]
+
+    def records(self, movie_ids):
+        """Full movie details for the given ids, in the given order"""
+        return [
+            {"id": int(self.ids[row]), **{name: self._value(name, row) for name in COLUMNS[1:]}}
+            for row in self.rows_of(movie_ids)
+        ]
+
+    def column(self, name):
+        """All values of a column, as Python objects"""
+        if name == "id":
+            return [int(movie_id) for movie_id in self.ids]
+        return [self._value(name, row) for row in range(len(self.ids))]
+
+    def rows(self):
+        return list(zip(*(self.column(name) for name in COLUMNS)))
+
+    def row_hashes(self, columns=("title", "genre", "description")):
+        """Same content hashes as model_store.row_hashes on the equivalent DataFrame"""
+        from model_store import hash_rows
+
+        values = zip(*(["" if value is None else str(value) for value in self.column(name)]
+                       for name in columns))
+        return hash_rows(values, len(self))
+
+    def to_frame(self):
+        """The catalog as a DataFrame, for the training code paths"""
+        import pandas as pd
+
+        return pd.DataFrame(self.rows(), columns=COLUMNS)
+
+    def apply(self, changed_rows, live_ids=None, state=None):
+        """New snapshot with changed_rows upserted and ids not in live_ids removed
+
+        When every changed row is already in the snapshot and nothing was
+        removed, the rows are patched in place by position; only inserts
+        and deletes rebuild the snapshot from all rows.
+        """
+        changed = {row[0]: row for row in changed_rows}
+        if not changed and live_ids is None:
+            return CatalogSnapshot(self.arrays, state)
+        ids = np.array(sorted(changed), dtype=np.int64)
+        positions = self.rows_of(ids)
+        removed = live_ids is not None and len(np.setdiff1d(self.ids, np.asarray(live_ids, dtype=np.int64))) > 0
+        if len(positions) == len(ids) and not removed:
+            return self._patched(positions, [changed[movie_id] for movie_id in ids.tolist()], state)
+
+        keep = [row for row in self.rows() if row[0] not in changed]
+        if live_ids is not None:
+            live = set(live_ids)
+            keep = [row for row in keep if row[0] in live]
+        return CatalogSnapshot.from_rows(keep + list(changed.values()), state)
+
+    def _patched(self, positions, rows, state):
+        """New snapshot with the rows at (sorted) positions replaced; ids are unchanged"""
+        values = dict(zip(COLUMNS, zip(*rows))) if rows else {name: () for name in COLUMNS}
+        arrays = dict(self.arrays)
+        for name in TEXT_COLUMNS:
+            arrays[f"{name}_data"], arrays[f"{name}_offsets"] = _patch_text(
+                self.arrays[f"{name}_data"], self.arrays[f"{name}_offsets"], positions, values[name]
+            )
+        for name in NUMERIC_COLUMNS:
+            column = np.array(self.arrays[name])
+            column[positions] = [0 if value is None else int(value) for value in values[name]]
+            arrays[name] = column
+        for name in TEXT_COLUMNS + NUMERIC_COLUMNS:
+            nulls = _patched_nulls(self.arrays.get(f"{name}_null"), len(self.ids), positions, values[name])
+            arrays.pop(f"{name}_null", None)
+            if nulls is not None:
+                arrays[f"{name}_null"] = nulls
+        return CatalogSnapshot(arrays, state)
+
+
+def fetch_all(cur):
+    cur.execute(f"SELECT {', '.join(COLUMNS)} FROM movies ORDER BY id")
+    return cur.fetchall()
+
+
+def refresh(snapshot, cur):
+    """Bring a snapshot up to date with the movies table
+
+    Returns the (possibly unchanged) snapshot and the ids that were
+    added, updated or removed. With no snapshot the whole table is read.
+    """
+    state = table_state(cur)
+    if snapshot is not None and snapshot.state == state:
+        return snapshot, []
+    if snapshot is None or snapshot.empty or snapshot.state.get("change_id") is None:
+        fresh = CatalogSnapshot.from_rows(fetch_all(cur), state)
+        previous = set(snapshot.ids.tolist()) if snapshot is not None else set()
+        return fresh, sorted(previous | set(fresh.ids.tolist()))
+
+    cur.execute(
+        f"SELECT {', '.join(COLUMNS)} FROM movies WHERE change_id > %s OR id > %s ORDER BY id",
+        [snapshot.state["change_id"], snapshot.state.get("max_id") or 0],
+    )
+    changed_rows = cur.fetchall()
+    known = set(snapshot.ids.tolist())
+    new_ids = {row[0] for row in changed_rows} - known
+    live_ids = None
+    if len(known) + len(new_ids) != state["count"]:
+        # Some movies were deleted; an id-only scan finds which
+        cur.execute("SELECT id FROM movies")
+        live_ids = [row[0] for row in cur.fetchall()]
+
+    updated = snapshot.apply(changed_rows, live_ids, state)
+    changed_ids = {row[0] for row in changed_rows}
+    if live_ids is not None:
+        changed_ids |= known - set(live_ids)
+    # Refetched rows whose content is identical are not changes
+    unchanged = {
+        row[0] for row in changed_rows
+        if row[0] in known and snapshot.records([row[0]]) == updated.records([row[0]])
+    }
+    return updated, sorted(changed_ids - unchanged)
+
+
+def sync_catalog(conn, snapshot=None, path=CATALOG_DIR):
+    """Refresh snapshot (the one saved at path if None) and save it if it changed
+
+    Returns the up-to-date snapshot and the ids that changed.
+    """
+    if snapshot is None:
+        try:
+            snapshot = CatalogSnapshot.load(path)
+        except (FileNotFoundError, ValueError):
+            pass
+    with conn.cursor() as cur:
+        updated, changed = refresh(snapshot, cur)
+    if updated is not snapshot and path:
+        try:
+            updated.save(path)
+        except OSError:
+            # A read-only deployment still serves from the fresh snapshot
+            pass
+    return updated, changed
+
+
+def load_catalog(conn, path=CATALOG_DIR):
+    """The saved snapshot, refreshed against the database"""
+    return sync_catalog(conn, path=path)[0]
@@ -0,0 +1,185 @@
+"""Item-item collaborative filtering model.
+
+Built from liked movies in user_interactions and, optionally, MovieLens
+ratings (a rating at or above the like threshold counts as a like). Two
+movies are similar when the same users like both:
+
+    similarity(i, j) = co_likes(i, j) / sqrt(likes(i) * likes(j))
+
+computed as a sparse (movies x users) @ (users x movies) product in row
+blocks of movies, each block pruned to its top K before the next one, so
+memory is bounded by the block size. The result is stored as a neighbour
+index artifact under models/item_cf and scored by the same ScoringEngine
+as the content model; CF_BLEND_WEIGHT blends the two at serving time.
+
+Usage:
+    python collaborative.py
+    python collaborative.py --ratings data/ml-25m
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from scipy import sparse
+
+import database
+import model_store
+from neighbors import DEFAULT_TOP_K, assemble_index, merge_top_k
+
+CF_MODEL_DIR = os.path.join(model_store.MODEL_DIR, "item_cf")
+
+DEFAULT_MIN_SUPPORT = 2
+DEFAULT_BLOCK_SIZE = 500
+DEFAULT_LIKE_THRESHOLD = 4.0
+
+
+def stream_interaction_likes(itersize=100000):
+    """Yield (user_id, movie_id) for every like in user_interactions"""
+    conn = database.connect()
+    try:
+        cur = conn.cursor(name="cf_likes")
+        cur.itersize = itersize
+        cur.execute("SELECT user_id, movie_id FROM user_interactions WHERE liked = TRUE")
+        for user_id, movie_id in cur:
+            yield user_id, movie_id
+        cur.close()
+    finally:
+        conn.close()
+
+
+def stream_rating_likes(dataset_path, movie_id_map, like_threshold=DEFAULT_LIKE_THRESHOLD,
+                        chunksize=1_000_000):
+    """Yield chunks of (user key, movie_id) arrays for ratings counted as likes
+
+    MovieLens users are kept apart from application users by negating
+    their ids.
+    """
+    from import_movielens_data import iter_ratings
+
+    ml_ids = np.fromiter(movie_id_map.keys(), dtype=np.int64)
+    db_ids = np.fromiter(movie_id_map.values(), dtype=np.int64)
+    order = np.argsort(ml_ids)
+    ml_ids, db_ids = ml_ids[order], db_ids[order]
+    for chunk in iter_ratings(dataset_path, chunksize):
+        chunk = chunk[chunk['rating'] >= like_threshold]
+        movie_ids = chunk['movieId'].to_numpy().astype(np.int64)
+        positions = np.searchsorted(ml_ids, movie_ids).clip(max=len(ml_ids) - 1)
+        known = ml_ids[positions] == movie_ids
+        yield -chunk['userId'].to_numpy()[known].astype(np.int64), db_ids[positions[known]]
+
+
+def like_matrix(pairs):
+    """Binary users x movies matrix from chunks of (user ids, movie ids)"""
+    users, movies = [], []
+    for user_ids, movie_ids in pairs:
+        users.append(np.asarray(user_ids, dtype=np.int64))
+        movies.append(np.asarray(movie_ids, dtype=np.int64))
+    users = np.concatenate(users) if users else np.empty(0, dtype=np.int64)
+    movies = np.concatenate(movies) if movies else np.empty(0, dtype=np.int64)
+
+    user_keys, user_rows = np.unique(users, return_inverse=True)
+    movie_ids, movie_cols = np.unique(movies, return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(users), dtype=np.float32), (user_rows, movie_cols)),
+        shape=(len(user_keys), len(movie_ids)),
+    )
+    # Repeated likes of the same movie count once
+    matrix.data[:] = 1
+    return matrix, movie_ids
+
+
+def item_similarity(likes, k=DEFAULT_TOP_K, min_support=DEFAULT_MIN_SUPPORT,
+                    block_size=DEFAULT_BLOCK_SIZE):
+    """Top-k normalised co-occurrence neighbours of every movie"""
+    likes = sparse.csr_matrix(likes, dtype=np.float32)
+    n_movies = likes.shape[1]
+    counts = np.asarray(likes.sum(axis=0)).ravel()
+    norms = np.sqrt(np.maximum(counts, 1))
+    by_movie = likes.T.tocsr()
+
+    all_rows, all_cols, all_scores = [], [], []
+    for start in range(0, n_movies, block_size):
+        stop = min(start + block_size, n_movies)
+        co_likes = (by_movie[start:stop] @ likes).tocoo()
+        rows = co_likes.row + start
+        keep = (rows != co_likes.col) & (co_likes.data >= min_support)
+        rows, cols = rows[keep], co_likes.col[keep]
+        scores = co_likes.data[keep] / (norms[rows] * norms[cols])
+        rows, cols, scores = merge_top_k(rows, cols, scores.astype(np.float32), k)
+        all_rows.append(rows)
+        all_cols.append(cols)
+        all_scores.append(scores)
+
+    return assemble_index(all_rows, all_cols, all_scores, n_movies)
+
+
+def train(pairs, k=DEFAULT_TOP_K, min_support=DEFAULT_MIN_SUPPORT, block_size=DEFAULT_BLOCK_SIZE,
+          model_dir=CF_MODEL_DIR, params=None):
+    """Build the item-item model from like pairs and publish it"""
+    likes, movie_ids = like_matrix(pairs)
+    similarity = item_similarity(likes, k, min_support, block_size)
+    manifest = {
+        "kind": "item_cf",
+        "n_movies": len(movie_ids),
+        "n_users": likes.shape[0],
+        "n_likes": int(likes.nnz),
+        "params": dict(params or {}, top_k=k, min_support=min_support),
+    }
+    return model_store.write_artifact(
+        model_store.neighbor_arrays(movie_ids, similarity), manifest, root=model_dir
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the item-item collaborative filtering model")
+    parser.add_argument("--ratings", metavar="DATASET_DIR",
+                        help="Also learn from ratings.csv of the imported MovieLens dataset")
+    parser.add_argument("--like-threshold", type=float, default=DEFAULT_LIKE_THRESHOLD)
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K)
+    parser.add_argument("--min-support", type=int, default=DEFAULT_MIN_SUPPORT,
+                        help="Minimum number of users liking both movies")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE,
+                        help="Movies per co-occurrence block")
+    parser.add_argument("--model-dir", default=CF_MODEL_DIR)
+    args = parser.parse_args(argv)
+
+    def interaction_chunks(chunk_size=1_000_000):
+        users, movies = [], []
+        for user_id, movie_id in stream_interaction_likes():
+            users.append(user_id)
+            movies.append(movie_id)
+            if len(users) == chunk_size:
+                yield np.array(users), np.array(movies)
+                users, movies = [], []
+        if users:
+            yield np.array(users), np.array(movies)
+
+    def all_pairs():
+        yield from interaction_chunks()
+        if args.ratings:
+            import pandas as pd
+            from import_movielens_data import imported_movie_ids
+
+            dataset_movies = pd.read_csv(f"{args.ratings}/movies.csv", usecols=["movieId"])
+            yield from stream_rating_likes(
+                args.ratings, imported_movie_ids(dataset_movies), args.like_threshold
+            )
+
+    try:
+        version = train(
+            all_pairs(),
+            k=args.top_k,
+            min_support=args.min_support,
+            block_size=args.block_size,
+            model_dir=args.model_dir,
+            params={"ratings": args.ratings, "like_threshold": args.like_threshold},
+        )
+    except Exception as e:
+        print(f"Error training collaborative model: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Saved collaborative model version {version} to '{args.model_dir}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""Shared database access for the recommendation code.
+
+Connections come from one process-wide pool, so a request costs no TCP
+or authentication handshake once the pool is warm:
+
+    with database.connection() as conn:
+        with conn.cursor() as cur:
+            ...
+
+The block commits on success and rolls back on error. The hot queries
+live in STATEMENTS and run with execute(cur, name, params); on a pooled
+Postgres connection each is PREPAREd once and then EXECUTEd, so it is
+parsed and planned once per connection instead of once per request.
+
+DATABASE_URL may also be sqlite:///path/to/file.db, a stand-in for local
+experiments: the cursor accepts the same %s placeholders, and
+create_tables() builds the schema from models.py. Postgres-only features
+(triggers, COPY, server-side cursors) are not available there.
+"""
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+POOL_MAX = int(os.environ.get("DB_POOL_MAX", 10))
+
+SQLITE_PREFIX = "sqlite:///"
+
+# Hot queries, run with execute(); parameters are positional %s
+STATEMENTS = {
+    "liked_movies": """
+        SELECT movie_id FROM user_interactions WHERE user_id = %s AND liked = TRUE
+        ORDER BY created_at DESC NULLS LAST, id DESC
+    """,
+    "catalog_state": """
+        SELECT COUNT(*), MAX(id), (SELECT MAX(version) FROM catalog_version) FROM movies
+    """,
+    "popular_likes": """
+        SELECT movie_id FROM movie_popularity WHERE like_count > 0
+        ORDER BY like_count DESC, movie_id LIMIT %s
+    """,
+    "popular_trending": """
+        SELECT movie_id FROM movie_popularity WHERE trending_score > 0
+        ORDER BY trending_score DESC, movie_id LIMIT %s
+    """,
+    "user_profile": """
+        SELECT model_version, liked_ids, terms, weights FROM user_profiles WHERE user_id = %s
+    """,
+}
+
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+
+
+def database_url():
+    return os.environ['DATABASE_URL']
+
+
+def is_sqlite(url=None):
+    return (url or database_url()).startswith(SQLITE_PREFIX)
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """psycopg2 connection remembering which STATEMENTS it has prepared"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class SQLiteCursor:
+    """sqlite3 cursor accepting psycopg2-style %s placeholders"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection.raw.cursor()
+
+    def execute(self, query, params=()):
+        self._cursor.execute(query.replace("%s", "?"), list(params))
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SQLiteConnection:
+    """sqlite3 connection with the parts of the psycopg2 interface used here"""
+
+    def __init__(self, path):
+        self.raw = sqlite3.connect(path, check_same_thread=False)
+
+    def cursor(self):
+        return SQLiteCursor(self)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        self.raw.close()
+
+    @property
+    def closed(self):
+        return False
+
+
+def connect(url=None):
+    """A new, unpooled connection, for long jobs and bulk loads"""
+    url = url or database_url()
+    if is_sqlite(url):
+        return SQLiteConnection(url[len(SQLITE_PREFIX):])
+    return psycopg2.connect(url)
+
+
+def get_pool():
+    """The process's connection pool, created on first use (and after a fork)"""
+    global _pool, _pool_pid, _pool_slots
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = psycopg2.pool.ThreadedConnectionPool(
+                POOL_MIN, POOL_MAX, database_url(), connection_factory=PreparingConnection
+            )
+            _pool_pid = os.getpid()
+            # ThreadedConnectionPool raises when exhausted; make callers wait instead
+            _pool_slots = threading.BoundedSemaphore(POOL_MAX)
+        return _pool, _pool_slots
+
+
+def close_pool():
+    """Close every pooled connection"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+@contextmanager
+def connection():
+    """A pooled connection for the duration of a with block
+
+    Commits when the block succeeds and rolls back when it raises.
+    """
+    if is_sqlite():
+        conn = connect()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return
+
+    pool, slots = get_pool()
+    with slots:
+        conn = pool.getconn()
+        broken = False
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+            raise
+        finally:
+            pool.putconn(conn, close=broken or bool(conn.closed))
+
+
+def _numbered(query):
+    """Rewrite %s placeholders as PREPARE's $1, $2, ..."""
+    counter = iter(range(1, 1000))
+    return re.sub(r"%s", lambda _: f"${next(counter)}", query)
+
+
+def execute(cur, name, params=()):
+    """Run one of STATEMENTS, as a prepared statement where possible"""
+    query = STATEMENTS[name]
+    prepared = getattr(cur.connection, "prepared", None)
+    if prepared is None:
+        cur.execute(query, list(params))
+        return
+    if name not in prepared:
+        cur.execute(f"PREPARE {name} AS {_numbered(query)}")
+        prepared.add(name)
+    if params:
+        cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", list(params))
+    else:
+        cur.execute(f"EXECUTE {name}")
+
+
+def liked_movie_ids(user_id):
+    """Ids of the movies a user liked, most recent first"""
+    with connection() as conn:
+        with conn.cursor() as cur:
+            execute(cur, "liked_movies", [user_id])
+            return [row[0] for row in cur.fetchall()]
+
+
+def sqlalchemy_url(url=None):
+    """DATABASE_URL in the form SQLAlchemy expects"""
+    url = url or database_url()
+    if url.startswith("postgres://"):
+        url = "postgresql://" + url[len("postgres://"):]
+    if url.startswith("postgresql://"):
+        url = "postgresql+psycopg2://" + url[len("postgresql://"):]
+    return url
+
+
+def create_tables(url=None):
+    """Create the tables of models.py, e.g. in a SQLite stand-in database"""
+    from sqlalchemy import create_engine
+
+    import models
+
+    engine = create_engine(sqlalchemy_url(url))
+    models.Base.metadata.create_all(engine)
+    engine.dispose()
+
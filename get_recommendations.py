@@ -1,21 +1,39 @@
+# Serving from a published artifact needs only NumPy and the database
+# driver; pandas, SciPy and scikit-learn are imported inside the functions
+# that train or read legacy model files (see benchmark.py --startup-budget)
 import sys
-import pickle
-import pandas as pd
 import json
-import psycopg2
-import numpy as np
 import os
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import logging
 
+from model_store import MODEL_DIR, SimilarityModel, load_artifact, row_hashes, save_content_model
+from scoring import BlendedEngine, ScoringEngine, recency_weights
+from popularity import top_movies
+from catalog import CATALOG_DIR, CatalogSnapshot, load_catalog
+import database
+import metrics
+
+# Halve a liked movie's weight every RECENCY_HALF_LIFE likes back in history
+RECENCY_HALF_LIFE = float(os.environ.get("RECENCY_HALF_LIFE", 0)) or None
+# "ann" builds a missing neighbour index approximately (see ann_index.py)
+CONTENT_NEIGHBORS = os.environ.get("CONTENT_NEIGHBORS", "exact")
+# "profile" scores content against stored per-user TF-IDF profiles (see profiles.py)
+CONTENT_SCORING = os.environ.get("CONTENT_SCORING", "neighbors")
+# Share of the item-item collaborative model in the blended score (0 = content only)
+CF_BLEND_WEIGHT = float(os.environ.get("CF_BLEND_WEIGHT", 0))
+# Share of the ALS latent-factor model in the blended score
+ALS_BLEND_WEIGHT = float(os.environ.get("ALS_BLEND_WEIGHT", 0))
+
+@metrics.timed("db_movies")
 def get_movies_from_db():
     """Fetch all movies from the database"""
+    import pandas as pd
+
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor()
-        cur.execute("SELECT id, title, description, genre, rating, release_year, poster_url FROM movies")
-        movies = cur.fetchall()
-        conn.close()
+        with database.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT id, title, description, genre, rating, release_year, poster_url FROM movies ORDER BY id")
+                movies = cur.fetchall()
         
         # Create DataFrame with all necessary columns
         return pd.DataFrame(
@@ -24,34 +42,47 @@ def get_movies_from_db():
         )
     except Exception as e:
         print(f"Error fetching movies: {str(e)}", file=sys.stderr)
+        metrics.error("db_movies", e)
         return pd.DataFrame(
             columns=["id", "title", "description", "genre", "rating", "release_year", "poster_url"]
         )
 
+@metrics.timed("db_catalog")
+def get_catalog(path=CATALOG_DIR):
+    """Catalog snapshot, refreshed with only the movies changed since it was saved"""
+    try:
+        with database.connection() as conn:
+            return load_catalog(conn, path)
+    except Exception as e:
+        print(f"Error refreshing catalog: {str(e)}", file=sys.stderr)
+        metrics.error("db_catalog", e)
+        # Serve from the last saved snapshot, possibly stale
+        try:
+            return CatalogSnapshot.load(path)
+        except (FileNotFoundError, ValueError):
+            return CatalogSnapshot.from_rows([])
+
+@metrics.timed("db_liked")
 def get_liked_movies(user_id):
-    """Get the movies that the user has liked"""
+    """Get the movies that the user has liked, most recent first"""
     try:
         # Validate user_id is a valid integer
         user_id = int(user_id)
         
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
-        cur = conn.cursor()
-        cur.execute(
-            "SELECT movie_id FROM user_interactions WHERE user_id = %s AND liked = TRUE",
-            [user_id]
-        )
-        liked_movies = [row[0] for row in cur.fetchall()]
-        conn.close()
-        return liked_movies
+        return database.liked_movie_ids(user_id)
     except (ValueError, TypeError) as e:
         print(f"Invalid user ID format: {str(e)}", file=sys.stderr)
         return []
     except Exception as e:
         print(f"Error fetching liked movies: {str(e)}", file=sys.stderr)
+        metrics.error("db_liked", e)
         return []
 
 def generate_movie_features(movies_df):
     """Generate content features from movie data for similarity calculation"""
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from neighbors import top_k_neighbors, empty_index
+
     try:
         # Combine relevant fields into a single string for each movie
         movies_df['features'] = movies_df['title'] + ' ' + movies_df['genre'] + ' ' + movies_df['description']
@@ -60,17 +91,200 @@ def generate_movie_features(movies_df):
         tfidf = TfidfVectorizer(stop_words='english')
         tfidf_matrix = tfidf.fit_transform(movies_df['features'].fillna(''))
         
-        # Calculate cosine similarity between movies
-        cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
-        
-        return cosine_sim
+        # Keep only the top-K most similar movies for each movie
+        if CONTENT_NEIGHBORS == "ann":
+            from ann_index import ann_neighbors
+            return ann_neighbors(tfidf_matrix)
+        return top_k_neighbors(tfidf_matrix)
     except Exception as e:
         print(f"Error generating features: {str(e)}", file=sys.stderr)
-        # Return identity matrix as fallback
-        return np.identity(len(movies_df))
+        # Return an index without neighbours as fallback
+        return empty_index(len(movies_df))
+
+@metrics.timed("model_load")
+def load_similarity(movies_df, model_path="cosine_sim.pkl", neighbors_path="neighbors.npz",
+                    model_dir=MODEL_DIR):
+    """Load the similarity model, generating and saving it if missing
+
+    The published artifact in model_dir is preferred. The legacy
+    neighbors.npz and cosine_sim.pkl files are still read; their rows are
+    assumed to follow the order of movies_df, which may also be a
+    CatalogSnapshot.
+    """
+    # If we have model files saved, try to load them
+    try:
+        return load_artifact(model_dir).similarity_model()
+    except FileNotFoundError:
+        pass
+    import pickle
+    from scipy import sparse
+
+    if isinstance(movies_df, CatalogSnapshot):
+        movies_df = movies_df.to_frame()
+    if os.path.exists(neighbors_path):
+        return SimilarityModel(sparse.load_npz(neighbors_path).tocsr(), movies_df["id"].to_numpy())
+    try:
+        with open(model_path, "rb") as f:
+            return SimilarityModel(pickle.load(f), movies_df["id"].to_numpy())
+    except FileNotFoundError:
+        # If models don't exist, generate them
+        cosine_sim = generate_movie_features(movies_df)
+        version = None
+        # Optionally save for future use
+        try:
+            version = save_content_model(
+                movies_df["id"].to_numpy(),
+                row_hashes(movies_df),
+                cosine_sim,
+                params={"source": "database"},
+                root=model_dir,
+            )
+        except Exception as e:
+            print(f"Warning: Could not save similarity model: {str(e)}", file=sys.stderr)
+            # Continue without saving
+        return SimilarityModel(cosine_sim, movies_df["id"].to_numpy(), version)
+
+def build_engine(model, cf_model_dir=None, blend_weight=CF_BLEND_WEIGHT,
+                 als_model_dir=None, als_weight=ALS_BLEND_WEIGHT,
+                 content_scoring=CONTENT_SCORING, model_dir=MODEL_DIR):
+    """Scoring engine for the content model, blended with the collaborative ones if enabled
+
+    cf_model_dir and als_model_dir default to collaborative.CF_MODEL_DIR
+    and als_model.ALS_MODEL_DIR; those modules are only imported when
+    their model is blended in.
+    """
+    def load_cf_engine(path):
+        return ScoringEngine(load_artifact(path).similarity_model())
+
+    content = ScoringEngine(model)
+    if content_scoring == "profile":
+        content = load_profile_engine(model, model_dir) or content
+    engines = [(content, max(0.0, 1 - blend_weight - als_weight))]
+    blended = []
+    if blend_weight > 0:
+        from collaborative import CF_MODEL_DIR
+        blended.append(("collaborative", load_cf_engine, cf_model_dir or CF_MODEL_DIR, blend_weight))
+    if als_weight > 0:
+        from als_model import ALS_MODEL_DIR, load_engine as load_als_engine
+        blended.append(("ALS", load_als_engine, als_model_dir or ALS_MODEL_DIR, als_weight))
+    for name, load, path, weight in blended:
+        try:
+            engines.append((load(path), weight))
+        except FileNotFoundError:
+            print(f"Warning: No {name} model in '{path}', leaving it out", file=sys.stderr)
+    if len(engines) == 1:
+        return content
+    # Results are always drawn from the content model's catalog rows
+    return BlendedEngine(engines)
+
+def model_dirs(model_dir=MODEL_DIR, blend_weight=CF_BLEND_WEIGHT, als_weight=ALS_BLEND_WEIGHT):
+    """Artifact directories that build_engine() reads with its default paths"""
+    dirs = [model_dir]
+    if blend_weight > 0:
+        from collaborative import CF_MODEL_DIR
+        dirs.append(CF_MODEL_DIR)
+    if als_weight > 0:
+        from als_model import ALS_MODEL_DIR
+        dirs.append(ALS_MODEL_DIR)
+    return dirs
+
+def load_profile_engine(model, model_dir=MODEL_DIR):
+    """Profile engine over the TF-IDF matrix of the model's artifact, or None"""
+    from profiles import ProfileEngine
+
+    artifact = None
+    if model.version is not None:
+        try:
+            artifact = load_artifact(model_dir, model.version)
+        except FileNotFoundError:
+            pass
+    if artifact is None or not artifact.has("tfidf_indptr"):
+        print("Warning: Model has no TF-IDF matrix, scoring without user profiles", file=sys.stderr)
+        return None
+    return ProfileEngine(artifact)
+
+@metrics.timed("db_popular")
+def get_popular_movies(exclude_ids, limit=10):
+    """Get the most liked (or trending) movies, excluding the given ids"""
+    with database.connection() as conn:
+        with conn.cursor() as cur:
+            return top_movies(cur, limit, exclude_ids)
+
+@metrics.timed("records")
+def movie_records(movies_df, movie_ids):
+    """Full movie details for the given ids, in the given order"""
+    if isinstance(movies_df, CatalogSnapshot):
+        return movies_df.records(movie_ids)
+    movies = movies_df[movies_df["id"].isin(movie_ids)].set_index("id", drop=False)
+    return movies.loc[[m for m in movie_ids if m in movies.index]].to_dict("records")
+
+def recommend(liked_movie_ids, movies_df, engine, limit=10, half_life=RECENCY_HALF_LIFE, user_id=None):
+    """Build the recommendation records for a user's liked movies
+
+    engine is a ScoringEngine, ALSEngine or BlendedEngine (see
+    build_engine); user_id lets the ALS model use the user's stored factor.
+    liked_movie_ids is ordered from most to least recent, which is what
+    the optional recency weighting relies on.
+    """
+    # Score every movie against all liked movies in one pass
+    with metrics.stage("scoring"):
+        weights = recency_weights(len(liked_movie_ids), half_life)
+        scored = engine.score(liked_movie_ids, n=limit, weights=weights, user_id=user_id)
+    recommendations = [movie_id for movie_id, _ in scored]
+    
+    if not recommendations:
+        # Fallback to popular movies if no recommendations found
+        metrics.count("recommendation_fallback_total")
+        metrics.annotate(fallback="popular")
+        try:
+            recommendations = get_popular_movies(liked_movie_ids)
+        except Exception as e:
+            print(f"Error fetching popular movies: {str(e)}", file=sys.stderr)
+            metrics.error("db_popular", e)
+            # Return empty list if fallback fails
+            return []
+    
+    # Get full movie details for the recommendations, best first
+    return movie_records(movies_df, recommendations)
+
+def recommendations_for_user(user_id):
+    """Recommendation records for one user, loading everything it needs"""
+    # Get liked movies for this user
+    liked_movie_ids = get_liked_movies(user_id)
+    
+    # If user hasn't liked any movies yet, return empty list
+    if not liked_movie_ids:
+        return []
+        
+    # Get all movies, from the saved snapshot unless the table changed
+    catalog = get_catalog()
+    
+    if catalog.empty:
+        return []
+        
+    engine = build_engine(load_similarity(catalog))
+    metrics.annotate(model_version=engine.version, liked=len(liked_movie_ids))
+    
+    return recommend(liked_movie_ids, catalog, engine, user_id=int(user_id))
 
 def main():
     try:
+        # Run as a long-lived service instead of answering a single request
+        if len(sys.argv) > 1 and sys.argv[1] == "--serve":
+            from recommendation_service import main as serve
+            serve(sys.argv[2:])
+            return
+
+        # Precompute recommendations for every user into the recommendations table
+        if len(sys.argv) > 1 and sys.argv[1] == "--batch":
+            from batch_recommendations import main as batch
+            batch(sys.argv[2:])
+            return
+
+        # Request log lines go to stderr; set LOG_LEVEL=INFO to see them
+        logging.basicConfig(level=os.environ.get("LOG_LEVEL", "WARNING"), stream=sys.stderr,
+                            format='%(message)s')
+
         # Check if we received a user ID
         if len(sys.argv) < 2:
             print(json.dumps([]))
@@ -86,97 +300,19 @@ def main():
             print(json.dumps([]))
             return
             
-        # Get liked movies for this user
-        liked_movie_ids = get_liked_movies(user_id)
-        
-        # If user hasn't liked any movies yet, return empty list
-        if not liked_movie_ids:
-            print(json.dumps([]))
-            return
-            
-        # Get all movies
-        movies_df = get_movies_from_db()
-        
-        if movies_df.empty:
-            print(json.dumps([]))
-            return
-            
-        # If we have model files saved, try to load them
-        try:
-            with open("cosine_sim.pkl", "rb") as f:
-                cosine_sim = pickle.load(f)
-        except FileNotFoundError:
-            # If models don't exist, generate them
-            cosine_sim = generate_movie_features(movies_df)
-            # Optionally save for future use
-            try:
-                with open("cosine_sim.pkl", "wb") as f:
-                    pickle.dump(cosine_sim, f)
-            except Exception as e:
-                print(f"Warning: Could not save similarity matrix: {str(e)}", file=sys.stderr)
-                # Continue without saving
-        
-        # Get recommendations based on liked movies
-        recommendations = set()
-        for movie_id in liked_movie_ids:
-            try:
-                # Find the movie's index in our dataframe
-                idx = movies_df.index[movies_df["id"] == movie_id].tolist()[0]
-                
-                # Get similarity scores for this movie with all others
-                sim_scores = list(enumerate(cosine_sim[idx]))
-                
-                # Sort by similarity score (descending)
-                sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-                
-                # Get top 5 most similar movies (excluding the movie itself)
-                similar_movies = [i[0] for i in sim_scores[1:6]]
-                
-                # Add to recommendations set (to avoid duplicates)
-                for movie_idx in similar_movies:
-                    movie_id = movies_df["id"].iloc[movie_idx]
-                    if movie_id not in liked_movie_ids:  # Don't recommend already liked movies
-                        recommendations.add(movie_id)
-            except (IndexError, ValueError) as e:
-                # If the movie ID isn't found, just continue to the next one
-                continue
-        
-        # Convert to list and limit to 10 recommendations
-        recommendations = list(recommendations)[:10]
-        
-        if not recommendations:
-            # Fallback to popular movies if no recommendations found
-            try:
-                conn = psycopg2.connect(os.environ['DATABASE_URL'])
-                cur = conn.cursor()
-                cur.execute("""
-                    SELECT DISTINCT movie_id 
-                    FROM user_interactions 
-                    WHERE liked = TRUE 
-                    AND movie_id NOT IN %s
-                    GROUP BY movie_id 
-                    ORDER BY COUNT(*) DESC 
-                    LIMIT 10
-                """, [tuple(liked_movie_ids) if liked_movie_ids else (0,)])
-                
-                recommendations = [row[0] for row in cur.fetchall()]
-                conn.close()
-            except Exception as e:
-                print(f"Error fetching popular movies: {str(e)}", file=sys.stderr)
-                # Return empty list if fallback fails
-                print(json.dumps([]))
-                return
-        
-        # Get full movie details for the recommendations
-        recommended_movies = movies_df[movies_df["id"].isin(recommendations)].to_dict("records")
-        
-        # Convert to JSON and print (this will be captured by the Node.js script)
-        print(json.dumps(recommended_movies))
+        with metrics.request(user_id=user_id, mode="cli"):
+            recommended_movies = metrics.profiled(recommendations_for_user, user_id)
+            metrics.annotate(result_count=len(recommended_movies))
+            # Convert to JSON and print (this will be captured by the Node.js script)
+            with metrics.stage("serialize"):
+                output = json.dumps(recommended_movies)
+        print(output)
     
     except Exception as e:
         # In case of any error, return empty array and log the error
         print(f"Error in recommendation system: {str(e)}", file=sys.stderr)
+        metrics.error("request", e)
         print(json.dumps([]))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,13 +1,18 @@
 import os
+import argparse
+import hashlib
+import json
 import pandas as pd
-import psycopg2
-import requests
+import database
 import zipfile
 import io
 import logging
 from dotenv import load_dotenv
 import time
-import requests
+from tmdb_enrichment import (
+    DEFAULT_CACHE_PATH, DEFAULT_RATE, DEFAULT_WORKERS, TMDB_IMAGE_URL,
+    create_session, enrich_movies, placeholder_description, placeholder_poster, search_movie,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,10 +23,36 @@ load_dotenv()
 # MovieLens small dataset URL
 MOVIELENS_URL = "https://files.grouplens.org/datasets/movielens/ml-latest-small.zip"
 
-def download_and_extract_dataset():
+# Datasets that can be imported, by name
+MOVIELENS_DATASETS = {
+    "ml-latest-small": MOVIELENS_URL,
+    "ml-latest": "https://files.grouplens.org/datasets/movielens/ml-latest.zip",
+    "ml-25m": "https://files.grouplens.org/datasets/movielens/ml-25m.zip",
+}
+
+# Rows sent per COPY statement when loading movies
+DEFAULT_BATCH_SIZE = 10000
+
+# Compact dtypes for ratings.csv; ids fit in int32 and ratings in float32
+RATINGS_DTYPES = {"userId": "int32", "movieId": "int32", "rating": "float32", "timestamp": "int64"}
+
+# Ratings read per chunk when streaming ratings.csv
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+# Ratings at or above this count as a like when imported as interactions
+DEFAULT_LIKE_THRESHOLD = 4.0
+
+# Columns of the movies table filled by the import, in COPY order
+MOVIE_COLUMNS = ["title", "description", "genre", "rating", "release_year", "poster_url"]
+
+# Columns of the staging table: the MovieLens key and row hash, then the movie
+STAGING_COLUMNS = ["movielens_id", "content_hash"] + MOVIE_COLUMNS
+
+def download_and_extract_dataset(name="ml-latest-small"):
     """Download and extract the MovieLens dataset"""
-    logging.info("Downloading MovieLens dataset...")
-    response = requests.get(MOVIELENS_URL)
+    logging.info(f"Downloading MovieLens dataset {name}...")
+    with create_session(1) as session:
+        response = session.get(MOVIELENS_DATASETS[name])
     
     if response.status_code != 200:
         logging.error(f"Failed to download dataset: {response.status_code}")
@@ -31,12 +62,17 @@ def download_and_extract_dataset():
     z = zipfile.ZipFile(io.BytesIO(response.content))
     z.extractall("data")
     
-    return "data/ml-latest-small"
+    return f"data/{name}"
 
-def load_movies(dataset_path):
+def load_movies(dataset_path, limit=None, tmdb_workers=DEFAULT_WORKERS, tmdb_rate=DEFAULT_RATE,
+                tmdb_cache=DEFAULT_CACHE_PATH):
     """Load and preprocess movies data"""
     movies_df = pd.read_csv(f"{dataset_path}/movies.csv")
     
+    # Only enrich the movies that will actually be imported
+    if limit:
+        movies_df = movies_df.head(limit)
+    
     # Extract the first genre as primary genre
     movies_df['genre'] = movies_df['genres'].apply(lambda x: x.split('|')[0] if '|' in x else x)
     
@@ -49,155 +85,379 @@ def load_movies(dataset_path):
         lambda x: f"https://via.placeholder.com/300x450.png?text=Movie+{x}"
     )
     
-    # Add a description (we'll use a placeholder since MovieLens doesn't include descriptions)
-    movies_df['description'] = movies_df.apply(
-    lambda row: get_movie_description(row['title'], row['release_year']), 
-    axis=1
-)
-    
-    # Set a default rating (we'll calculate actual average later)
-    movies_df['poster_url'] = movies_df.apply(
-    lambda row: get_movie_poster(row['title'], row['release_year']), 
-    axis=1
-)
-    
-    return movies_df
+    # Add descriptions and posters from TMDB (one cached search per title/year)
+    return enrich_movies(
+        movies_df,
+        api_key=TMDB_API_KEY,
+        cache_path=tmdb_cache,
+        max_workers=tmdb_workers,
+        rate=tmdb_rate,
+    )
 
 def load_ratings(dataset_path):
     """Load ratings data"""
-    return pd.read_csv(f"{dataset_path}/ratings.csv")
+    return pd.read_csv(f"{dataset_path}/ratings.csv", dtype=RATINGS_DTYPES)
 
-def calculate_average_ratings(movies_df, ratings_df):
-    """Calculate average rating for each movie"""
-    avg_ratings = ratings_df.groupby('movieId')['rating'].mean().reset_index()
-    
-    # Merge with movies dataframe
-    movies_df = movies_df.merge(avg_ratings, on='movieId', how='left')
-    
-    # Replace the placeholder rating with the actual average
-    movies_df['rating'] = movies_df['rating_y'].fillna(0)
+def iter_ratings(dataset_path, chunksize=DEFAULT_CHUNK_SIZE):
+    """Read ratings.csv in chunks with compact dtypes"""
+    return pd.read_csv(f"{dataset_path}/ratings.csv", dtype=RATINGS_DTYPES, chunksize=chunksize)
+
+def stream_average_ratings(dataset_path, chunksize=DEFAULT_CHUNK_SIZE):
+    """Average rating per movie, keeping only running sums and counts in memory"""
+    totals = None
+    for chunk in iter_ratings(dataset_path, chunksize):
+        # Sum in float64 so long-running totals do not lose precision
+        partial = chunk.groupby('movieId')['rating'].agg(
+            sum=lambda r: r.astype('float64').sum(), count='count'
+        )
+        totals = partial if totals is None else totals.add(partial, fill_value=0)
+    if totals is None:
+        return pd.DataFrame(columns=['movieId', 'rating'])
+    avg_ratings = (totals['sum'] / totals['count']).rename('rating').reset_index()
+    avg_ratings['movieId'] = avg_ratings['movieId'].astype('int32')
+    return avg_ratings
+
+def calculate_average_ratings(movies_df, ratings_df=None, avg_ratings=None):
+    """Calculate average rating for each movie
+
+    Pass avg_ratings (movieId, rating) when the averages were already
+    computed, e.g. by stream_average_ratings().
+    """
+    if avg_ratings is None:
+        avg_ratings = ratings_df.groupby('movieId')['rating'].mean().reset_index()
     
-    # Drop the extra column
-    movies_df = movies_df.drop(columns=['rating_y'])
+    # Merge with movies dataframe, replacing any placeholder rating
+    movies_df = movies_df.drop(columns=['rating'], errors='ignore').merge(
+        avg_ratings, on='movieId', how='left'
+    )
+    movies_df['rating'] = movies_df['rating'].fillna(0)
     
     return movies_df
 
-def import_to_database(movies_df):
-    """Import processed movie data to PostgreSQL database"""
+def prepare_movie_rows(movies_df):
+    """Movie columns in database order, with missing values left empty"""
+    rows = movies_df[MOVIE_COLUMNS].copy()
+    rows['rating'] = pd.to_numeric(rows['rating'], errors='coerce').astype(float)
+    rows['release_year'] = pd.to_numeric(rows['release_year'], errors='coerce').astype('Int64')
+    return rows
+
+def content_hashes(rows):
+    """MD5 of each prepared movie row; a changed hash means the movie changed upstream"""
+    return [
+        hashlib.md5("\x1f".join("" if pd.isna(value) else str(value) for value in row).encode("utf-8")).hexdigest()
+        for row in rows.itertuples(index=False)
+    ]
+
+def prepare_staging_rows(movies_df):
+    """Prepared movie rows keyed by MovieLens movieId, with their content hash"""
+    rows = prepare_movie_rows(movies_df)
+    rows.insert(0, 'content_hash', content_hashes(rows))
+    rows.insert(0, 'movielens_id', movies_df['movieId'].astype(int).to_numpy())
+    return rows
+
+def copy_movies(cur, movies_df, batch_size=DEFAULT_BATCH_SIZE):
+    """Stream movies into a temporary staging table with COPY FROM STDIN"""
+    cur.execute("""
+        CREATE TEMP TABLE movies_staging (
+            position BIGSERIAL,
+            movielens_id INTEGER PRIMARY KEY,
+            content_hash TEXT,
+            title TEXT,
+            description TEXT,
+            genre TEXT,
+            rating DOUBLE PRECISION,
+            release_year INTEGER,
+            poster_url TEXT
+        ) ON COMMIT DROP
+    """)
+    rows = prepare_staging_rows(movies_df)
+    for start in range(0, len(rows), batch_size):
+        buffer = io.StringIO()
+        # Empty unquoted CSV fields are read as NULL
+        rows.iloc[start:start + batch_size].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cur.copy_expert(
+            f"COPY movies_staging ({', '.join(STAGING_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+
+def adopt_existing_movies(cur):
+    """Give movies imported before movielens_id existed their MovieLens key
+
+    A movie is matched on title and release year, and only when exactly
+    one unkeyed movie and one incoming row share them.
+    """
+    cur.execute("CREATE INDEX ON movies_staging (title)")
+    cur.execute("""
+        WITH candidates AS (
+            SELECT movies.id, movies_staging.movielens_id,
+                   COUNT(*) OVER (PARTITION BY movies.id) AS staged_matches,
+                   COUNT(*) OVER (PARTITION BY movies_staging.movielens_id) AS movie_matches
+            FROM movies
+            JOIN movies_staging
+                ON movies_staging.title = movies.title
+                AND movies_staging.release_year IS NOT DISTINCT FROM movies.release_year
+            WHERE movies.movielens_id IS NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM movies AS keyed WHERE keyed.movielens_id = movies_staging.movielens_id
+              )
+        )
+        UPDATE movies SET movielens_id = candidates.movielens_id
+        FROM candidates
+        WHERE movies.id = candidates.id AND staged_matches = 1 AND movie_matches = 1
+    """)
+    return cur.rowcount
+
+def sync_movies(cur):
+    """Upsert the staged movies that are new or whose content hash changed
+
+    Returns the ids of the inserted and of the updated movies. Movies
+    that are unchanged keep their row, id and interactions.
+    """
+    assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in STAGING_COLUMNS[1:])
+    cur.execute(f"""
+        INSERT INTO movies ({', '.join(STAGING_COLUMNS)})
+        SELECT {', '.join('movies_staging.' + column for column in STAGING_COLUMNS)}
+        FROM movies_staging
+        LEFT JOIN movies ON movies.movielens_id = movies_staging.movielens_id
+        WHERE movies.id IS NULL OR movies.content_hash IS DISTINCT FROM movies_staging.content_hash
+        ORDER BY movies_staging.position
+        ON CONFLICT (movielens_id) DO UPDATE SET {assignments}
+        RETURNING id, xmax = 0 AS inserted
+    """)
+    changes = {"inserted": [], "updated": []}
+    for movie_id, inserted in cur.fetchall():
+        changes["inserted" if inserted else "updated"].append(movie_id)
+    return changes
+
+def import_to_database(movies_df, batch_size=DEFAULT_BATCH_SIZE, replace=False):
+    """Import processed movie data to PostgreSQL database
+
+    All rows are loaded in one transaction through COPY, batch_size rows
+    per COPY statement. By default movies are matched to existing ones by
+    MovieLens movieId and only new or changed ones are written, so ids and
+    user interactions survive a re-import. replace=True empties the
+    movies table (and everything referencing it) first.
+
+    Returns the ids of the inserted and updated movies, or None on error.
+    """
+    conn = None
+    cur = None
+    changes = None
     try:
-        conn = psycopg2.connect(os.environ['DATABASE_URL'])
+        conn = database.connect()
         cur = conn.cursor()
         
-        # Clear existing data
-        cur.execute("TRUNCATE TABLE movies RESTART IDENTITY CASCADE")
+        if replace:
+            # Clear existing data
+            cur.execute("TRUNCATE TABLE movies RESTART IDENTITY CASCADE")
         
-        # Insert movie data
-        for _, movie in movies_df.iterrows():
-            cur.execute(
-                """
-                INSERT INTO movies (title, description, genre, rating, release_year, poster_url)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                """,
-                (
-                    movie['title'],
-                    movie['description'],
-                    movie['genre'],
-                    float(movie['rating']),
-                    int(movie['release_year']) if pd.notna(movie['release_year']) else None,
-                    movie['poster_url']
-                )
-            )
+        # Bulk load into staging, then upsert in file order so new ids follow it
+        copy_movies(cur, movies_df, batch_size)
+        if not replace:
+            adopted = adopt_existing_movies(cur)
+            if adopted:
+                logging.info(f"Matched {adopted} existing movies to their MovieLens ids")
+        changes = sync_movies(cur)
         
         conn.commit()
-        logging.info(f"Successfully imported {len(movies_df)} movies")
+        logging.info(
+            f"Synced {len(movies_df)} movies: {len(changes['inserted'])} new, "
+            f"{len(changes['updated'])} updated"
+        )
         
     except Exception as e:
         logging.error(f"Database import error: {e}")
-        conn.rollback()
+        changes = None
+        if conn:
+            conn.rollback()
     finally:
-        cur.close()
-        conn.close()
-TMDB_API_KEY = "your_tmdb_api_key"
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+    return changes
 
-def get_movie_poster(title, year=None):
-    """Get movie poster URL from TMDB API"""
+
+def import_ratings_as_interactions(dataset_path, movie_id_map, like_threshold=DEFAULT_LIKE_THRESHOLD,
+                                   chunksize=DEFAULT_CHUNK_SIZE):
+    """Stream raw ratings into user_interactions
+
+    movie_id_map maps MovieLens movieId to movies.id; ratings of other
+    movies are skipped. Every MovieLens user gets a placeholder account
+    named movielens_<userId>, and a rating of like_threshold or more
+    counts as a like. Each chunk is loaded with COPY and committed on its
+    own, so memory stays flat regardless of the size of ratings.csv.
+    """
+    conn = None
+    cur = None
+    imported = 0
     try:
-        search_url = f"https://api.themoviedb.org/3/search/movie"
-        params = {
-            "api_key": TMDB_API_KEY,
-            "query": title,
-            "year": year
-        }
-        
-        response = requests.get(search_url, params=params)
-        data = response.json()
+        conn = database.connect()
+        cur = conn.cursor()
+        cur.execute("""
+            CREATE TEMP TABLE movie_id_map (ml_movie_id INTEGER PRIMARY KEY, movie_id INTEGER)
+        """)
+        buffer = io.StringIO()
+        pd.DataFrame(list(movie_id_map.items())).to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cur.copy_expert("COPY movie_id_map FROM STDIN WITH (FORMAT csv)", buffer)
+        cur.execute("""
+            CREATE TEMP TABLE ratings_staging (
+                ml_user_id INTEGER,
+                ml_movie_id INTEGER,
+                rating REAL,
+                rated_at BIGINT
+            )
+        """)
+        conn.commit()
         
-        if "results" in data and data["results"]:
-            poster_path = data["results"][0]["poster_path"]
-            if poster_path:
-                return f"https://image.tmdb.org/t/p/w500{poster_path}"
+        known_movies = pd.Index(list(movie_id_map))
+        for chunk in iter_ratings(dataset_path, chunksize):
+            chunk = chunk[chunk['movieId'].isin(known_movies)]
+            if chunk.empty:
+                continue
+            buffer = io.StringIO()
+            chunk[['userId', 'movieId', 'rating', 'timestamp']].to_csv(buffer, index=False, header=False)
+            buffer.seek(0)
+            cur.copy_expert("COPY ratings_staging FROM STDIN WITH (FORMAT csv)", buffer)
+            cur.execute("""
+                INSERT INTO users (username)
+                SELECT DISTINCT 'movielens_' || ml_user_id FROM ratings_staging
+                ON CONFLICT (username) DO NOTHING
+            """)
+            cur.execute("""
+                INSERT INTO user_interactions (user_id, movie_id, liked, watch_later, created_at)
+                SELECT users.id, movie_id_map.movie_id, ratings_staging.rating >= %s, FALSE,
+                       to_timestamp(ratings_staging.rated_at)
+                FROM ratings_staging
+                JOIN movie_id_map USING (ml_movie_id)
+                JOIN users ON users.username = 'movielens_' || ratings_staging.ml_user_id
+                ON CONFLICT (user_id, movie_id)
+                DO UPDATE SET liked = EXCLUDED.liked, created_at = EXCLUDED.created_at
+            """, [like_threshold])
+            cur.execute("TRUNCATE ratings_staging")
+            conn.commit()
+            imported += len(chunk)
         
-        # Add a small delay to avoid hitting rate limits
-        time.sleep(0.25)
+        logging.info(f"Successfully imported {imported} ratings as interactions")
         
+    except Exception as e:
+        logging.error(f"Ratings import error: {e}")
+        if conn:
+            conn.rollback()
+    finally:
+        if cur:
+            cur.close()
+        if conn:
+            conn.close()
+    return imported
+
+def imported_movie_ids(movies_df):
+    """Map the MovieLens movieIds of movies_df to movies.id after import_to_database()"""
+    conn = database.connect()
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT movielens_id, id FROM movies WHERE movielens_id IS NOT NULL")
+        ids = dict(cur.fetchall())
+    finally:
+        conn.close()
+    return {
+        movielens_id: ids[movielens_id]
+        for movielens_id in movies_df['movieId'].astype(int).tolist()
+        if movielens_id in ids
+    }
+
+TMDB_API_KEY = os.environ.get("TMDB_API_KEY", "your_tmdb_api_key")
+
+def get_movie_poster(title, year=None):
+    """Get movie poster URL from TMDB API"""
+    try:
+        with create_session(1) as session:
+            movie = search_movie(session, title, year, TMDB_API_KEY)
+        if movie and movie.get("poster_path"):
+            return f"{TMDB_IMAGE_URL}{movie['poster_path']}"
     except Exception as e:
         logging.error(f"Error fetching poster for {title}: {e}")
     
     # Return placeholder if no poster found
-    return f"https://via.placeholder.com/500x750.png?text={title.replace(' ', '+')}"
+    return placeholder_poster(title)
 
-# Then in your load_movies function, replace the placeholder URL with:
 def get_movie_description(title, year=None):
     """Get movie description from TMDB API"""
     try:
-        search_url = f"https://api.themoviedb.org/3/search/movie"
-        params = {
-            "api_key": TMDB_API_KEY,
-            "query": title,
-            "year": year
-        }
-        
-        response = requests.get(search_url, params=params)
-        data = response.json()
-        
-        if "results" in data and data["results"]:
-            overview = data["results"][0]["overview"]
-            if overview:
-                return overview
-        
-        # Add a small delay to avoid hitting rate limits
-        time.sleep(0.25)
-        
+        with create_session(1) as session:
+            movie = search_movie(session, title, year, TMDB_API_KEY)
+        if movie and movie.get("overview"):
+            return movie["overview"]
     except Exception as e:
         logging.error(f"Error fetching description for {title}: {e}")
     
     # Return placeholder if no description found
-    return f"No description available for {title}."
+    return placeholder_description(title)
 
 
-def main():
+def main(argv=None):
     """Main function to coordinate the import process"""
+    parser = argparse.ArgumentParser(description="Import a MovieLens dataset into the movies table")
+    parser.add_argument("--dataset", choices=sorted(MOVIELENS_DATASETS), default="ml-latest-small")
+    parser.add_argument("--limit", type=int, default=1000,
+                        help="Import only the first N movies (0 imports all of them)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Rows per COPY statement")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Ratings read per chunk from ratings.csv")
+    parser.add_argument("--replace", action="store_true",
+                        help="Empty the movies table (and all interactions) before importing")
+    parser.add_argument("--changes-file",
+                        help="Write the ids of the inserted and updated movies to this JSON file")
+    parser.add_argument("--import-ratings", action="store_true",
+                        help="Also stream the raw ratings into user_interactions")
+    parser.add_argument("--like-threshold", type=float, default=DEFAULT_LIKE_THRESHOLD,
+                        help="Minimum rating imported as a like")
+    parser.add_argument("--tmdb-workers", type=int, default=DEFAULT_WORKERS,
+                        help="Concurrent TMDB requests")
+    parser.add_argument("--tmdb-rate", type=float, default=DEFAULT_RATE,
+                        help="Maximum TMDB requests per second")
+    parser.add_argument("--tmdb-cache", default=DEFAULT_CACHE_PATH,
+                        help="SQLite file caching TMDB search results")
+    args = parser.parse_args(argv)
+
     # Download and extract dataset
-    dataset_path = download_and_extract_dataset()
+    dataset_path = download_and_extract_dataset(args.dataset)
     if not dataset_path:
         return
     
     # Load and process movie data
-    movies_df = load_movies(dataset_path)
-    
-    # Load ratings data
-    ratings_df = load_ratings(dataset_path)
-    
-    # Calculate average ratings
-    movies_df = calculate_average_ratings(movies_df, ratings_df)
+    movies_df = load_movies(
+        dataset_path,
+        limit=args.limit,
+        tmdb_workers=args.tmdb_workers,
+        tmdb_rate=args.tmdb_rate,
+        tmdb_cache=args.tmdb_cache,
+    )
     
-    # Limit to a reasonable number (e.g., 1000) for initial import
-    movies_df = movies_df.head(1000)
+    # Calculate average ratings, streaming ratings.csv in chunks
+    avg_ratings = stream_average_ratings(dataset_path, args.chunk_size)
+    movies_df = calculate_average_ratings(movies_df, avg_ratings=avg_ratings)
     
     # Import to database
-    import_to_database(movies_df)
+    changes = import_to_database(movies_df, batch_size=args.batch_size, replace=args.replace)
+    if changes is None:
+        return
+    if args.changes_file:
+        with open(args.changes_file, "w", encoding="utf-8") as f:
+            json.dump(changes, f)
+    
+    if args.import_ratings:
+        import_ratings_as_interactions(
+            dataset_path,
+            imported_movie_ids(movies_df),
+            like_threshold=args.like_threshold,
+            chunksize=args.chunk_size,
+        )
     
     logging.info("MovieLens data import completed")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
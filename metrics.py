@@ -0,0 +1,272 @@
+"""Timers, counters and request logs for the recommendation path.
+
+Every stage of a request (DB queries, model load, scoring, serialisation)
+is timed with `stage("name")`. Durations go into a per-stage histogram
+and into the current request's trace, which is logged as one JSON line
+when the request ends. Counters track cache hits, fallbacks to popular
+movies, empty results and swallowed errors.
+
+The registry renders in the Prometheus text format; the service exposes
+it at GET /metrics and can also write it to a file for the node_exporter
+textfile collector.
+
+Setting PROFILE_SAMPLE_RATE (0..1) profiles that share of requests with
+cProfile and writes the stats to PROFILE_DIR.
+"""
+import cProfile
+import functools
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger("recommendations")
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+
+HELP = {
+    "recommendation_stage_seconds": "Time spent in each stage of a recommendation request",
+    "recommendation_requests_total": "Recommendation requests answered",
+    "recommendation_cache_total": "Recommendation cache lookups by result",
+    "recommendation_singleflight_total": "Cache misses that computed a result (leader) or shared one in flight (follower)",
+    "recommendation_fallback_total": "Requests answered with popular movies instead of scored ones",
+    "recommendation_empty_total": "Requests answered with an empty list",
+    "recommendation_errors_total": "Errors caught and answered with a fallback, by stage",
+    "recommendation_model_info": "Currently loaded model version",
+}
+
+
+def _label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observed values"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    """Thread-safe store of counters, gauges and histograms"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            key = (name, _label_key(labels))
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def clear_gauge(self, name):
+        with self._lock:
+            for key in [key for key in self._gauges if key[0] == name]:
+                del self._gauges[key]
+
+    def observe(self, name, value, **labels):
+        with self._lock:
+            key = (name, _label_key(labels))
+            if key not in self._histograms:
+                self._histograms[key] = Histogram()
+            self._histograms[key].observe(value)
+
+    def snapshot(self):
+        """Counters and histogram summaries as a JSON-able dict"""
+        with self._lock:
+            return {
+                "counters": {f"{name}{_format_labels(key)}": value
+                             for (name, key), value in sorted(self._counters.items())},
+                "stages": {f"{name}{_format_labels(key)}": {"count": h.count, "sum": h.total}
+                           for (name, key), h in sorted(self._histograms.items())},
+            }
+
+    def prometheus_text(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, series in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({name for name, _ in series}):
+                    lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (series_name, key), value in sorted(series.items()):
+                        if series_name == name:
+                            lines.append(f"{name}{_format_labels(key)} {value}")
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for (series_name, key), histogram in sorted(self._histograms.items()):
+                    if series_name != name:
+                        continue
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        lines.append(f"{name}_bucket{_format_labels(key, [('le', bound)])} {count}")
+                    lines.append(f"{name}_bucket{_format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.total}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Atomically write the metrics to path"""
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+REGISTRY = Registry()
+
+# Trace of the request being handled by the current thread
+_current = threading.local()
+# Only one cProfile profiler can be active at a time
+_profile_lock = threading.Lock()
+
+
+class RequestTrace:
+    """Stage durations and attributes of one request, logged as a JSON line"""
+
+    def __init__(self, **fields):
+        self.fields = dict(fields)
+        self.stages = {}
+        self.started = time.perf_counter()
+
+    def add_stage(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    def record(self):
+        total = time.perf_counter() - self.started
+        REGISTRY.observe("recommendation_stage_seconds", total, stage="total")
+        REGISTRY.inc("recommendation_requests_total")
+        if self.fields.get("result_count") == 0:
+            REGISTRY.inc("recommendation_empty_total")
+        line = dict(self.fields, event="recommendation", total_ms=round(total * 1000, 3),
+                    stages_ms={name: round(seconds * 1000, 3) for name, seconds in self.stages.items()})
+        logger.info(json.dumps(line, default=str))
+        return line
+
+
+def current_trace():
+    return getattr(_current, "trace", None)
+
+
+def annotate(**fields):
+    """Attach fields to the current request's log line, if any"""
+    trace = current_trace()
+    if trace is not None:
+        trace.set(**fields)
+
+
+@contextmanager
+def request(**fields):
+    """Trace a request on this thread; logs and records it when done"""
+    trace = RequestTrace(**fields)
+    previous, _current.trace = current_trace(), trace
+    try:
+        yield trace
+    except Exception as e:
+        trace.set(error=str(e))
+        raise
+    finally:
+        _current.trace = previous
+        trace.record()
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        REGISTRY.observe("recommendation_stage_seconds", seconds, stage=name)
+        trace = current_trace()
+        if trace is not None:
+            trace.add_stage(name, seconds)
+
+
+def timed(name):
+    """Decorator timing every call of a function as a stage"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, amount=1, **labels):
+    REGISTRY.inc(name, amount, **labels)
+
+
+def error(stage_name, exc):
+    """Count an error that is handled by falling back, and note it on the request"""
+    REGISTRY.inc("recommendation_errors_total", stage=stage_name)
+    annotate(error_stage=stage_name, error=str(exc))
+
+
+def set_model_version(version):
+    REGISTRY.clear_gauge("recommendation_model_info")
+    REGISTRY.set("recommendation_model_info", 1, version=version)
+
+
+def profiled(func, *args, sample_rate=None, profile_dir=None, label="request", **kwargs):
+    """Call func, under cProfile for a sample_rate share of calls
+
+    Profiles are written to profile_dir as <label>-<time>-<thread>.prof
+    and can be read with `python -m pstats`.
+    """
+    sample_rate = PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if sample_rate <= 0 or random.random() >= sample_rate:
+        return func(*args, **kwargs)
+    if not _profile_lock.acquire(blocking=False):
+        return func(*args, **kwargs)
+    profile_dir = profile_dir or PROFILE_DIR
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        path = os.path.join(
+            profile_dir, f"{label}-{time.strftime('%Y%m%d-%H%M%S')}-{threading.get_ident()}.prof"
+        )
+        profiler.dump_stats(path)
+        _profile_lock.release()
+        annotate(profile=path)
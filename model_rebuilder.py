@@ -0,0 +1,243 @@
+"""Rebuilds model artifacts in the background when their inputs change.
+
+Every --interval seconds the rebuilder polls two cheap fingerprints:
+
+    catalog         count, max(id) and max(updated_at) of movies; when it
+                    moves, the catalog snapshot is refreshed and the content
+                    model is rebuilt if the ids or training text no longer
+                    match the catalog fingerprint in its manifest
+    interactions    Postgres' insert/update/delete counters for
+                    user_interactions (pg_stat_user_tables); when they
+                    move, the collaborative and ALS models are rebuilt
+
+A model is rebuilt at most every --min-interval seconds. Each rebuild
+runs the model's script in a child process at lower CPU priority: the
+content model is brought up to date with update_model.py, which patches
+the changed rows and keeps the neighbour settings of the live manifest,
+and the collaborative and ALS models are retrained. The script writes a
+new version directory and atomically points CURRENT at it, and the
+serving processes swap the new version in on their next model check
+(recommendation_service.py --model-refresh). Afterwards all but the
+newest --keep versions are deleted.
+
+Rows precomputed by batch_recommendations.py were scored with the old
+models, so once a new version is published they are recomputed (with
+--batch, using this process's CF_BLEND_WEIGHT, ALS_BLEND_WEIGHT and
+CONTENT_SCORING) or deleted, and server.js asks the service instead.
+
+Usage:
+    python model_rebuilder.py --models content als --interval 60
+    python model_rebuilder.py --once --batch
+"""
+import argparse
+import logging
+import os
+import shlex
+import subprocess
+import sys
+import time
+
+import catalog
+import database
+import model_store
+from als_model import ALS_MODEL_DIR
+from collaborative import CF_MODEL_DIR
+from neighbors import DEFAULT_TOP_K
+
+logger = logging.getLogger("model_rebuilder")
+
+DEFAULT_INTERVAL = 60.0
+DEFAULT_MIN_INTERVAL = 600.0
+# Added to the training processes' niceness, so serving keeps its CPU share
+DEFAULT_NICE = 10
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Training script, artifact directory and input of each model
+MODELS = {
+    "content": ("update_model.py", model_store.MODEL_DIR, "catalog"),
+    "cf": ("collaborative.py", CF_MODEL_DIR, "interactions"),
+    "als": ("als_model.py", ALS_MODEL_DIR, "interactions"),
+}
+
+
+def interaction_state(cur):
+    """Counter that moves whenever a row of user_interactions is written"""
+    cur.execute("""
+        SELECT n_tup_ins + n_tup_upd + n_tup_del FROM pg_stat_user_tables
+        WHERE relname = 'user_interactions'
+    """)
+    row = cur.fetchone()
+    return int(row[0]) if row else None
+
+
+def content_model_stale(snapshot, model_dir):
+    """Whether the live content model was trained on a different catalog"""
+    try:
+        manifest = model_store.load_artifact(model_dir).manifest
+    except FileNotFoundError:
+        return True
+    fingerprint = model_store.catalog_fingerprint(snapshot.ids, snapshot.row_hashes())
+    return manifest.get("catalog_fingerprint") != fingerprint
+
+
+class ModelRebuilder:
+    """Polls the inputs of the selected models and rebuilds the stale ones"""
+
+    def __init__(self, models=("content",), model_dirs=None, train_args=None,
+                 min_interval=DEFAULT_MIN_INTERVAL, keep=model_store.DEFAULT_KEEP_VERSIONS,
+                 nice=DEFAULT_NICE, batch_args=None):
+        self.models = list(models)
+        self.model_dirs = {name: MODELS[name][1] for name in self.models}
+        self.model_dirs.update(model_dirs or {})
+        self.train_args = train_args or {}
+        self.min_interval = min_interval
+        self.keep = keep
+        self.nice = nice
+        # Arguments for batch_recommendations.py, or None to delete precomputed rows
+        self.batch_args = batch_args
+        self.snapshot = None
+        self.interactions = None
+        self.polled = False
+        # Models waiting for a rebuild, and when each was last rebuilt
+        self.pending = set()
+        self.built_at = {}
+
+    def poll(self):
+        """Add the models whose inputs changed to pending"""
+        interaction_models = [name for name in self.models if MODELS[name][2] == "interactions"]
+        with database.connection() as conn:
+            with conn.cursor() as cur:
+                if "content" in self.models:
+                    self.snapshot, changed = catalog.refresh(self.snapshot, cur)
+                    # Rating or poster edits change the catalog but not the training text
+                    if changed and content_model_stale(self.snapshot, self.model_dirs["content"]):
+                        self.pending.add("content")
+                if interaction_models:
+                    state = interaction_state(cur)
+                    # The first poll only records the counter
+                    changed = self.polled and state != self.interactions
+                    self.interactions = state
+                    for name in interaction_models:
+                        if changed or model_store.current_version(self.model_dirs[name]) is None:
+                            self.pending.add(name)
+        self.polled = True
+        return sorted(self.pending)
+
+    def run_script(self, script, args):
+        """Run one of the repository's scripts in a child process at lower priority"""
+        command = [sys.executable, os.path.join(SCRIPT_DIR, script)] + list(args)
+        logger.info("Running %s", shlex.join(command))
+        subprocess.run(command, check=True, preexec_fn=(lambda: os.nice(self.nice)) if self.nice else None)
+
+    def rebuild(self, name):
+        """Build a new version of a model in a child process and prune old ones
+
+        Returns whether a new version was published.
+        """
+        script, _, _ = MODELS[name]
+        model_dir = self.model_dirs[name]
+        args = ["--model-dir", model_dir]
+        if name == "content":
+            # --top-k only matters while no model is published
+            args += ["--from-db", "--top-k", str(DEFAULT_TOP_K)]
+        args += self.train_args.get(name, [])
+        before = model_store.current_version(model_dir)
+        start = self.built_at[name] = time.monotonic()
+        self.run_script(script, args)
+        self.pending.discard(name)
+        version = model_store.current_version(model_dir)
+        logger.info("Rebuilt %s model version %s in %.1fs", name, version, time.monotonic() - start)
+        removed = model_store.prune_versions(model_dir, self.keep)
+        if removed:
+            logger.info("Deleted old %s model versions %s", name, removed)
+        return version != before
+
+    def refresh_precomputed(self):
+        """Recompute the precomputed recommendations, or delete them if that is off or fails"""
+        if self.batch_args is not None:
+            content_dir = self.model_dirs.get("content", MODELS["content"][1])
+            try:
+                self.run_script("batch_recommendations.py", ["--model-dir", content_dir] + self.batch_args)
+                return
+            except (subprocess.CalledProcessError, OSError) as e:
+                logger.error("Error recomputing recommendations: %s", e)
+        with database.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM recommendations")
+                logger.info("Deleted %s precomputed recommendations of the old models", cur.rowcount)
+
+    def check(self):
+        """Rebuild every stale model that was not rebuilt too recently; returns the rebuilt ones"""
+        rebuilt = []
+        published = False
+        for name in self.poll():
+            if name in self.built_at and time.monotonic() - self.built_at[name] < self.min_interval:
+                # Stays pending until min_interval has passed
+                continue
+            try:
+                published = self.rebuild(name) or published
+                rebuilt.append(name)
+            except (subprocess.CalledProcessError, OSError) as e:
+                logger.error("Error rebuilding %s model: %s", name, e)
+        if published:
+            self.refresh_precomputed()
+        return rebuilt
+
+    def run(self, interval=DEFAULT_INTERVAL):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                logger.error("Error checking for model changes: %s", e)
+            time.sleep(interval)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild models when the catalog or interactions change")
+    parser.add_argument("--models", nargs="+", choices=sorted(MODELS), default=["content"])
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL,
+                        help="Seconds between checks for changes")
+    parser.add_argument("--min-interval", type=float, default=DEFAULT_MIN_INTERVAL,
+                        help="Minimum seconds between two rebuilds of the same model")
+    parser.add_argument("--keep", type=int, default=model_store.DEFAULT_KEEP_VERSIONS,
+                        help="Model versions kept after a rebuild")
+    parser.add_argument("--nice", type=int, default=DEFAULT_NICE,
+                        help="Niceness added to the training processes")
+    for name in sorted(MODELS):
+        parser.add_argument(f"--{name}-args", default="",
+                            help=f"Extra arguments for {MODELS[name][0]}, e.g. \"--top-k 50\"")
+    parser.add_argument("--batch", action="store_true",
+                        help="Recompute precomputed recommendations after a rebuild instead of deleting them")
+    parser.add_argument("--batch-args", default="",
+                        help="Extra arguments for batch_recommendations.py, e.g. \"--workers 4\"")
+    parser.add_argument("--once", action="store_true",
+                        help="Check once, rebuild what is stale and exit")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    rebuilder = ModelRebuilder(
+        models=args.models,
+        train_args={name: shlex.split(getattr(args, f"{name}_args")) for name in MODELS},
+        min_interval=args.min_interval,
+        keep=args.keep,
+        nice=args.nice,
+        batch_args=shlex.split(args.batch_args) if args.batch else None,
+    )
+    if args.once:
+        try:
+            rebuilder.check()
+        except Exception as e:
+            print(f"Error rebuilding models: {str(e)}", file=sys.stderr)
+            sys.exit(1)
+        return
+    logger.info("Watching for changes to rebuild %s every %ss", ", ".join(args.models), args.interval)
+    try:
+        rebuilder.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
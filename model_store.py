@@ -0,0 +1,528 @@
+"""Versioned, memory-mapped model artifacts.
+
+A model is stored as a directory of raw .npy arrays plus a manifest:
+
+    models/
+        CURRENT                 name of the live version directory
+        v3/
+            manifest.json       version, catalog fingerprint, build parameters
+            movie_ids.npy       row -> movie id
+            row_hashes.npy      per-row content hash of the training text
+            neighbors_indptr.npy, neighbors_indices.npy, neighbors_scores.npy
+                                top-K neighbour index (CSR), or
+            similarity.npy      dense similarity matrix
+            score_scale.npy     dequantisation factor of int8 scores
+            tfidf_indptr.npy, tfidf_indices.npy, tfidf_data.npy
+                                TF-IDF matrix of the catalog (CSR)
+            tfidf_csc_indptr.npy, tfidf_csc_indices.npy, tfidf_csc_data.npy
+                                the same matrix by column (CSC), for profiles
+            tfidf_idf.npy, tfidf_vocabulary.json
+                                fitted TF-IDF model
+
+Arrays are opened with np.load(mmap_mode="r"), so every server process
+shares the same page-cache pages and loading costs almost nothing.
+Version directories are written to a temporary name and renamed into
+place, and CURRENT is swapped atomically, so readers never observe a
+partially written model. Old versions are deleted with prune_versions()
+(model_rebuilder.py does this after every rebuild); processes that still
+have one memory-mapped keep reading it until they reload.
+
+Legacy cosine_sim.pkl / tfidf_model.pkl files can be converted with:
+    python model_store.py migrate --movies movies.csv
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+
+from scoring import RowIndex
+
+FORMAT_VERSION = 1
+
+# Storage types for similarity scores; int8 keeps a scale factor
+PRECISIONS = ("float64", "float32", "float16", "int8")
+DEFAULT_PRECISION = "float32"
+
+MODEL_DIR = os.environ.get("MODEL_DIR", "models")
+
+# Newest versions kept by prune_versions(); the live one is always kept
+DEFAULT_KEEP_VERSIONS = 3
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+
+class SimilarityModel:
+    """Similarity rows together with the movie id of every row"""
+
+    def __init__(self, similarity, movie_ids, version=None, manifest=None, scale=1.0):
+        self.similarity = similarity
+        self.movie_ids = np.asarray(movie_ids)
+        self.row_of = RowIndex(self.movie_ids)
+        self.version = version
+        self.manifest = manifest or {}
+        # Stored scores times scale are the similarities (int8 storage)
+        self.scale = scale
+
+
+class CSRArrays:
+    """Components of a stored CSR matrix, usable without importing SciPy"""
+
+    def __init__(self, data, indices, indptr, shape):
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = shape
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def tocsr(self):
+        from scipy import sparse
+
+        return sparse.csr_matrix((self.data, self.indices, self.indptr), shape=self.shape, copy=False)
+
+
+class ModelArtifact:
+    """A loaded artifact directory; arrays are memory-mapped on first use"""
+
+    def __init__(self, path, manifest, mmap=True):
+        self.path = path
+        self.manifest = manifest
+        self.version = manifest["version"]
+        self._mmap_mode = "r" if mmap else None
+        self._arrays = {}
+
+    def has(self, name):
+        return os.path.exists(os.path.join(self.path, f"{name}.npy"))
+
+    def array(self, name):
+        """Return a stored array, memory-mapped read-only"""
+        if name not in self._arrays:
+            self._arrays[name] = np.load(
+                os.path.join(self.path, f"{name}.npy"), mmap_mode=self._mmap_mode
+            )
+        return self._arrays[name]
+
+    def csr_arrays(self, prefix, shape, values="data"):
+        return CSRArrays(
+            self.array(f"{prefix}_{values}"),
+            self.array(f"{prefix}_indices"),
+            self.array(f"{prefix}_indptr"),
+            shape,
+        )
+
+    def csr(self, prefix, shape, values="data"):
+        """Rebuild a CSR matrix from its stored component arrays"""
+        return self.csr_arrays(prefix, shape, values).tocsr()
+
+    @property
+    def movie_ids(self):
+        return self.array("movie_ids")
+
+    @property
+    def score_scale(self):
+        return float(self.array("score_scale")[0]) if self.has("score_scale") else 1.0
+
+    def similarity(self, dequantize=False):
+        """The neighbour index (CSR) or dense similarity matrix
+
+        Scores are returned as stored; with dequantize they are converted
+        to float32 similarities (a copy, unless already float32).
+        """
+        n = len(self.movie_ids)
+        if self.has("similarity"):
+            similarity = self.array("similarity")
+        else:
+            similarity = self.csr("neighbors", (n, n), values="scores")
+        if dequantize and similarity.dtype != np.float32:
+            similarity = similarity.astype(np.float32) * np.float32(self.score_scale)
+        return similarity
+
+    def tfidf_matrix(self):
+        return self.csr("tfidf", (len(self.movie_ids), len(self.array("tfidf_idf"))))
+
+    def tfidf_columns(self):
+        """The TF-IDF matrix in CSC form; artifacts without a stored copy are converted"""
+        from scipy import sparse
+
+        if not self.has("tfidf_csc_data"):
+            return self.tfidf_matrix().tocsc()
+        shape = (len(self.movie_ids), len(self.array("tfidf_idf")))
+        return sparse.csc_matrix(
+            (self.array("tfidf_csc_data"), self.array("tfidf_csc_indices"), self.array("tfidf_csc_indptr")),
+            shape=shape,
+        )
+
+    def vocabulary(self):
+        with open(os.path.join(self.path, "tfidf_vocabulary.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def vectorizer(self):
+        """Rebuild the fitted TfidfVectorizer from its vocabulary and idf weights"""
+        from sklearn.feature_extraction.text import TfidfVectorizer
+
+        params = self.manifest.get("params", {}).get("tfidf", {"stop_words": "english"})
+        tfidf = TfidfVectorizer(vocabulary=self.vocabulary(), **params)
+        tfidf.idf_ = np.asarray(self.array("tfidf_idf"))
+        return tfidf
+
+    def similarity_model(self):
+        """Model for serving; a neighbour index is kept as raw CSR arrays (no SciPy)"""
+        n = len(self.movie_ids)
+        if self.has("similarity"):
+            similarity = self.array("similarity")
+        else:
+            similarity = self.csr_arrays("neighbors", (n, n), values="scores")
+        return SimilarityModel(similarity, self.movie_ids, self.version, self.manifest, self.score_scale)
+
+
+def hash_rows(rows, count):
+    """64-bit hash of each tuple of strings in rows"""
+    hashes = np.empty(count, dtype=np.uint64)
+    for i, row in enumerate(rows):
+        digest = hashlib.blake2b("\x1f".join(row).encode("utf-8"), digest_size=8).digest()
+        hashes[i] = int.from_bytes(digest, "little")
+    return hashes
+
+
+def row_hashes(movies_df, columns=("title", "genre", "description")):
+    """64-bit content hash of each movie's training text"""
+    values = movies_df[list(columns)].fillna("").astype(str).itertuples(index=False, name=None)
+    return hash_rows(values, len(movies_df))
+
+
+def catalog_fingerprint(movie_ids, hashes):
+    """Fingerprint of a catalog: its ids in row order and their content hashes"""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(movie_ids, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(hashes, dtype=np.uint64).tobytes())
+    return digest.hexdigest()
+
+
+def version_dir(root, version):
+    return os.path.join(root, f"v{version}")
+
+
+def list_versions(root=MODEL_DIR):
+    """Versions present under root, in ascending order"""
+    if not os.path.isdir(root):
+        return []
+    versions = []
+    for name in os.listdir(root):
+        if name.startswith("v") and name[1:].isdigit():
+            versions.append(int(name[1:]))
+    return sorted(versions)
+
+
+def current_version(root=MODEL_DIR):
+    """The live version, or None when no artifact has been published"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return int(name[1:]) if name.startswith("v") and name[1:].isdigit() else None
+
+
+def set_current(root, version):
+    """Atomically point CURRENT at a version"""
+    tmp_path = os.path.join(root, f"{CURRENT_FILE}.tmp-{os.getpid()}")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(f"v{version}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+
+def prune_versions(root=MODEL_DIR, keep=DEFAULT_KEEP_VERSIONS):
+    """Delete all but the newest keep versions, never the live one
+
+    Returns the deleted versions.
+    """
+    live = current_version(root)
+    versions = list_versions(root)
+    stale = [version for version in versions[:max(0, len(versions) - keep)] if version != live]
+    for version in stale:
+        # Rename first so a half-deleted directory is never mistaken for a version
+        trash = os.path.join(root, f".trash-v{version}-{os.getpid()}")
+        os.rename(version_dir(root, version), trash)
+        shutil.rmtree(trash, ignore_errors=True)
+    return stale
+
+
+def write_artifact(arrays, manifest, root=MODEL_DIR, files=None, publish=True):
+    """Write a new artifact version and return its version number
+
+    arrays maps names to NumPy arrays, files maps file names to JSON-able
+    objects. The version is one above the newest existing version.
+    """
+    os.makedirs(root, exist_ok=True)
+    versions = list_versions(root)
+    version = (versions[-1] if versions else 0) + 1
+
+    tmp_dir = os.path.join(root, f".tmp-v{version}-{os.getpid()}")
+    os.makedirs(tmp_dir)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), np.ascontiguousarray(array))
+        for name, payload in (files or {}).items():
+            with open(os.path.join(tmp_dir, name), "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+
+        manifest = dict(manifest)
+        manifest.update({
+            "format": FORMAT_VERSION,
+            "version": version,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "arrays": sorted(arrays),
+        })
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        os.rename(tmp_dir, version_dir(root, version))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    if publish:
+        set_current(root, version)
+    return version
+
+
+def load_artifact(root=MODEL_DIR, version=None, mmap=True):
+    """Open an artifact version (the current one by default)"""
+    if version is None:
+        version = current_version(root)
+        if version is None:
+            raise FileNotFoundError(f"No model artifact published in '{root}'")
+    path = version_dir(root, version)
+    with open(os.path.join(path, MANIFEST_FILE), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format", 0) > FORMAT_VERSION:
+        raise ValueError(f"Unsupported model artifact format {manifest['format']}")
+    return ModelArtifact(path, manifest, mmap=mmap)
+
+
+def _index_dtype(matrix):
+    """Shared dtype for indptr and indices, so scipy does not copy on load"""
+    return np.int32 if max(matrix.nnz, *matrix.shape) < np.iinfo(np.int32).max else np.int64
+
+
+def quantize(values, precision=DEFAULT_PRECISION, peak=None):
+    """Scores in the given storage precision, and the scale restoring them
+
+    int8 maps [-peak, peak] onto [-127, 127]; larger values saturate.
+    peak defaults to the largest absolute value.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}', expected one of {', '.join(PRECISIONS)}")
+    values = np.asarray(values)
+    if precision != "int8":
+        return values.astype(precision), 1.0
+    if peak is None:
+        peak = float(np.abs(values).max(initial=0))
+    scale = peak / 127 if peak > 0 else 1.0
+    return np.clip(np.rint(values / scale), -127, 127).astype(np.int8), scale
+
+
+def off_diagonal_peak(similarity, block_rows=1024):
+    """Largest absolute similarity between two different movies
+
+    Self-similarity is never ranked, so it should not use up int8 range.
+    """
+    similarity = np.asarray(similarity)
+    peak = 0.0
+    for start in range(0, similarity.shape[0], block_rows):
+        block = np.abs(similarity[start:start + block_rows], dtype=np.float64)
+        rows = np.arange(len(block))
+        in_range = rows + start < similarity.shape[1]
+        block[rows[in_range], rows[in_range] + start] = 0
+        peak = max(peak, float(block.max(initial=0)))
+    return peak
+
+
+def neighbor_arrays(movie_ids, similarity, precision=DEFAULT_PRECISION):
+    """Arrays storing a neighbour index (or dense similarity) and its row ids"""
+    from scipy import sparse
+
+    arrays = {"movie_ids": np.asarray(movie_ids, dtype=np.int64)}
+    if sparse.issparse(similarity):
+        similarity = sparse.csr_matrix(similarity)
+        similarity.sort_indices()
+        index_dtype = _index_dtype(similarity)
+        arrays["neighbors_indptr"] = similarity.indptr.astype(index_dtype)
+        arrays["neighbors_indices"] = similarity.indices.astype(index_dtype)
+        arrays["neighbors_scores"], scale = quantize(similarity.data, precision)
+    else:
+        arrays["similarity"], scale = quantize(similarity, precision, off_diagonal_peak(similarity))
+    if precision == "int8":
+        arrays["score_scale"] = np.array([scale], dtype=np.float64)
+    return arrays
+
+
+def ranking_agreement(reference, stored, scale=1.0, n=10, sample=1000, seed=0):
+    """How well stored scores preserve the ranking of each movie's neighbours
+
+    Compares the top n neighbours of sampled rows under the reference
+    (float64) scores and the stored ones. Returns the mean share of the
+    reference top n that is kept ("overlap") and the share of rows whose
+    top n comes out in exactly the same order ("exact_order").
+    """
+    from scipy import sparse
+
+    n_rows = reference.shape[0]
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(n_rows, min(sample, n_rows), replace=False) if n_rows else []
+
+    def top_n(matrix, row, factor):
+        if sparse.issparse(matrix):
+            start, stop = matrix.indptr[row], matrix.indptr[row + 1]
+            cols = matrix.indices[start:stop]
+            scores = np.asarray(matrix.data[start:stop], dtype=np.float64) * factor
+        else:
+            scores = np.asarray(matrix[row], dtype=np.float64) * factor
+            cols = np.arange(len(scores))
+        keep = (cols != row) & (scores > 0)
+        cols, scores = cols[keep], scores[keep]
+        return cols[np.lexsort((cols, -scores))][:n].tolist()
+
+    overlaps, exact = [], []
+    for row in rows:
+        expected = top_n(reference, row, 1.0)
+        if not expected:
+            continue
+        actual = top_n(stored, row, scale)
+        overlaps.append(len(set(expected) & set(actual)) / len(expected))
+        exact.append(expected == actual)
+    return {
+        "overlap": float(np.mean(overlaps)) if overlaps else 1.0,
+        "exact_order": float(np.mean(exact)) if exact else 1.0,
+        "rows": len(overlaps),
+    }
+
+
+def content_arrays(movie_ids, hashes, similarity, tfidf=None, tfidf_matrix=None,
+                   precision=DEFAULT_PRECISION):
+    """Arrays and files making up a content model artifact"""
+    from scipy import sparse
+
+    arrays = neighbor_arrays(movie_ids, similarity, precision)
+    arrays["row_hashes"] = np.asarray(hashes, dtype=np.uint64)
+    files = {}
+
+    if tfidf is not None:
+        vocabulary = {term: int(column) for term, column in tfidf.vocabulary_.items()}
+        files["tfidf_vocabulary.json"] = vocabulary
+        arrays["tfidf_idf"] = np.asarray(tfidf.idf_, dtype=np.float64)
+    if tfidf_matrix is not None:
+        tfidf_matrix = sparse.csr_matrix(tfidf_matrix)
+        tfidf_matrix.sort_indices()
+        index_dtype = _index_dtype(tfidf_matrix)
+        arrays["tfidf_indptr"] = tfidf_matrix.indptr.astype(index_dtype)
+        arrays["tfidf_indices"] = tfidf_matrix.indices.astype(index_dtype)
+        arrays["tfidf_data"] = tfidf_matrix.data.astype(np.float32)
+        columns = tfidf_matrix.tocsc()
+        columns.sort_indices()
+        arrays["tfidf_csc_indptr"] = columns.indptr.astype(index_dtype)
+        arrays["tfidf_csc_indices"] = columns.indices.astype(index_dtype)
+        arrays["tfidf_csc_data"] = columns.data.astype(np.float32)
+    return arrays, files
+
+
+def save_content_model(movie_ids, hashes, similarity, tfidf=None, tfidf_matrix=None,
+                       params=None, root=MODEL_DIR, precision=DEFAULT_PRECISION):
+    """Write a content-similarity model artifact and publish it"""
+    arrays, files = content_arrays(movie_ids, hashes, similarity, tfidf, tfidf_matrix, precision)
+    manifest = {
+        "kind": "content",
+        "n_movies": len(movie_ids),
+        "catalog_fingerprint": catalog_fingerprint(movie_ids, hashes),
+        "params": params or {},
+    }
+    return write_artifact(arrays, manifest, root=root, files=files)
+
+
+def migrate_pickles(movies_df, cosine_sim_path="cosine_sim.pkl", tfidf_path="tfidf_model.pkl",
+                    root=MODEL_DIR):
+    """Convert legacy pickled models into an artifact
+
+    movies_df must list the movies in the row order the pickles were
+    trained with, so that each similarity row gets its movie id.
+    """
+    with open(cosine_sim_path, "rb") as f:
+        similarity = pickle.load(f)
+    if similarity.shape[0] != len(movies_df):
+        raise ValueError(
+            f"{cosine_sim_path} has {similarity.shape[0]} rows but the catalog has {len(movies_df)} movies"
+        )
+
+    tfidf = None
+    if tfidf_path and os.path.exists(tfidf_path):
+        with open(tfidf_path, "rb") as f:
+            tfidf = pickle.load(f)
+
+    return save_content_model(
+        movies_df["id"].to_numpy(),
+        row_hashes(movies_df),
+        similarity,
+        tfidf=tfidf,
+        params={"migrated_from": os.path.basename(cosine_sim_path)},
+        root=root,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage model artifacts")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate = subparsers.add_parser("migrate", help="Convert cosine_sim.pkl / tfidf_model.pkl")
+    migrate.add_argument("--movies", help="CSV the pickles were trained from (default: the database)")
+    migrate.add_argument("--cosine-sim", default="cosine_sim.pkl")
+    migrate.add_argument("--tfidf", default="tfidf_model.pkl")
+    migrate.add_argument("--model-dir", default=MODEL_DIR)
+
+    show = subparsers.add_parser("show", help="Print the manifest of the current model")
+    show.add_argument("--model-dir", default=MODEL_DIR)
+
+    prune = subparsers.add_parser("prune", help="Delete old model versions")
+    prune.add_argument("--model-dir", default=MODEL_DIR)
+    prune.add_argument("--keep", type=int, default=DEFAULT_KEEP_VERSIONS,
+                       help="Newest versions to keep (the live one is never deleted)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "migrate":
+        if args.movies:
+            from train_model import load_movies
+            movies_df = load_movies(args.movies)
+        else:
+            from get_recommendations import get_movies_from_db
+            movies_df = get_movies_from_db()
+        version = migrate_pickles(movies_df, args.cosine_sim, args.tfidf, args.model_dir)
+        print(f"Migrated {args.cosine_sim} to version {version} in '{args.model_dir}'")
+    elif args.command == "show":
+        try:
+            artifact = load_artifact(args.model_dir)
+        except FileNotFoundError as e:
+            print(str(e), file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(artifact.manifest, indent=2))
+    elif args.command == "prune":
+        removed = prune_versions(args.model_dir, args.keep)
+        print(f"Deleted {len(removed)} old versions from '{args.model_dir}'")
+
+
+if __name__ == "__main__":
+    main()
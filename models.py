@@ -1,7 +1,7 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, SmallInteger, String, Boolean, Float, ForeignKey, DateTime, LargeBinary, BigInteger
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import UniqueConstraint, text
 
 Base = declarative_base()
 
@@ -26,6 +26,13 @@ class Movie(Base):
     rating = Column(Integer)
     release_year = Column(Integer)
     poster_url = Column(String)
+    # MovieLens movieId and hash of the imported row, matched by import_movielens_data.py
+    movielens_id = Column(Integer, unique=True, index=True)
+    content_hash = Column(String(32))
+    updated_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"), nullable=False, index=True)
+    # catalog_version value of the statement that last wrote the row, set by a
+    # trigger; catalog.py refreshes from rows changed since its snapshot
+    change_id = Column(BigInteger, server_default=text("0"), nullable=False, index=True)
 
     # Relationships
     interactions = relationship("UserInteraction", back_populates="movie")
@@ -46,4 +53,41 @@ class UserInteraction(Base):
 
     # Relationships
     user = relationship("User", back_populates="interactions")
-    movie = relationship("Movie", back_populates="interactions")
\ No newline at end of file
+    movie = relationship("Movie", back_populates="interactions")
+
+class Recommendation(Base):
+    __tablename__ = "recommendations"
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    rank = Column(SmallInteger, primary_key=True)
+    movie_id = Column(Integer, ForeignKey("movies.id", ondelete="CASCADE"), nullable=False)
+    score = Column(Float, nullable=False)
+    model_version = Column(Integer)
+    computed_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"), nullable=False, index=True)
+
+class CatalogVersion(Base):
+    __tablename__ = "catalog_version"
+
+    # Single row, bumped by a trigger on every statement writing movies
+    id = Column(Boolean, server_default=text("TRUE"), primary_key=True)
+    version = Column(BigInteger, server_default=text("0"), nullable=False)
+
+class MoviePopularity(Base):
+    __tablename__ = "movie_popularity"
+
+    # like_count is maintained by triggers on user_interactions, and a trigger on
+    # movies inserts the row of every new movie; see popularity.py
+    movie_id = Column(Integer, ForeignKey("movies.id", ondelete="CASCADE"), primary_key=True)
+    like_count = Column(Integer, server_default=text("0"), nullable=False)
+    trending_score = Column(Float, server_default=text("0"), nullable=False)
+
+class UserProfile(Base):
+    __tablename__ = "user_profiles"
+
+    # Sparse sum of the TF-IDF rows of the user's liked movies; see profiles.py
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    model_version = Column(Integer, nullable=False)
+    liked_ids = Column(LargeBinary, nullable=False)  # int64 movie ids
+    terms = Column(LargeBinary, nullable=False)      # int32 term columns
+    weights = Column(LargeBinary, nullable=False)    # float32 weights
+    updated_at = Column(DateTime, server_default=text("CURRENT_TIMESTAMP"), nullable=False)
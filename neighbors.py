@@ -0,0 +1,203 @@
+"""Sparse top-K neighbour index for content similarity.
+
+Instead of the dense N x N cosine similarity matrix, only the K most
+similar movies of every movie are kept, as a scipy CSR matrix whose row i
+holds the neighbours of row i and their scores. Memory is O(N * K).
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+DEFAULT_TOP_K = 50
+
+# Upper bound on dense similarity cells materialised per block
+DEFAULT_BLOCK_CELLS = 20_000_000
+
+# Approximate bytes held per similarity cell while a block is computed and
+# reduced: the sparse product (float64 value and int32 column, 12 bytes per
+# nonzero, at worst one per cell), its float64 dense copy and the int64
+# argpartition result
+BYTES_PER_CELL = 28
+
+# TF-IDF matrix shared with pool workers, set once per worker process
+_worker_matrix = None
+_worker_transposed = None
+
+
+def default_block_size(n_rows, block_cells=DEFAULT_BLOCK_CELLS):
+    """Number of rows per block so that a dense block stays bounded"""
+    return max(1, min(n_rows, block_cells // max(n_rows, 1)))
+
+
+def matrix_bytes(matrix):
+    """Memory held by a CSR or CSC matrix's arrays"""
+    return matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+
+
+def block_size_for_memory(n_rows, max_memory_mb, n_jobs=1, matrix_size=0):
+    """Rows per block so that n_jobs concurrent blocks fit in max_memory_mb
+
+    matrix_size is the size in bytes of the TF-IDF matrix. Every worker
+    holds a copy of it and of its transpose, which comes off the budget
+    before the blocks are sized. Python and library overhead is not
+    counted, so the real peak is somewhat above the budget.
+    """
+    n_jobs = max(n_jobs, 1)
+    budget = max_memory_mb * 1024 * 1024 / n_jobs - 2 * matrix_size
+    budget_cells = int(max(budget, 0) / BYTES_PER_CELL)
+    return default_block_size(n_rows, budget_cells)
+
+
+def block_top_k(similarities, row_ids, k):
+    """Reduce a dense block of similarity rows to their top-k neighbours
+
+    Row i of similarities holds the scores of row row_ids[i] against every
+    column. The movie itself and non-positive scores are dropped.
+    Returns (rows, cols, scores) arrays.
+    """
+    n_rows, n_cols = similarities.shape
+    rows = np.arange(n_rows)
+    row_ids = np.asarray(row_ids)
+    # Exclude each movie from its own neighbour list
+    in_range = row_ids < n_cols
+    similarities[rows[in_range], row_ids[in_range]] = -np.inf
+
+    k = min(k, n_cols)
+    if k == 0:
+        empty = np.empty(0)
+        return empty.astype(np.int64), empty.astype(np.int64), empty.astype(np.float32)
+    if k < n_cols:
+        # Partition in place of negating so no second dense copy is made
+        cols = np.argpartition(similarities, n_cols - k, axis=1)[:, n_cols - k:]
+    else:
+        cols = np.tile(np.arange(n_cols), (n_rows, 1))
+    scores = np.take_along_axis(similarities, cols, axis=1)
+
+    keep = scores > 0
+    block_rows = np.repeat(row_ids, k).reshape(n_rows, k)
+    return block_rows[keep], cols[keep], scores[keep].astype(np.float32)
+
+
+def rows_top_k(tfidf_matrix, row_ids, k, block_size=None):
+    """Top-k neighbours of selected rows against the whole matrix"""
+    tfidf_matrix = sparse.csr_matrix(tfidf_matrix)
+    row_ids = np.asarray(row_ids, dtype=np.int64)
+    if block_size is None:
+        block_size = default_block_size(tfidf_matrix.shape[0])
+    transposed = tfidf_matrix.T.tocsc()
+    results = []
+    for start in range(0, len(row_ids), block_size):
+        block = row_ids[start:start + block_size]
+        similarities = (tfidf_matrix[block] @ transposed).toarray()
+        results.append(block_top_k(similarities, block, k))
+    return results
+
+
+def merge_top_k(rows, cols, scores, k):
+    """Keep the k best (col, score) entries of every row
+
+    Duplicate (row, col) pairs keep their first occurrence.
+    """
+    rows, cols, scores = np.asarray(rows), np.asarray(cols), np.asarray(scores)
+    _, first = np.unique(rows * (int(cols.max(initial=0)) + 1) + cols, return_index=True)
+    rows, cols, scores = rows[first], cols[first], scores[first]
+
+    order = np.lexsort((cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    # Rank of each entry within its row
+    row_starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+    counts = np.diff(np.r_[row_starts, len(rows)])
+    ranks = np.arange(len(rows)) - np.repeat(row_starts, counts)
+    keep = ranks < k
+    return rows[keep], cols[keep], scores[keep]
+
+
+def _block_neighbors(tfidf_matrix, transposed, start, stop, k):
+    """Top-k neighbours of rows start..stop, computed as one dense block"""
+    similarities = (tfidf_matrix[start:stop] @ transposed).toarray()
+    return block_top_k(similarities, np.arange(start, stop), k)
+
+
+def _init_worker(tfidf_matrix):
+    global _worker_matrix, _worker_transposed
+    _worker_matrix = tfidf_matrix
+    _worker_transposed = tfidf_matrix.T.tocsc()
+
+
+def _worker_block(block):
+    start, stop, k = block
+    return _block_neighbors(_worker_matrix, _worker_transposed, start, stop, k)
+
+
+def top_k_neighbors(tfidf_matrix, k=DEFAULT_TOP_K, block_size=None, n_jobs=1, max_memory_mb=None):
+    """Build the top-k cosine neighbour index of L2-normalised TF-IDF rows
+
+    Rows are processed in blocks so that only block_size x N similarities
+    are held in memory at once; each block is reduced to its top-k before
+    the next one is computed. With n_jobs > 1 blocks are spread over a
+    process pool. When max_memory_mb is given and block_size is not, the
+    block size is chosen so that all workers' blocks fit in that budget.
+    """
+    tfidf_matrix = sparse.csr_matrix(tfidf_matrix)
+    n_rows = tfidf_matrix.shape[0]
+    if n_jobs is None or n_jobs < 1:
+        n_jobs = os.cpu_count() or 1
+    if block_size is None:
+        if max_memory_mb:
+            block_size = block_size_for_memory(n_rows, max_memory_mb, n_jobs, matrix_bytes(tfidf_matrix))
+        else:
+            block_size = default_block_size(n_rows)
+
+    blocks = [(start, min(start + block_size, n_rows), k) for start in range(0, n_rows, block_size)]
+
+    if n_jobs == 1 or len(blocks) <= 1:
+        transposed = tfidf_matrix.T.tocsc()
+        results = [_block_neighbors(tfidf_matrix, transposed, *block) for block in blocks]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=min(n_jobs, len(blocks)),
+            initializer=_init_worker,
+            initargs=(tfidf_matrix,),
+        ) as executor:
+            results = list(executor.map(_worker_block, blocks))
+
+    all_rows, all_cols, all_scores = zip(*results) if results else ([], [], [])
+    return assemble_index(all_rows, all_cols, all_scores, n_rows)
+
+
+def assemble_index(all_rows, all_cols, all_scores, n_rows):
+    """Combine per-block (rows, cols, scores) triples into a CSR index"""
+    if all_rows:
+        rows = np.concatenate(all_rows)
+        cols = np.concatenate(all_cols)
+        scores = np.concatenate(all_scores)
+    else:
+        rows = cols = np.empty(0, dtype=np.int64)
+        scores = np.empty(0, dtype=np.float32)
+    index = sparse.csr_matrix((scores, (rows, cols)), shape=(n_rows, n_rows), dtype=np.float32)
+    index.sort_indices()
+    return index
+
+
+def empty_index(n_rows):
+    """Neighbour index in which no movie has any neighbours"""
+    return sparse.csr_matrix((n_rows, n_rows), dtype=np.float32)
+
+
+def most_similar(similarity, idx, n=5):
+    """Row positions of the n movies most similar to row idx
+
+    Works with both a dense similarity matrix and a sparse neighbour index.
+    The movie itself is never returned.
+    """
+    if sparse.issparse(similarity):
+        start, stop = similarity.indptr[idx], similarity.indptr[idx + 1]
+        cols = similarity.indices[start:stop]
+        scores = similarity.data[start:stop]
+        order = np.lexsort((cols, -scores))
+        return [int(c) for c in cols[order] if c != idx][:n]
+
+    sim_scores = sorted(enumerate(similarity[idx]), key=lambda x: x[1], reverse=True)
+    return [i for i, _ in sim_scores if i != idx][:n]
@@ -0,0 +1,110 @@
+"""Maintained per-movie popularity for the cold-start fallback.
+
+movie_popularity holds each movie's like count, kept current by
+statement-level triggers on user_interactions (see the alembic migrations;
+another trigger adds a zero row for every new movie), so "most liked" is a
+top-N scan of an index instead of a GROUP BY over every interaction.
+trending_score is an exponentially decayed like count,
+
+    trending_score = sum over likes of 0.5 ** (age / half_life)
+
+recomputed by `refresh`, e.g. hourly from cron.
+
+Usage:
+    python popularity.py backfill
+    python popularity.py refresh --half-life 7
+"""
+import argparse
+import os
+import sys
+
+import database
+
+DEFAULT_HALF_LIFE_DAYS = 7.0
+
+# Order of the popular list: all-time likes or the decayed trending score,
+# each read by a prepared statement in database.STATEMENTS
+ORDERS = ("likes", "trending")
+POPULAR_ORDER = os.environ.get("POPULAR_ORDER", "likes")
+
+
+def top_movies(cur, limit=10, exclude_ids=(), order=POPULAR_ORDER):
+    """Ids of the most popular movies with at least one like, excluding exclude_ids"""
+    if order not in ORDERS:
+        raise ValueError(f"Unknown popularity order '{order}'")
+    exclude = set(exclude_ids)
+    # Over-fetch by the excluded ids rather than filtering in SQL, so the
+    # statement stays a plain top-N index scan
+    database.execute(cur, f"popular_{order}", [limit + len(exclude)])
+    return [movie_id for (movie_id,) in cur.fetchall() if movie_id not in exclude][:limit]
+
+
+def backfill(conn):
+    """Recount every movie's likes from user_interactions
+
+    Writes to user_interactions are blocked while counting, so the
+    triggers can't apply a delta to a count that is being replaced.
+    """
+    with conn.cursor() as cur:
+        cur.execute("LOCK TABLE user_interactions IN SHARE MODE")
+        cur.execute("""
+            INSERT INTO movie_popularity (movie_id, like_count)
+            SELECT movies.id, COUNT(user_interactions.movie_id)
+            FROM movies
+            LEFT JOIN user_interactions
+                ON user_interactions.movie_id = movies.id AND user_interactions.liked = TRUE
+            GROUP BY movies.id
+            ON CONFLICT (movie_id) DO UPDATE SET like_count = EXCLUDED.like_count
+        """)
+        movies = cur.rowcount
+    conn.commit()
+    return movies
+
+
+def refresh_trending(conn, half_life_days=DEFAULT_HALF_LIFE_DAYS):
+    """Recompute the decayed trending score of every movie"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE movie_popularity
+            SET trending_score = COALESCE(recent.score, 0)
+            FROM movie_popularity AS current
+            LEFT JOIN (
+                SELECT movie_id,
+                       SUM(POWER(0.5, EXTRACT(EPOCH FROM (NOW() - created_at)) / %s)) AS score
+                FROM user_interactions
+                WHERE liked = TRUE AND created_at IS NOT NULL
+                GROUP BY movie_id
+            ) AS recent ON recent.movie_id = current.movie_id
+            WHERE movie_popularity.movie_id = current.movie_id
+              AND movie_popularity.trending_score IS DISTINCT FROM COALESCE(recent.score, 0)
+        """, [half_life_days * 86400])
+        movies = cur.rowcount
+    conn.commit()
+    return movies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild the movie_popularity table")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("backfill", help="Recount all-time likes per movie")
+    refresh = subparsers.add_parser("refresh", help="Recompute the time-decayed trending scores")
+    refresh.add_argument("--half-life", type=float, default=DEFAULT_HALF_LIFE_DAYS,
+                         help="Days after which a like counts half")
+    args = parser.parse_args(argv)
+
+    try:
+        conn = database.connect()
+        try:
+            if args.command == "backfill":
+                print(f"Recounted likes of {backfill(conn)} movies")
+            else:
+                print(f"Updated trending scores of {refresh_trending(conn, args.half_life)} movies")
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"Error rebuilding popularity: {str(e)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
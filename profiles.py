@@ -0,0 +1,273 @@
+"""Persisted per-user taste profiles over the TF-IDF vocabulary.
+
+A user's profile is the sum of the TF-IDF rows of the movies they like,
+
+    profile(u) = sum over liked movies m of tfidf[m]
+
+stored sparsely (term ids and weights) in user_profiles together with
+the liked ids it was built from and the model version whose vocabulary
+it uses. Scoring normalises it and takes one sparse product with the
+catalog's TF-IDF matrix, the cosine between the profile and every movie,
+so the cost no longer depends on how many movies the user has liked.
+
+A like or unlike changes the profile by one TF-IDF row. The service
+adds or subtracts only the difference and saves the profile as soon as
+server.js reports an interaction (RecommendationService.invalidate).
+Reads never write on the request thread: when the stored liked ids
+are behind the user's current likes (a missed notification), the
+difference is applied in memory for that request only. A profile that
+is missing or of another model version is rebuilt from scratch, and the
+rebuilt profile is queued for a background writer (write-behind), so
+after a model version bump each user is rebuilt once, not on every read.
+
+Enabled with CONTENT_SCORING=profile; needs a model artifact that
+stores the TF-IDF matrix (train_model.py writes one).
+"""
+import logging
+import queue
+import threading
+
+import numpy as np
+from scipy import sparse
+
+import database
+import metrics
+from scoring import RowIndex, lookup_rows, rank
+
+# Profile weights this close to zero are left over from subtracting a
+# row again and are dropped
+EPSILON = 1e-6
+
+# Rebuilt profiles waiting for the background writer; beyond this they
+# are dropped and rebuilt again on the user's next read
+MAX_PENDING_SAVES = 10000
+
+logger = logging.getLogger("recommendations")
+
+
+class UserProfile:
+    """Sparse sum of liked movies' TF-IDF rows"""
+
+    def __init__(self, model_version, liked_ids, terms, weights):
+        self.model_version = model_version
+        self.liked_ids = np.unique(np.asarray(liked_ids, dtype=np.int64))
+        self.terms = np.asarray(terms, dtype=np.int32)
+        self.weights = np.asarray(weights, dtype=np.float32)
+
+    @classmethod
+    def empty(cls, model_version):
+        return cls(model_version, [], [], [])
+
+    def vector(self, n_terms):
+        return sparse.csr_matrix(
+            (self.weights.astype(np.float64), self.terms, [0, len(self.terms)]), shape=(1, n_terms)
+        )
+
+    def update(self, tfidf, added_rows, removed_rows, liked_ids):
+        """Add the TF-IDF rows of new likes and subtract those of removed ones"""
+        n_terms = tfidf.shape[1]
+        rows = np.concatenate([added_rows, removed_rows]).astype(np.int64)
+        signs = np.concatenate([np.ones(len(added_rows)), -np.ones(len(removed_rows))])
+        total = self.vector(n_terms)
+        if len(rows):
+            total = (total + sparse.csr_matrix(signs[np.newaxis, :]) @ tfidf[rows]).tocsr()
+        total.sum_duplicates()
+        keep = np.abs(total.data) > EPSILON
+        self.terms = total.indices[keep].astype(np.int32)
+        self.weights = total.data[keep].astype(np.float32)
+        self.liked_ids = np.unique(np.asarray(liked_ids, dtype=np.int64))
+
+
+def load_profile(cur, user_id, for_update=False):
+    """The stored profile of a user, or None"""
+    if for_update:
+        cur.execute(
+            "SELECT model_version, liked_ids, terms, weights FROM user_profiles "
+            "WHERE user_id = %s FOR UPDATE",
+            [user_id],
+        )
+    else:
+        database.execute(cur, "user_profile", [user_id])
+    row = cur.fetchone()
+    if row is None:
+        return None
+    model_version, liked_ids, terms, weights = row
+    return UserProfile(
+        model_version,
+        np.frombuffer(liked_ids, dtype=np.int64),
+        np.frombuffer(terms, dtype=np.int32),
+        np.frombuffer(weights, dtype=np.float32),
+    )
+
+
+def save_profile(cur, user_id, profile):
+    cur.execute("""
+        INSERT INTO user_profiles (user_id, model_version, liked_ids, terms, weights, updated_at)
+        VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id) DO UPDATE SET
+            model_version = EXCLUDED.model_version,
+            liked_ids = EXCLUDED.liked_ids,
+            terms = EXCLUDED.terms,
+            weights = EXCLUDED.weights,
+            updated_at = EXCLUDED.updated_at
+    """, [
+        user_id,
+        profile.model_version,
+        profile.liked_ids.tobytes(),
+        profile.terms.tobytes(),
+        profile.weights.tobytes(),
+    ])
+
+
+def save_rebuilt_profile(cur, user_id, profile):
+    """Store a profile rebuilt on a read, unless one of its model version is stored
+
+    A profile of the same version was saved by ProfileEngine.refresh
+    from likes at least as recent, so it is left alone.
+    """
+    cur.execute("""
+        INSERT INTO user_profiles (user_id, model_version, liked_ids, terms, weights, updated_at)
+        VALUES (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+        ON CONFLICT (user_id) DO UPDATE SET
+            model_version = EXCLUDED.model_version,
+            liked_ids = EXCLUDED.liked_ids,
+            terms = EXCLUDED.terms,
+            weights = EXCLUDED.weights,
+            updated_at = EXCLUDED.updated_at
+        WHERE user_profiles.model_version <> EXCLUDED.model_version
+    """, [
+        user_id,
+        profile.model_version,
+        profile.liked_ids.tobytes(),
+        profile.terms.tobytes(),
+        profile.weights.tobytes(),
+    ])
+
+
+def fetch_liked_ids(cur, user_id):
+    cur.execute("SELECT movie_id FROM user_interactions WHERE user_id = %s AND liked = TRUE", [user_id])
+    return [row[0] for row in cur.fetchall()]
+
+
+class ProfileEngine:
+    """Scores the catalog against a user's stored TF-IDF profile
+
+    Exposes the same interface as scoring.ScoringEngine, so it can stand
+    in for the content engine and be blended with the other models.
+    """
+
+    def __init__(self, artifact, connection=database.connection):
+        self.version = artifact.version
+        self.movie_ids = artifact.movie_ids
+        self.row_of = RowIndex(self.movie_ids)
+        self.n_movies = len(self.movie_ids)
+        self.tfidf = artifact.tfidf_matrix()
+        # Column slices of the catalog matrix touch only the profile's terms
+        self.tfidf_columns = artifact.tfidf_columns()
+        self.connection = connection
+        self._saves = queue.Queue(MAX_PENDING_SAVES)
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._writer = None
+
+    def rows_for(self, movie_ids):
+        return lookup_rows(self.row_of, movie_ids)
+
+    def reconcile(self, profile, liked_ids):
+        """Bring a profile (possibly None or of another version) up to date with liked_ids
+
+        Returns the profile and whether it changed.
+        """
+        liked = np.unique(np.asarray(liked_ids, dtype=np.int64))
+        if profile is None or profile.model_version != self.version:
+            profile = UserProfile.empty(self.version)
+        elif np.array_equal(profile.liked_ids, liked):
+            return profile, False
+        added, _ = self.rows_for(np.setdiff1d(liked, profile.liked_ids))
+        removed, _ = self.rows_for(np.setdiff1d(profile.liked_ids, liked))
+        profile.update(self.tfidf, added, removed, liked)
+        return profile, True
+
+    def profile_for(self, user_id, liked_movie_ids):
+        """The user's stored profile, brought up to date with their likes in memory
+
+        A profile rebuilt from scratch is saved in the background.
+        """
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                stored = load_profile(cur, user_id)
+        profile = self.reconcile(stored, liked_movie_ids)[0]
+        if stored is None or stored.model_version != self.version:
+            self.save_later(user_id, profile)
+        return profile
+
+    def save_later(self, user_id, profile):
+        """Queue a rebuilt profile for the background writer"""
+        with self._pending_lock:
+            if user_id in self._pending:
+                return
+            try:
+                self._saves.put_nowait((user_id, profile))
+            except queue.Full:
+                return
+            self._pending.add(user_id)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_behind, name="profile-writer", daemon=True)
+                self._writer.start()
+
+    def _write_behind(self):
+        while True:
+            user_id, profile = self._saves.get()
+            try:
+                with self.connection() as conn:
+                    with conn.cursor() as cur:
+                        save_rebuilt_profile(cur, user_id, profile)
+            except Exception as e:
+                # The next read rebuilds and queues the profile again
+                logger.error("Error saving profile of user %s: %s", user_id, e)
+                metrics.error("profile_save", e)
+            finally:
+                with self._pending_lock:
+                    self._pending.discard(user_id)
+                self._saves.task_done()
+
+    def flush(self):
+        """Wait until every queued profile has been saved"""
+        self._saves.join()
+
+    def refresh(self, user_id):
+        """Apply a user's latest likes to their stored profile"""
+        with self.connection() as conn:
+            with conn.cursor() as cur:
+                profile = load_profile(cur, user_id, for_update=True)
+                profile, changed = self.reconcile(profile, fetch_liked_ids(cur, user_id))
+                if changed:
+                    save_profile(cur, user_id, profile)
+        return profile
+
+    def catalog_scores(self, liked_movie_ids, weights=None, user_id=None):
+        """Cosine of every movie with the user's profile, or None if it is empty
+
+        Recency weights change with every like, so weighted profiles are
+        summed from the liked rows instead of being stored.
+        """
+        uniform = weights is None or np.all(np.asarray(weights) == 1)
+        if user_id is not None and uniform:
+            profile = self.profile_for(user_id, liked_movie_ids)
+        else:
+            rows, positions = self.rows_for(liked_movie_ids)
+            row_weights = np.ones(len(rows)) if weights is None else np.asarray(weights, dtype=np.float64)[positions]
+            total = sparse.csr_matrix(row_weights[np.newaxis, :]) @ self.tfidf[rows]
+            profile = UserProfile(self.version, liked_movie_ids, total.indices, total.data)
+        norm = np.linalg.norm(profile.weights.astype(np.float64))
+        if norm == 0:
+            return None
+        columns = self.tfidf_columns[:, profile.terms]
+        return np.asarray(columns @ (profile.weights.astype(np.float64) / norm)).ravel()
+
+    def score(self, liked_movie_ids, n=10, weights=None, exclude_ids=(), user_id=None):
+        """Top n (movie_id, score) pairs, excluding liked movies and exclude_ids"""
+        scores = self.catalog_scores(liked_movie_ids, weights, user_id)
+        if scores is None:
+            return []
+        return rank(self, scores, liked_movie_ids, n, exclude_ids)
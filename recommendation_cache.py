@@ -0,0 +1,168 @@
+"""Per-user cache of recommendation results.
+
+Entries are keyed by user id and model version, evicted least recently
+used first and expire after a TTL. A result computed against another
+model version is never returned. Writes to user_interactions invalidate
+the user's entry; computations that started before an invalidation are
+not stored, so a stale result cannot slip back in.
+
+SingleFlight lets concurrent misses for the same key share one
+computation instead of each doing it.
+"""
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_SIZE = 10000
+DEFAULT_TTL = 300
+
+
+class RecommendationCache:
+    """Thread-safe LRU + TTL cache of recommendation results"""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        # user id -> (model version, expires at, result)
+        self._entries = OrderedDict()
+        # user id -> sequence number of the user's latest invalidation
+        self._invalidated = OrderedDict()
+        # Results computed before this sequence number are never stored
+        self._floor = 0
+        self._sequence = itertools.count(1)
+        self._last_sequence = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self, user_id):
+        """Changes whenever the user's cached results are invalidated"""
+        with self._lock:
+            return max(self._floor, self._invalidated.get(user_id, 0))
+
+    def token(self):
+        """Snapshot to take before computing a result that will be put()"""
+        with self._lock:
+            return self._last_sequence
+
+    def get(self, user_id, model_version):
+        """Cached result for the user under model_version, or None"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                version, expires_at, result = entry
+                if version == model_version and expires_at > self._clock():
+                    self._entries.move_to_end(user_id)
+                    self.hits += 1
+                    return result
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, user_id, model_version, result, token=None):
+        """Store a result unless the user was invalidated after token"""
+        with self._lock:
+            if token is not None:
+                if token < self._floor or self._invalidated.get(user_id, 0) > token:
+                    return False
+            self._entries[user_id] = (model_version, self._clock() + self.ttl, result)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def invalidate_user(self, user_id):
+        """Drop the user's entry and reject results already in flight"""
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._last_sequence = next(self._sequence)
+            self._invalidated[user_id] = self._last_sequence
+            self._invalidated.move_to_end(user_id)
+            while len(self._invalidated) > self.max_size:
+                # Forgetting an invalidation raises the floor for everyone
+                _, sequence = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, sequence)
+            self.invalidations += 1
+
+    def clear(self):
+        """Drop every entry, e.g. after a model reload"""
+        with self._lock:
+            self._entries.clear()
+            self._last_sequence = next(self._sequence)
+            self._floor = self._last_sequence
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+class _Call:
+    """A computation in flight and, once done, its outcome"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """At most one call in flight per key; concurrent callers share its outcome"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """Return (result, shared) of func for key
+
+        The first caller runs func; callers arriving while it runs wait
+        for it and get the same result (or exception), with shared=True.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            calls = self.leaders + self.followers
+            return {
+                "in_flight": len(self._calls),
+                "computed": self.leaders,
+                "coalesced": self.followers,
+                "coalesced_rate": self.followers / calls if calls else 0.0,
+            }
@@ -0,0 +1,388 @@
+"""Long-lived recommendation service.
+
+Loads the similarity model and movie catalog once and answers
+GET /recommendations?userId=<id> with the same JSON list that
+get_recommendations.py prints, so server.js can call it instead of
+spawning a Python process per request.
+
+Results are cached per user and model version, and concurrent requests
+for the same user share one computation. server.js calls
+POST /invalidate?userId=<id> whenever the user's interactions change,
+which also updates the user's stored taste profile when
+CONTENT_SCORING=profile.
+
+Response rows come from an in-memory catalog snapshot (see catalog.py).
+At most every --catalog-refresh seconds a request checks the movies
+table's fingerprint and, if it changed, pulls just the changed rows.
+
+At most every --model-refresh seconds a request also checks whether a
+new model version was published (see model_rebuilder.py). If so, the new
+model is loaded on a background thread and swapped in at once; requests
+keep using the old one until then.
+
+GET /metrics serves per-stage timings and counters in the Prometheus
+text format, and every request is logged as a JSON line.
+
+Run with:
+    python get_recommendations.py --serve --port 5001
+    python get_recommendations.py --serve --socket /tmp/recommender.sock
+"""
+import argparse
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import catalog
+import database
+import get_recommendations
+import metrics
+import model_store
+from recommendation_cache import DEFAULT_MAX_SIZE, DEFAULT_TTL, RecommendationCache, SingleFlight
+
+logger = logging.getLogger("recommendation_service")
+
+# Seconds between checks of the movies table for catalog changes
+DEFAULT_CATALOG_REFRESH = 30.0
+# Seconds between checks for a newly published model version
+DEFAULT_MODEL_REFRESH = 10.0
+
+
+class RecommendationService:
+    """Keeps the model and catalog warm between requests"""
+
+    def __init__(self, model_path="cosine_sim.pkl", neighbors_path="neighbors.npz",
+                 model_dir=model_store.MODEL_DIR, cache=None, catalog_dir=catalog.CATALOG_DIR,
+                 catalog_refresh=DEFAULT_CATALOG_REFRESH, model_refresh=DEFAULT_MODEL_REFRESH):
+        self.model_path = model_path
+        self.neighbors_path = neighbors_path
+        self.model_dir = model_dir
+        self.cache = cache if cache is not None else RecommendationCache()
+        self.flights = SingleFlight()
+        self.catalog_dir = catalog_dir
+        self.catalog_refresh = catalog_refresh
+        self.model_refresh = model_refresh
+        self.model_dirs = get_recommendations.model_dirs(model_dir)
+        self.catalog = None
+        self.model = None
+        self.engine = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._catalog_checked = 0.0
+        self._reload_lock = threading.Lock()
+        self._model_checked = 0.0
+        self._model_versions = None
+
+    def model_versions(self):
+        """Live version of every model the engine uses"""
+        return tuple(model_store.current_version(path) for path in self.model_dirs)
+
+    def load(self):
+        """Load (or reload) the movie catalog and similarity model"""
+        # Read before loading, so a version published meanwhile triggers another reload
+        versions = self.model_versions()
+        movies = get_recommendations.get_catalog(self.catalog_dir)
+        model = get_recommendations.load_similarity(
+            movies, self.model_path, self.neighbors_path, self.model_dir
+        )
+        fingerprint = model.manifest.get("catalog_fingerprint")
+        if fingerprint and fingerprint != model_store.catalog_fingerprint(movies.ids, movies.row_hashes()):
+            logger.warning("Model version %s was trained on a different catalog", model.version)
+        engine = get_recommendations.build_engine(model)
+        # Swap everything at once so requests never see a mismatched pair
+        with self._lock:
+            self.catalog, self.model, self.engine = movies, model, engine
+            self._catalog_checked = time.monotonic()
+            self._model_versions = versions
+            self._model_checked = time.monotonic()
+        # Cached results may refer to movies that are no longer in the catalog
+        self.cache.clear()
+        metrics.set_model_version(engine.version)
+        logger.info("Loaded %d movies, model version %s", len(movies), engine.version)
+
+    def refresh_catalog(self, force=False):
+        """Pull catalog changes if the last check is older than catalog_refresh
+
+        Only one thread refreshes at a time; the others keep serving from
+        the current snapshot. Returns the ids that changed.
+        """
+        if not force and time.monotonic() - self._catalog_checked < self.catalog_refresh:
+            return []
+        if not self._refresh_lock.acquire(blocking=False):
+            return []
+        try:
+            self._catalog_checked = time.monotonic()
+            with metrics.stage("catalog_refresh"):
+                with database.connection() as conn:
+                    movies, changed = catalog.sync_catalog(conn, self.catalog, self.catalog_dir)
+            if changed:
+                with self._lock:
+                    self.catalog = movies
+                # Cached rows may show stale details of the changed movies
+                self.cache.clear()
+                logger.info("Catalog refreshed, %d movies changed", len(changed))
+            return changed
+        except Exception as e:
+            logger.error("Error refreshing catalog: %s", e)
+            metrics.error("catalog_refresh", e)
+            return []
+        finally:
+            self._refresh_lock.release()
+
+    def refresh_model(self, force=False):
+        """Reload in the background if a new model version was published
+
+        Checks at most every model_refresh seconds. Returns whether a
+        reload was started.
+        """
+        if not force and time.monotonic() - self._model_checked < self.model_refresh:
+            return False
+        if not self._reload_lock.acquire(blocking=False):
+            return False
+        self._model_checked = time.monotonic()
+        if self.model_versions() == self._model_versions:
+            self._reload_lock.release()
+            return False
+        thread = threading.Thread(target=self._reload, name="model-reload", daemon=True)
+        thread.start()
+        return True
+
+    def _reload(self):
+        try:
+            with metrics.stage("model_reload"):
+                self.load()
+        except Exception as e:
+            # Keep serving the previous model; the next check retries
+            logger.error("Error reloading model: %s", e)
+            metrics.error("model_reload", e)
+        finally:
+            self._reload_lock.release()
+
+    def recommend(self, user_id):
+        """Return recommendation records for a user"""
+        try:
+            user_id = int(user_id)
+        except (ValueError, TypeError):
+            logger.warning("Invalid user ID format: %s", user_id)
+            return []
+
+        self.refresh_catalog()
+        self.refresh_model()
+        with self._lock:
+            movies, engine = self.catalog, self.engine
+
+        metrics.annotate(model_version=engine.version)
+        token = self.cache.token()
+        cached = self.cache.get(user_id, engine.version)
+        if cached is not None:
+            metrics.count("recommendation_cache_total", result="hit")
+            metrics.annotate(cache="hit")
+            return cached
+        metrics.count("recommendation_cache_total", result="miss")
+        metrics.annotate(cache="miss")
+
+        def compute():
+            liked_movie_ids = get_recommendations.get_liked_movies(user_id)
+            if not liked_movie_ids or movies is None or movies.empty:
+                recommendations = []
+            else:
+                recommendations = metrics.profiled(
+                    get_recommendations.recommend, liked_movie_ids, movies, engine, user_id=user_id
+                )
+            self.cache.put(user_id, engine.version, recommendations, token)
+            return recommendations
+
+        # Concurrent misses for the same user and model share one computation;
+        # an invalidation starts a new one
+        key = (user_id, engine.version, self.cache.generation(user_id))
+        recommendations, shared = self.flights.do(key, compute)
+        metrics.count("recommendation_singleflight_total", role="follower" if shared else "leader")
+        if shared:
+            metrics.annotate(coalesced=True)
+        return recommendations
+
+    def invalidate(self, user_id):
+        """Forget a user's cached recommendations and update their taste profile"""
+        from profiles import ProfileEngine
+
+        user_id = int(user_id)
+        self.cache.invalidate_user(user_id)
+        with self._lock:
+            engine = self.engine
+        for candidate, _ in getattr(engine, "engines", [(engine, 1.0)]):
+            if isinstance(candidate, ProfileEngine):
+                try:
+                    candidate.refresh(user_id)
+                except Exception as e:
+                    # Requests reconcile the stale profile in memory until the next update
+                    logger.error("Error updating profile of user %s: %s", user_id, e)
+                    metrics.error("profile_update", e)
+
+
+class RecommendationHandler(BaseHTTPRequestHandler):
+    """HTTP front end for a RecommendationService"""
+
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/recommendations":
+            user_id = parse_qs(url.query).get("userId", [None])[0]
+            with metrics.request(user_id=user_id, mode="service"):
+                try:
+                    recommendations = self.service.recommend(user_id)
+                except Exception as e:
+                    logger.error("Error in recommendation system: %s", e)
+                    metrics.error("request", e)
+                    recommendations = []
+                metrics.annotate(result_count=len(recommendations))
+                with metrics.stage("serialize"):
+                    body = json.dumps(recommendations).encode("utf-8")
+            self._send_body(200, body)
+        elif url.path == "/health":
+            self._send_json(200, {"status": "ok"})
+        elif url.path == "/stats":
+            self._send_json(200, {
+                "cache": self.service.cache.stats(),
+                "singleflight": self.service.flights.stats(),
+                "metrics": metrics.REGISTRY.snapshot(),
+            })
+        elif url.path == "/metrics":
+            body = metrics.REGISTRY.prometheus_text().encode("utf-8")
+            self._send_body(200, body, "text/plain; version=0.0.4; charset=utf-8")
+        else:
+            self._send_json(404, {"message": "Not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/invalidate":
+            user_id = parse_qs(url.query).get("userId", [None])[0]
+            try:
+                self.service.invalidate(user_id)
+                self._send_json(200, {"status": "invalidated"})
+            except (ValueError, TypeError):
+                self._send_json(400, {"message": "Valid user ID is required"})
+        elif url.path == "/reload":
+            try:
+                self.service.load()
+                self._send_json(200, {"status": "reloaded"})
+            except Exception as e:
+                logger.error("Error reloading model: %s", e)
+                self._send_json(500, {"message": str(e)})
+        else:
+            self._send_json(404, {"message": "Not found"})
+
+    def _send_json(self, status, payload):
+        self._send_body(status, json.dumps(payload).encode("utf-8"))
+
+    def _send_body(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Unix socket peers have no address, so don't rely on client_address
+        logger.debug(format, *args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server listening on a Unix domain socket"""
+
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) style address
+        return request, ("unix", 0)
+
+
+def create_server(service, host="127.0.0.1", port=5001, socket_path=None):
+    """Create an HTTP server bound to a TCP port or a Unix socket"""
+    handler = type("Handler", (RecommendationHandler,), {"service": service})
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_metrics_writer(path, interval):
+    """Periodically write the metrics registry to a textfile in the background"""
+    def write_forever():
+        while True:
+            try:
+                metrics.REGISTRY.write_textfile(path)
+            except OSError as e:
+                logger.error("Error writing metrics to %s: %s", path, e)
+            time.sleep(interval)
+
+    thread = threading.Thread(target=write_forever, name="metrics-writer", daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve movie recommendations over HTTP")
+    parser.add_argument("--host", default=os.environ.get("RECOMMENDER_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("RECOMMENDER_PORT", 5001)))
+    parser.add_argument("--socket", default=os.environ.get("RECOMMENDER_SOCKET"),
+                        help="Listen on a Unix domain socket instead of a TCP port")
+    parser.add_argument("--model", default="cosine_sim.pkl")
+    parser.add_argument("--neighbors", default="neighbors.npz")
+    parser.add_argument("--model-dir", default=model_store.MODEL_DIR)
+    parser.add_argument("--cache-size", type=int,
+                        default=int(os.environ.get("RECOMMENDATION_CACHE_SIZE", DEFAULT_MAX_SIZE)),
+                        help="Maximum number of users with cached recommendations")
+    parser.add_argument("--cache-ttl", type=float,
+                        default=float(os.environ.get("RECOMMENDATION_CACHE_TTL", DEFAULT_TTL)),
+                        help="Seconds a cached result stays valid")
+    parser.add_argument("--catalog-dir", default=catalog.CATALOG_DIR)
+    parser.add_argument("--catalog-refresh", type=float,
+                        default=float(os.environ.get("CATALOG_REFRESH_INTERVAL", DEFAULT_CATALOG_REFRESH)),
+                        help="Seconds between checks of the movies table for changes")
+    parser.add_argument("--model-refresh", type=float,
+                        default=float(os.environ.get("MODEL_REFRESH_INTERVAL", DEFAULT_MODEL_REFRESH)),
+                        help="Seconds between checks for a newly published model version")
+    parser.add_argument("--metrics-file", default=os.environ.get("METRICS_FILE"),
+                        help="Also write Prometheus metrics to this file every --metrics-interval seconds")
+    parser.add_argument("--metrics-interval", type=float, default=15.0)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    service = RecommendationService(
+        model_path=args.model,
+        neighbors_path=args.neighbors,
+        model_dir=args.model_dir,
+        cache=RecommendationCache(max_size=args.cache_size, ttl=args.cache_ttl),
+        catalog_dir=args.catalog_dir,
+        catalog_refresh=args.catalog_refresh,
+        model_refresh=args.model_refresh,
+    )
+    service.load()
+
+    if args.metrics_file:
+        start_metrics_writer(args.metrics_file, args.metrics_interval)
+
+    server = create_server(service, args.host, args.port, args.socket)
+    logger.info("Recommendation service listening on %s", args.socket or f"{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
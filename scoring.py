@@ -0,0 +1,212 @@
+"""Vectorised scoring of candidate movies against a user's liked movies.
+
+The similarity rows of all liked movies are combined in a single NumPy
+pass (a weighted sum), already-liked movies are masked out, and the top N
+are picked with argpartition. Works with both the sparse neighbour index
+and a dense similarity matrix.
+"""
+import numpy as np
+
+
+def recency_weights(n_liked, half_life=None):
+    """Weights for liked movies ordered from most to least recent
+
+    With a half_life (counted in likes) the weight halves every half_life
+    likes further back in the history; otherwise all likes weigh the same.
+    """
+    if not half_life:
+        return np.ones(n_liked)
+    return 0.5 ** (np.arange(n_liked) / float(half_life))
+
+
+def sparse_row_sum(indptr, indices, data, rows, weights, n_cols):
+    """Weighted sum of CSR rows, computed with NumPy only"""
+    starts = indptr[rows]
+    lengths = indptr[rows + 1] - starts
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(n_cols)
+    # Position of every stored entry of the selected rows
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    positions = offsets + np.arange(total)
+    values = data[positions] * np.repeat(weights, lengths)
+    return np.bincount(indices[positions], weights=values, minlength=n_cols)
+
+
+def top_n_rows(scores, n):
+    """Row positions of the n highest positive scores, best first
+
+    Ties are broken by row position so the ranking is deterministic.
+    """
+    candidates = np.flatnonzero(scores > 0)
+    if len(candidates) > n:
+        candidates = candidates[np.argpartition(-scores[candidates], n - 1)[:n]]
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order]
+
+
+class RowIndex:
+    """Row of every movie id, found by binary search instead of a dict
+
+    Nothing is computed until the first lookup, which checks whether the
+    ids are sorted (they are for models trained from the database) and
+    sorts a copy only if not, so opening a large memory-mapped model
+    stays cheap.
+    """
+
+    def __init__(self, movie_ids):
+        self.movie_ids = movie_ids
+        self._sorted_ids = None
+        self.order = None
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    @property
+    def sorted_ids(self):
+        if self._sorted_ids is None:
+            ids = np.asarray(self.movie_ids, dtype=np.int64).reshape(-1)
+            if len(ids) > 1 and not bool(np.all(ids[1:] > ids[:-1])):
+                self.order = np.argsort(ids, kind="stable")
+                ids = ids[self.order]
+            self._sorted_ids = ids
+        return self._sorted_ids
+
+    def find(self, movie_ids):
+        """Row of every id, -1 for unknown ids"""
+        ids = np.asarray(movie_ids, dtype=np.int64).reshape(-1)
+        if not len(self.sorted_ids):
+            return np.full(len(ids), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.sorted_ids, ids), len(self.sorted_ids) - 1)
+        found = self.sorted_ids[positions] == ids
+        rows = positions if self.order is None else self.order[positions]
+        return np.where(found, rows, -1).astype(np.int64)
+
+    def get(self, movie_id, default=None):
+        row = int(self.find([movie_id])[0])
+        return default if row < 0 else row
+
+    def __contains__(self, movie_id):
+        return self.get(movie_id) is not None
+
+
+def lookup_rows(row_of, movie_ids):
+    """Rows of the given movie ids; unknown ids are dropped
+
+    Returns the rows and the positions in movie_ids they came from.
+    """
+    if isinstance(row_of, RowIndex):
+        rows = row_of.find(list(movie_ids))
+        positions = np.flatnonzero(rows >= 0)
+        return rows[positions], positions
+    rows, positions = [], []
+    for position, movie_id in enumerate(movie_ids):
+        row = row_of.get(int(movie_id))
+        if row is not None:
+            rows.append(row)
+            positions.append(position)
+    return np.asarray(rows, dtype=np.int64), np.asarray(positions, dtype=np.int64)
+
+
+class ScoringEngine:
+    """Scores the whole catalog for a set of liked movies in one pass"""
+
+    def __init__(self, model):
+        self.model = model
+        self.movie_ids = model.movie_ids
+        self.row_of = model.row_of
+        self.n_movies = len(model.movie_ids)
+        self.version = model.version
+
+    def rows_for(self, movie_ids):
+        return lookup_rows(self.row_of, movie_ids)
+
+    def aggregate(self, rows, weights):
+        """Weighted sum of the similarity rows of the liked movies"""
+        similarity = self.model.similarity
+        # A SciPy CSR matrix or model_store.CSRArrays
+        if hasattr(similarity, "indptr"):
+            scores = sparse_row_sum(
+                similarity.indptr, similarity.indices, similarity.data, rows, weights, self.n_movies
+            )
+        else:
+            scores = np.asarray(weights, dtype=np.float64) @ np.asarray(similarity[rows], dtype=np.float64)
+        # Quantised (int8) scores are stored divided by the model's scale
+        if self.model.scale != 1.0:
+            scores *= self.model.scale
+        return scores
+
+    def catalog_scores(self, liked_movie_ids, weights=None, user_id=None):
+        """Score of every row of the model, or None if no liked movie is known
+
+        user_id is accepted for engines that keep per-user state; the
+        neighbourhood models only look at the liked movies.
+        """
+        rows, positions = self.rows_for(liked_movie_ids)
+        if len(rows) == 0:
+            return None
+        if weights is None:
+            row_weights = np.ones(len(rows))
+        else:
+            row_weights = np.asarray(weights, dtype=np.float64)[positions]
+        return self.aggregate(rows, row_weights)
+
+    def score(self, liked_movie_ids, n=10, weights=None, exclude_ids=(), user_id=None):
+        """Top n (movie_id, score) pairs for a user's liked movies
+
+        weights, when given, has one entry per liked movie. Liked movies
+        and exclude_ids are never returned.
+        """
+        scores = self.catalog_scores(liked_movie_ids, weights, user_id)
+        if scores is None:
+            return []
+        return rank(self, scores, liked_movie_ids, n, exclude_ids)
+
+
+def rank(engine, scores, liked_movie_ids, n, exclude_ids=()):
+    """Top n (movie_id, score) pairs of a score vector over engine's rows"""
+    excluded, _ = engine.rows_for(list(liked_movie_ids) + list(exclude_ids))
+    scores[excluded] = -np.inf
+    best = top_n_rows(scores, n)
+    return [(int(engine.movie_ids[row]), float(scores[row])) for row in best]
+
+
+class BlendedEngine:
+    """Weighted blend of several engines, ranked in the first engine's rows
+
+    Each engine's scores are scaled to a maximum of 1 before blending so
+    that models with different score ranges mix according to the weights.
+    Movies unknown to the first engine are never returned.
+    """
+
+    def __init__(self, engines):
+        self.engines = [(engine, float(weight)) for engine, weight in engines if weight > 0]
+        base = engines[0][0]
+        self.movie_ids = base.movie_ids
+        self.row_of = base.row_of
+        self.n_movies = base.n_movies
+        self.version = "+".join(str(engine.version) for engine, _ in self.engines)
+        # Position of each engine's rows in the base engine, -1 when missing
+        self._to_base = []
+        for engine, _ in self.engines:
+            self._to_base.append(self.row_of.find(engine.movie_ids))
+
+    def rows_for(self, movie_ids):
+        return lookup_rows(self.row_of, movie_ids)
+
+    def score(self, liked_movie_ids, n=10, weights=None, exclude_ids=(), user_id=None):
+        blended = np.zeros(self.n_movies)
+        found = False
+        for (engine, weight), mapping in zip(self.engines, self._to_base):
+            scores = engine.catalog_scores(liked_movie_ids, weights, user_id)
+            if scores is None:
+                continue
+            found = True
+            peak = scores.max(initial=0)
+            if peak <= 0:
+                continue
+            known = mapping >= 0
+            np.add.at(blended, mapping[known], weight * scores[known] / peak)
+        if not found:
+            return []
+        return rank(self, blended, liked_movie_ids, n, exclude_ids)
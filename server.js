@@ -6,9 +6,117 @@ const jwt = require("jsonwebtoken");
 const pool = require("./db");
 const cors = require("cors");
 const { PythonShell } = require("python-shell");
+const http = require("http");
 const app = express();
 const PORT = process.env.PORT || 5000;
 
+// Long-lived recommendation service (python get_recommendations.py --serve).
+// When neither variable is set we fall back to spawning the Python script.
+const RECOMMENDER_URL = process.env.RECOMMENDER_URL;
+const RECOMMENDER_SOCKET = process.env.RECOMMENDER_SOCKET;
+// Milliseconds to wait for the service before giving up on it
+const RECOMMENDER_TIMEOUT_MS = parseInt(
+  process.env.RECOMMENDER_TIMEOUT_MS || "2000",
+  10
+);
+
+// Call the recommendation service and resolve with its parsed JSON response.
+// Rejects on connection errors, error statuses and timeouts.
+const requestRecommender = (method, path) =>
+  new Promise((resolve, reject) => {
+    const target = RECOMMENDER_SOCKET
+      ? [{ socketPath: RECOMMENDER_SOCKET, path, method }]
+      : [new URL(path, RECOMMENDER_URL), { method }];
+    const req = http.request(...target, (response) => {
+      let body = "";
+      response.setEncoding("utf8");
+      response.on("data", (chunk) => (body += chunk));
+      response.on("end", () => {
+        if (response.statusCode >= 400) {
+          return reject(
+            new Error(`Recommendation service returned ${response.statusCode}`)
+          );
+        }
+        try {
+          resolve(JSON.parse(body));
+        } catch (parseError) {
+          reject(parseError);
+        }
+      });
+      response.on("error", reject);
+    });
+    req.setTimeout(RECOMMENDER_TIMEOUT_MS, () =>
+      req.destroy(
+        new Error(
+          `Recommendation service timed out after ${RECOMMENDER_TIMEOUT_MS}ms`
+        )
+      )
+    );
+    req.on("error", reject);
+    req.end();
+  });
+
+// Run get_recommendations.py for one user and send its output
+const sendScriptRecommendations = (userId, res) => {
+  const options = {
+    args: [userId],
+  };
+
+  PythonShell.run("get_recommendations.py", options, (err, results) => {
+    if (err) {
+      console.error("Error running Python script:", err);
+      return res.status(500).json({
+        message: "Server error",
+        error: err.message,
+        recommendations: [],
+      });
+    }
+
+    try {
+      // Parse the results safely
+      const recommendations =
+        results && results.length > 0 ? JSON.parse(results[0]) : [];
+
+      res.json(recommendations);
+    } catch (parseError) {
+      console.error("Error parsing recommendations:", parseError);
+      res.status(500).json({
+        message: "Error parsing recommendations",
+        error: parseError.message,
+        recommendations: [],
+      });
+    }
+  });
+};
+
+// A user's interactions changed: drop their precomputed recommendations and
+// tell the recommendation service to forget its cached ones. Resolves once
+// both are done, so the next /recommendations sees the change. Failures are
+// logged, never surfaced.
+const invalidateRecommendations = async (userId) => {
+  const pending = [
+    pool
+      .query("DELETE FROM recommendations WHERE user_id = $1", [userId])
+      .catch((err) =>
+        console.error(
+          "Error clearing precomputed recommendations:",
+          err.message
+        )
+      ),
+  ];
+  if (RECOMMENDER_URL || RECOMMENDER_SOCKET) {
+    pending.push(
+      requestRecommender(
+        "POST",
+        `/invalidate?userId=${encodeURIComponent(userId)}`
+      ).catch((err) =>
+        console.error("Error invalidating recommendations:", err.message)
+      )
+    );
+  }
+  await Promise.all(pending);
+};
+
 // Middleware to parse JSON
 app.use(cors({ origin: "http://localhost:3000", credentials: true }));
 app.use(express.json());
@@ -85,13 +193,13 @@ app.post("/login", async (req, res) => {
 // Get popular movies (most liked)
 app.get("/movies/popular", async (req, res) => {
   try {
+    // Like counts are maintained by triggers (see popularity.py), and every
+    // movie gets a zero row when inserted, so movies nobody liked yet are listed too
     const popularMovies = await pool.query(`
-      SELECT movies.*, COUNT(user_interactions.movie_id) as likes 
-      FROM movies 
-      LEFT JOIN user_interactions ON movies.id = user_interactions.movie_id 
-      AND user_interactions.liked = true 
-      GROUP BY movies.id 
-      ORDER BY likes DESC 
+      SELECT movies.*, movie_popularity.like_count as likes 
+      FROM movie_popularity 
+      JOIN movies ON movies.id = movie_popularity.movie_id 
+      ORDER BY movie_popularity.like_count DESC, movie_popularity.movie_id 
       LIMIT 10
     `);
     res.json(popularMovies.rows);
@@ -126,6 +234,7 @@ app.post("/movies/:id/like", async (req, res) => {
       [userId, id]
     );
 
+    await invalidateRecommendations(userId);
     res.json({ message: "Like updated successfully" });
   } catch (err) {
     console.error("Like error:", err);
@@ -148,6 +257,7 @@ app.post("/movies/:id/dislike", async (req, res) => {
       [userId, id]
     );
 
+    await invalidateRecommendations(userId);
     res.json({ message: "Dislike updated successfully" });
   } catch (err) {
     console.error("Dislike error:", err);
@@ -170,6 +280,7 @@ app.post("/movies/:id/watch-later", async (req, res) => {
       [userId, id]
     );
 
+    await invalidateRecommendations(userId);
     res.json({ message: "Watch later updated successfully" });
   } catch (err) {
     console.error("Watch later error:", err);
@@ -320,36 +431,39 @@ app.get("/recommendations", async (req, res) => {
       });
     }
 
-    // Fetch recommendations using Python script
-    const options = {
-      args: [userId],
-    };
-
-    PythonShell.run("get_recommendations.py", options, (err, results) => {
-      if (err) {
-        console.error("Error running Python script:", err);
-        return res.status(500).json({
-          message: "Server error",
-          error: err.message,
-          recommendations: [],
-        });
-      }
+    // Serve precomputed recommendations (get_recommendations.py --batch)
+    const precomputed = await pool.query(
+      `SELECT movies.id, movies.title, movies.description, movies.genre,
+              movies.rating, movies.release_year, movies.poster_url
+       FROM recommendations
+       JOIN movies ON movies.id = recommendations.movie_id
+       WHERE recommendations.user_id = $1
+       ORDER BY recommendations.rank`,
+      [userId]
+    );
+    if (precomputed.rows.length > 0) {
+      return res.json(precomputed.rows);
+    }
 
+    // Prefer the long-lived recommendation service when it is configured
+    if (RECOMMENDER_URL || RECOMMENDER_SOCKET) {
       try {
-        // Parse the results safely
-        const recommendations =
-          results && results.length > 0 ? JSON.parse(results[0]) : [];
-
-        res.json(recommendations);
-      } catch (parseError) {
-        console.error("Error parsing recommendations:", parseError);
-        res.status(500).json({
-          message: "Error parsing recommendations",
-          error: parseError.message,
-          recommendations: [],
-        });
+        const recommendations = await requestRecommender(
+          "GET",
+          `/recommendations?userId=${encodeURIComponent(userId)}`
+        );
+        return res.json(recommendations);
+      } catch (serviceError) {
+        // Still answer, the slow way
+        console.error(
+          "Error calling recommendation service, running the script instead:",
+          serviceError.message
+        );
       }
-    });
+    }
+
+    // Fetch recommendations using Python script
+    sendScriptRecommendations(userId, res);
   } catch (err) {
     console.error("Error fetching recommendations:", err);
     res.status(500).json({
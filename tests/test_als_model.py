@@ -0,0 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy import sparse
+
+from als_model import ALSEngine, als_step, factorize, interaction_matrix, likes_hash
+
+
+def random_strengths(n_users=30, n_movies=20, density=0.2, seed=0):
+    matrix = sparse.random(n_users, n_movies, density=density, random_state=seed, format="csr")
+    matrix.data = np.where(matrix.data > 0.5, 1.0, 0.5)
+    return matrix
+
+
+def dense_solve(strengths, fixed, regularization, alpha):
+    """Closed-form implicit ALS factors, one dense solve per row"""
+    dense = strengths.toarray()
+    solved = []
+    for row in dense:
+        confidence = np.diag(1.0 + alpha * row)
+        preference = (row > 0).astype(np.float64)
+        lhs = fixed.T @ confidence @ fixed + regularization * np.eye(fixed.shape[1])
+        solved.append(np.linalg.solve(lhs, fixed.T @ confidence @ preference))
+    return np.array(solved)
+
+
+def implicit_loss(strengths, users, items, regularization, alpha):
+    dense = strengths.toarray()
+    confidence = 1.0 + alpha * dense
+    errors = (dense > 0) - users @ items.T
+    return (confidence * errors ** 2).sum() + regularization * ((users ** 2).sum() + (items ** 2).sum())
+
+
+def test_als_step_matches_dense_closed_form():
+    strengths = random_strengths()
+    rng = np.random.default_rng(1)
+    items = rng.normal(size=(strengths.shape[1], 4))
+    expected = dense_solve(strengths, items, 0.1, 40.0)
+    for block_size, workers in ((1, 1), (7, 3), (100, 2)):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            got = als_step(strengths * 40.0, items, 0.1, block_size, executor)
+        np.testing.assert_allclose(got, expected, rtol=1e-8, atol=1e-10)
+
+
+def test_factorize_decreases_the_loss():
+    strengths = random_strengths(seed=3)
+    losses = []
+    for iterations in (1, 3, 10):
+        users, items = factorize(strengths, factors=4, iterations=iterations, regularization=0.1,
+                                 alpha=10.0, block_size=8, workers=2)
+        losses.append(implicit_loss(strengths, users.astype(np.float64), items.astype(np.float64), 0.1, 10.0))
+    assert losses[0] >= losses[1] >= losses[2] * (1 - 1e-6)
+
+
+class Artifact:
+    def __init__(self, arrays, manifest):
+        self.arrays = arrays
+        self.manifest = manifest
+        self.version = 1
+        self.movie_ids = arrays["movie_ids"]
+
+    def has(self, name):
+        return name in self.arrays
+
+    def array(self, name):
+        return self.arrays[name]
+
+
+def test_fold_in_matches_a_user_half_step():
+    strengths = random_strengths(seed=5)
+    rng = np.random.default_rng(2)
+    items = rng.normal(size=(strengths.shape[1], 4))
+    engine = ALSEngine(Artifact({
+        "movie_ids": np.arange(strengths.shape[1]) + 100,
+        "item_factors": items.astype(np.float32),
+        "user_ids": np.empty(0, dtype=np.int64),
+        "user_factors": np.empty((0, 4), dtype=np.float32),
+        "user_like_hashes": np.empty(0, dtype=np.uint64),
+        "item_gram": items.T.astype(np.float32).astype(np.float64) @ items.astype(np.float32).astype(np.float64),
+    }, {"params": {"alpha": 40.0, "regularization": 0.1}}))
+
+    row = strengths[0]
+    assert row.nnz > 0
+    got = engine.fold_in(row.indices, row.data)
+    expected = dense_solve(row, items.astype(np.float32).astype(np.float64), 0.1, 40.0)[0]
+    np.testing.assert_allclose(got, expected, rtol=1e-6)
+
+
+def test_stored_factor_is_used_only_for_the_same_liked_movies():
+    # (user, movie, strength): a like is 1, a watch-later mark 0.5
+    interactions = [(1, 10, 1.0), (1, 11, 1.5), (1, 12, 0.5), (2, 11, 1.0)]
+    _, user_ids, movie_ids, like_hashes = interaction_matrix(interactions)
+    assert like_hashes[0] == likes_hash([11, 10])
+    items = np.random.default_rng(3).normal(size=(len(movie_ids), 2)).astype(np.float32)
+    engine = ALSEngine(Artifact({
+        "movie_ids": movie_ids,
+        "item_factors": items,
+        "user_ids": user_ids,
+        "user_factors": np.array([[5.0, 5.0], [6.0, 6.0]], dtype=np.float32),
+        "user_like_hashes": like_hashes,
+        "item_gram": items.T.astype(np.float64) @ items.astype(np.float64),
+    }, {"params": {"alpha": 40.0, "regularization": 0.1}}))
+
+    assert engine.stored_factor(1, [11, 10]).tolist() == [5.0, 5.0]
+    # Same number of likes, but one was swapped for another movie
+    assert engine.stored_factor(1, [10, 12]) is None
+    assert engine.stored_factor(2, [11]).tolist() == [6.0, 6.0]
+    assert engine.stored_factor(3, [11]) is None
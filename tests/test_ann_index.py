@@ -0,0 +1,75 @@
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from ann_index import ann_neighbors, exact_scores, measure_recall, rescore
+from neighbors import top_k_neighbors
+
+
+def clustered_tfidf(n_rows=400, n_terms=300, n_topics=12, seed=0):
+    """L2-normalised rows drawing most of their terms from one topic each"""
+    rng = np.random.default_rng(seed)
+    topics = [rng.choice(n_terms, size=30, replace=False) for _ in range(n_topics)]
+    rows, cols = [], []
+    for row in range(n_rows):
+        terms = np.r_[rng.choice(topics[row % n_topics], size=8), rng.choice(n_terms, size=2)]
+        rows += [row] * len(terms)
+        cols += terms.tolist()
+    # Continuous weights, so neighbours are not tied
+    matrix = sparse.csr_matrix((rng.random(len(rows)) + 0.1, (rows, cols)), shape=(n_rows, n_terms))
+    return normalize(matrix)
+
+
+def test_ann_index_recalls_the_exact_neighbours():
+    tfidf = clustered_tfidf()
+    exact = top_k_neighbors(tfidf, k=10)
+    index = ann_neighbors(tfidf, k=10, n_components=32, n_probe=8)
+    assert index.shape == exact.shape
+    recall = measure_recall(tfidf, index, k=10, sample=400)
+    assert recall >= 0.9
+    # Probing fewer lists finds fewer of the exact neighbours
+    fewer = ann_neighbors(tfidf, k=10, n_components=32, n_probe=2)
+    assert measure_recall(tfidf, fewer, k=10, sample=400) < recall
+    # Every stored score is the exact cosine, never the projected one
+    rows = np.repeat(np.arange(index.shape[0]), np.diff(index.indptr))
+    np.testing.assert_allclose(index.data, exact_scores(tfidf, rows, index.indices), rtol=1e-5)
+    assert not np.any(rows == index.indices)
+
+
+def test_probing_every_list_finds_the_exact_index():
+    tfidf = clustered_tfidf(n_rows=150, seed=1)
+    exact = top_k_neighbors(tfidf, k=5)
+    index = ann_neighbors(tfidf, k=5, n_components=16, n_lists=6, n_probe=6, rerank=40)
+    assert measure_recall(tfidf, index, k=5, sample=150) == 1.0
+    assert np.array_equal(np.diff(index.indptr), np.diff(exact.indptr))
+
+
+def test_measure_recall_counts_missing_neighbours():
+    tfidf = clustered_tfidf(n_rows=100, seed=2)
+    exact = top_k_neighbors(tfidf, k=5)
+    assert measure_recall(tfidf, exact, k=5, sample=100) == 1.0
+    empty = sparse.csr_matrix(exact.shape, dtype=np.float32)
+    assert measure_recall(tfidf, empty, k=5, sample=100) == 0.0
+
+
+def test_rescore_blocks_agree():
+    tfidf = clustered_tfidf(n_rows=120, seed=3)
+    rng = np.random.default_rng(0)
+    cand_cols = np.array([rng.choice(np.delete(np.arange(120), row), 20, replace=False) for row in range(120)])
+    cand_cols[::7, -3:] = -1
+    whole = rescore(tfidf, cand_cols, 5, block_rows=1000)
+    blocked = rescore(tfidf, cand_cols, 5, block_rows=7)
+    assert (whole != blocked).nnz == 0
+    dense = (tfidf @ tfidf.T).toarray()
+    for row in range(120):
+        cols = cand_cols[row][cand_cols[row] >= 0]
+        best = np.sort(dense[row, cols])[::-1][:5]
+        got = np.sort(whole.data[whole.indptr[row]:whole.indptr[row + 1]])[::-1]
+        np.testing.assert_allclose(got, best[best > 0], rtol=1e-5)
+
+
+def test_tiny_catalogs():
+    assert ann_neighbors(clustered_tfidf(n_rows=1), k=5).nnz == 0
+    index = ann_neighbors(clustered_tfidf(n_rows=3, n_topics=1), k=5)
+    assert index.shape == (3, 3)
+    assert np.all(np.diff(index.indptr) <= 2)
@@ -0,0 +1,106 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from batch_recommendations import BatchScorer, changed_users, score_chunk_with_engine
+from model_store import SimilarityModel
+from scoring import ScoringEngine, recency_weights
+
+
+def random_model(n=40, seed=0):
+    matrix = sparse.random(n, n, density=0.3, random_state=seed, format="csr", dtype=np.float64)
+    matrix = (matrix + matrix.T).tocsr()
+    matrix.setdiag(0)
+    matrix.eliminate_zeros()
+    return SimilarityModel(matrix, np.arange(n) * 3 + 1)
+
+
+def test_sparse_chunk_matches_engine_scoring():
+    model = random_model()
+    rng = np.random.default_rng(2)
+    user_ids = [5, 6, 7, 8]
+    liked = [list(rng.choice(model.movie_ids, size=k, replace=False)) for k in (1, 3, 6, 0)]
+    scorer = BatchScorer(model, ScoringEngine(model))
+    assert scorer.similarity is not None
+
+    fast = scorer.score_chunk(user_ids, liked, n=5, half_life=2)
+    slow = score_chunk_with_engine(ScoringEngine(model), user_ids, liked, n=5, half_life=2)
+    fast_users, fast_ranks, fast_movies, fast_scores = fast
+    slow_users, slow_ranks, slow_movies, slow_scores = slow
+    assert fast_users.tolist() == slow_users.tolist()
+    assert fast_ranks.tolist() == slow_ranks.tolist()
+    np.testing.assert_allclose(fast_scores, slow_scores)
+    assert_same_top_n(model, user_ids, liked, fast, slow, half_life=2)
+
+
+def by_user(result):
+    users, _, movies, scores = result
+    grouped = {}
+    for user, movie, score in zip(users.tolist(), movies.tolist(), scores.tolist()):
+        grouped.setdefault(user, []).append((movie, score))
+    return grouped
+
+
+def assert_same_top_n(model, user_ids, liked, fast, slow, half_life):
+    """Both results are top-n lists of the dense reference, equal up to tie order
+
+    Movies sharing a score must form the same set, except in the lowest
+    group, which may be cut at n differently; there each movie only has
+    to carry that score in the reference.
+    """
+    dense = model.similarity.toarray()
+    fast, slow = by_user(fast), by_user(slow)
+    assert fast.keys() == slow.keys()
+    for user, fast_top in fast.items():
+        user_liked = liked[user_ids.index(user)]
+        rows = [int(np.flatnonzero(model.movie_ids == movie_id)[0]) for movie_id in user_liked]
+        reference = recency_weights(len(rows), half_life) @ dense[rows]
+        score_of = dict(zip(model.movie_ids.tolist(), reference))
+        for top in (fast_top, slow.get(user, [])):
+            for movie, score in top:
+                assert movie not in user_liked
+                assert score == pytest.approx(score_of[movie])
+        lowest = min(score for _, score in fast_top)
+        # Nothing left out scores above the lowest kept movie
+        kept = {movie for movie, _ in fast_top} | set(user_liked)
+        assert all(score <= lowest + 1e-9 for movie, score in score_of.items() if movie not in kept)
+        groups = [
+            {(movie, round(score, 9)) for movie, score in top if not np.isclose(score, lowest)}
+            for top in (fast_top, slow[user])
+        ]
+        assert groups[0] == groups[1]
+
+
+def test_blended_engine_is_scored_per_user():
+    model = random_model()
+
+    class Engine(ScoringEngine):
+        def score(self, liked_movie_ids, n=10, weights=None, user_id=None):
+            return [(user_id * 100, 1.0)]
+
+    scorer = BatchScorer(model, Engine(model))
+    assert scorer.similarity is None
+    users, ranks, movies, scores = scorer.score_chunk([1, 2], [[1], [4]], n=3)
+    assert users.tolist() == [1, 2]
+    assert ranks.tolist() == [1, 1]
+    assert movies.tolist() == [100, 200]
+
+
+class LikesCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, query, params):
+        self.user_ids = params[0]
+
+    def fetchall(self):
+        return [row for row in self.rows if row[0] in self.user_ids]
+
+
+def test_users_whose_likes_changed_since_the_read_are_found():
+    # User 1 added a like, user 2 removed one, user 3 is unchanged and
+    # user 4 no longer likes anything
+    cursor = LikesCursor([(1, 7), (1, 5), (2, 5), (3, 9), (3, 8)])
+    user_ids = [1, 2, 3, 4]
+    liked = [[5], [5, 6], [9, 8], [4]]
+    assert changed_users(cursor, user_ids, liked) == [1, 2, 4]
@@ -0,0 +1,121 @@
+import numpy as np
+
+from catalog import CatalogSnapshot, refresh
+
+
+def movie(movie_id, seed=0):
+    rng = np.random.default_rng(movie_id * 31 + seed)
+    word = "".join(rng.choice(list("abcdeé✓ "), size=rng.integers(0, 12)))
+    return (
+        movie_id,
+        f"Movie {movie_id} {word}",
+        None if rng.random() < 0.2 else f"About {word}" * int(rng.integers(1, 4)),
+        rng.choice(["Drama", "Comedy", "Action|Drama"]),
+        None if rng.random() < 0.2 else int(rng.integers(1, 10)),
+        int(rng.integers(1950, 2024)),
+        None if rng.random() < 0.5 else f"https://posters.example/{movie_id}.jpg",
+    )
+
+
+def assert_same_snapshot(got, expected):
+    assert got.rows() == expected.rows()
+    assert sorted(got.arrays) == sorted(expected.arrays)
+    for name, array in expected.arrays.items():
+        np.testing.assert_array_equal(got.arrays[name], array, err_msg=name)
+
+
+def test_updates_are_patched_like_a_rebuild():
+    rows = [movie(movie_id) for movie_id in range(1, 200, 2)]
+    snapshot = CatalogSnapshot.from_rows(rows)
+    changed = [movie(movie_id, seed=1) for movie_id in (1, 7, 99, 151, 199)]
+    # Values moving to and from NULL, and a row refetched unchanged
+    changed.append((3, "Only a title", None, None, None, None, None))
+    changed.append(rows[10])
+    expected_rows = {row[0]: row for row in rows}
+    expected_rows.update((row[0], row) for row in changed)
+
+    patched = snapshot.apply(changed, state={"count": len(rows)})
+    assert patched.state == {"count": len(rows)}
+    assert_same_snapshot(patched, CatalogSnapshot.from_rows(list(expected_rows.values())))
+    # The original snapshot is left as it was
+    assert_same_snapshot(snapshot, CatalogSnapshot.from_rows(rows))
+
+
+def test_clearing_the_last_null_drops_the_mask():
+    snapshot = CatalogSnapshot.from_rows([(1, "A", None, "Drama", 5, 2000, None), (2, "B", "b", "Drama", 6, 2001, None)])
+    patched = snapshot.apply([(1, "A", "a", "Drama", 5, 2000, "https://posters.example/1.jpg")])
+    assert "description_null" not in patched.arrays
+    assert patched.records([1, 2])[0]["description"] == "a"
+    assert patched.arrays["poster_url_null"].tolist() == [False, True]
+
+
+def test_inserts_and_deletes_rebuild():
+    rows = [movie(movie_id) for movie_id in range(1, 50)]
+    snapshot = CatalogSnapshot.from_rows(rows)
+    changed = [movie(100), movie(5, seed=2)]
+    live_ids = [row[0] for row in rows if row[0] % 7] + [100]
+    updated = snapshot.apply(changed, live_ids)
+    expected = {row[0]: row for row in rows if row[0] % 7}
+    expected.update((row[0], row) for row in changed)
+    assert_same_snapshot(updated, CatalogSnapshot.from_rows(list(expected.values())))
+
+
+def test_apply_to_an_empty_snapshot():
+    snapshot = CatalogSnapshot.from_rows([])
+    updated = snapshot.apply([movie(3), movie(1)])
+    assert_same_snapshot(updated, CatalogSnapshot.from_rows([movie(1), movie(3)]))
+
+
+class MoviesCursor:
+    """Answers the state query and the changed-rows query from a row list"""
+
+    connection = None
+
+    def __init__(self, rows, change_ids, version):
+        self.rows, self.change_ids, self.version = rows, change_ids, version
+        self.queries = []
+
+    def execute(self, query, params=()):
+        self.queries.append(query)
+        if "COUNT(*)" in query:
+            max_id = max((row[0] for row in self.rows), default=None)
+            self.result = [(len(self.rows), max_id, self.version)]
+        elif "change_id >" in query:
+            since, max_id = params
+            self.result = [row for row in self.rows if self.change_ids[row[0]] > since or row[0] > max_id]
+        else:
+            self.result = list(self.rows)
+
+    def fetchone(self):
+        return self.result[0]
+
+    def fetchall(self):
+        return self.result
+
+
+def test_refresh_fetches_rows_written_after_the_snapshot_version():
+    rows = [movie(movie_id) for movie_id in range(1, 20)]
+    cur = MoviesCursor(rows, {row[0]: 1 for row in rows}, version=3)
+    snapshot, _ = refresh(None, cur)
+    assert snapshot.state == {"count": 19, "max_id": 19, "change_id": 3}
+
+    # A long transaction stamped version 5 on movie 2 but committed after
+    # version 4 (movie 8); neither is older than the snapshot's version
+    rows[1], rows[7] = movie(2, seed=1), movie(8, seed=1)
+    cur.change_ids.update({2: 5, 8: 4})
+    cur.version = 5
+    updated, changed = refresh(snapshot, cur)
+    assert changed == [2, 8]
+    assert "change_id >" in cur.queries[-1]
+    assert_same_snapshot(updated, CatalogSnapshot.from_rows(rows))
+    assert refresh(updated, cur) == (updated, [])
+
+
+def test_refresh_without_a_change_counter_reloads():
+    rows = [movie(movie_id) for movie_id in range(1, 10)]
+    old = CatalogSnapshot.from_rows(rows, {"count": 9, "max_id": 9, "watermark": "2024-01-01T00:00:00"})
+    cur = MoviesCursor(rows, {}, version=None)
+    updated, _ = refresh(old, cur)
+    assert not any("change_id >" in query for query in cur.queries)
+    assert updated.state["change_id"] is None
+    assert_same_snapshot(updated, CatalogSnapshot.from_rows(rows))
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+import model_store
+from model_store import neighbor_arrays, off_diagonal_peak, quantize, ranking_agreement
+
+
+def random_similarity(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    matrix = rng.random((n, n))
+    matrix = (matrix + matrix.T) / 2
+    np.fill_diagonal(matrix, 1.0)
+    return matrix
+
+
+def test_int8_round_trip_error_is_at_most_half_a_step():
+    values = np.random.default_rng(0).uniform(-0.8, 0.8, size=1000)
+    stored, scale = quantize(values, "int8")
+    assert stored.dtype == np.int8
+    assert scale == pytest.approx(np.abs(values).max() / 127)
+    assert np.abs(stored * scale - values).max() <= scale / 2 + 1e-12
+
+
+def test_int8_saturates_above_the_peak():
+    stored, scale = quantize(np.array([-2.0, -0.5, 0.5, 2.0]), "int8", peak=0.5)
+    assert stored.tolist() == [-127, -127, 127, 127]
+    assert scale == pytest.approx(0.5 / 127)
+
+
+def test_float_precisions_keep_the_values():
+    values = np.random.default_rng(1).random(100)
+    for precision in ("float64", "float32", "float16"):
+        stored, scale = quantize(values, precision)
+        assert stored.dtype == np.dtype(precision)
+        assert scale == 1.0
+        np.testing.assert_allclose(stored, values, rtol=np.finfo(precision).eps)
+    with pytest.raises(ValueError):
+        quantize(values, "int4")
+
+
+def test_off_diagonal_peak_ignores_self_similarity():
+    matrix = random_similarity()
+    expected = np.abs(matrix - np.diag(np.diag(matrix))).max()
+    assert off_diagonal_peak(matrix, block_rows=7) == expected
+
+
+def test_ranking_agreement_of_exact_copies():
+    matrix = random_similarity()
+    for stored in (matrix, matrix.astype(np.float32), sparse.csr_matrix(matrix)):
+        agreement = ranking_agreement(matrix, stored, n=10, sample=100)
+        assert agreement["overlap"] == 1.0
+        assert agreement["exact_order"] == 1.0
+        assert agreement["rows"] == len(matrix)
+
+
+def test_ranking_agreement_counts_reordered_neighbours():
+    reference = np.array([
+        [1.0, 0.9, 0.8, 0.1],
+        [0.9, 1.0, 0.2, 0.3],
+        [0.8, 0.2, 1.0, 0.4],
+        [0.1, 0.3, 0.4, 1.0],
+    ])
+    stored = reference.copy()
+    # Row 0 swaps its top two neighbours; row 1 drops one of its top two
+    stored[0, 1], stored[0, 2] = 0.8, 0.9
+    stored[1, 3] = 0.0
+    agreement = ranking_agreement(reference, stored, n=2, sample=4)
+    assert agreement["exact_order"] == 0.5
+    assert agreement["overlap"] == pytest.approx((1 + 0.5 + 1 + 1) / 4)
+
+
+def test_int8_artifact_dequantizes_close_to_the_reference(tmp_path):
+    matrix = random_similarity(seed=2)
+    movie_ids = np.arange(len(matrix)) + 10
+    for similarity in (matrix, sparse.csr_matrix(np.where(matrix > 0.7, matrix, 0))):
+        arrays = neighbor_arrays(movie_ids, similarity, "int8")
+        root = str(tmp_path / ("dense" if isinstance(similarity, np.ndarray) else "sparse"))
+        version = model_store.write_artifact(arrays, {"kind": "content"}, root=root)
+        artifact = model_store.load_artifact(root, version)
+        scale = artifact.score_scale
+        restored = artifact.similarity(dequantize=True)
+        expected = similarity if isinstance(similarity, np.ndarray) else similarity.toarray()
+        if sparse.issparse(restored):
+            restored = restored.toarray()
+        off_diagonal = ~np.eye(len(matrix), dtype=bool)
+        assert np.abs(restored - expected)[off_diagonal].max() <= scale / 2 + 1e-6
+        assert ranking_agreement(expected, artifact.similarity(), scale, n=5)["overlap"] > 0.9
@@ -0,0 +1,73 @@
+import numpy as np
+from scipy import sparse
+from sklearn.preprocessing import normalize
+
+from neighbors import BYTES_PER_CELL, block_size_for_memory, top_k_neighbors
+
+
+def random_tfidf(n_rows=60, n_terms=40, density=0.15, seed=0):
+    matrix = sparse.random(n_rows, n_terms, density=density, random_state=seed, format="csr")
+    return normalize(matrix)
+
+
+def brute_force_top_k(tfidf, k):
+    """Top-k neighbours of every row from the dense cosine matrix"""
+    dense = (tfidf @ tfidf.T).toarray()
+    np.fill_diagonal(dense, -np.inf)
+    neighbours = []
+    for row in dense:
+        cols = np.argsort(-row, kind="stable")[:k]
+        neighbours.append({int(col): row[col] for col in cols if row[col] > 0})
+    return neighbours
+
+
+def index_rows(index):
+    return [
+        dict(zip(index.indices[index.indptr[row]:index.indptr[row + 1]].tolist(),
+                 index.data[index.indptr[row]:index.indptr[row + 1]]))
+        for row in range(index.shape[0])
+    ]
+
+
+def assert_matches(index, expected):
+    for got, want in zip(index_rows(index), expected):
+        assert set(got) == set(want)
+        for col, score in want.items():
+            assert got[col] == np.float32(score) or abs(got[col] - score) < 1e-6
+
+
+def test_top_k_matches_brute_force():
+    tfidf = random_tfidf()
+    assert_matches(top_k_neighbors(tfidf, k=5), brute_force_top_k(tfidf, 5))
+
+
+def test_block_size_does_not_change_the_index():
+    tfidf = random_tfidf(seed=1)
+    expected = brute_force_top_k(tfidf, 3)
+    for block_size in (1, 7, 60):
+        assert_matches(top_k_neighbors(tfidf, k=3, block_size=block_size), expected)
+
+
+def test_rows_without_overlap_have_no_neighbours():
+    tfidf = sparse.csr_matrix(np.eye(4))
+    index = top_k_neighbors(tfidf, k=2)
+    assert index.nnz == 0
+    assert index.shape == (4, 4)
+
+
+def test_process_pool_matches_single_process():
+    tfidf = random_tfidf(seed=2)
+    single = top_k_neighbors(tfidf, k=4, block_size=10)
+    pooled = top_k_neighbors(tfidf, k=4, block_size=10, n_jobs=2)
+    assert (single != pooled).nnz == 0
+
+
+def test_block_size_fits_the_memory_budget():
+    n_rows, budget_mb, n_jobs = 100_000, 512, 4
+    matrix_size = 50 * 1024 * 1024
+    rows = block_size_for_memory(n_rows, budget_mb, n_jobs, matrix_size)
+    used = n_jobs * (rows * n_rows * BYTES_PER_CELL + 2 * matrix_size)
+    assert used <= budget_mb * 1024 * 1024
+    assert rows < block_size_for_memory(n_rows, budget_mb, n_jobs)
+    # A matrix that alone exceeds the budget still makes progress
+    assert block_size_for_memory(n_rows, 1, n_jobs, matrix_size) == 1
@@ -0,0 +1,145 @@
+from contextlib import contextmanager
+
+import numpy as np
+from scipy import sparse
+
+import profiles
+from model_store import content_arrays
+from profiles import ProfileEngine, UserProfile
+
+
+class Artifact:
+    """In-memory stand-in for a model_store.ModelArtifact"""
+
+    def __init__(self, arrays, version=1):
+        self.arrays = arrays
+        self.version = version
+        self.movie_ids = arrays["movie_ids"]
+
+    def has(self, name):
+        return name in self.arrays
+
+    def array(self, name):
+        return self.arrays[name]
+
+    def tfidf_matrix(self):
+        shape = (len(self.movie_ids), len(self.arrays["tfidf_idf"]))
+        return sparse.csr_matrix(
+            (self.arrays["tfidf_data"], self.arrays["tfidf_indices"], self.arrays["tfidf_indptr"]), shape=shape
+        )
+
+    def tfidf_columns(self):
+        shape = (len(self.movie_ids), len(self.arrays["tfidf_idf"]))
+        return sparse.csc_matrix(
+            (self.arrays["tfidf_csc_data"], self.arrays["tfidf_csc_indices"], self.arrays["tfidf_csc_indptr"]),
+            shape=shape,
+        )
+
+
+@contextmanager
+def fake_connection():
+    class Conn:
+        @contextmanager
+        def cursor(self):
+            yield None
+    yield Conn()
+
+
+def random_engine(n_movies=30, n_terms=50, seed=0):
+    tfidf = sparse.random(n_movies, n_terms, density=0.15, random_state=seed, format="csr")
+    movie_ids = np.arange(n_movies) * 2 + 1
+    arrays, _ = content_arrays(movie_ids, np.zeros(n_movies), sparse.identity(n_movies, format="csr"),
+                               tfidf_matrix=tfidf)
+    arrays["tfidf_idf"] = np.ones(n_terms)
+    engine = ProfileEngine(Artifact(arrays), connection=fake_connection)
+    return engine, tfidf.toarray().astype(np.float32), movie_ids
+
+
+def test_stored_csc_copy_matches_the_matrix():
+    engine, dense, _ = random_engine()
+    np.testing.assert_array_equal(engine.tfidf_columns.toarray(), dense)
+
+
+def test_catalog_scores_are_cosines_with_the_summed_rows():
+    engine, dense, movie_ids = random_engine()
+    liked = [movie_ids[3], movie_ids[8], movie_ids[20]]
+    profile = dense[[3, 8, 20]].sum(axis=0).astype(np.float64)
+    expected = dense @ (profile / np.linalg.norm(profile))
+    np.testing.assert_allclose(engine.catalog_scores(liked), expected, rtol=1e-5)
+
+
+def test_reads_reconcile_a_stale_profile_without_saving(monkeypatch):
+    engine, dense, movie_ids = random_engine()
+    # The stored profile knows only the first like
+    stored, _ = engine.reconcile(None, [movie_ids[3]])
+    saved = []
+    monkeypatch.setattr(profiles, "load_profile", lambda cur, user_id, for_update=False: UserProfile(
+        stored.model_version, stored.liked_ids, stored.terms, stored.weights))
+    monkeypatch.setattr(profiles, "save_profile", lambda cur, user_id, profile: saved.append(user_id))
+
+    liked = [movie_ids[3], movie_ids[8]]
+    profile = engine.profile_for(7, liked)
+    assert profile.liked_ids.tolist() == sorted(liked)
+    np.testing.assert_allclose(profile.vector(dense.shape[1]).toarray()[0], dense[[3, 8]].sum(axis=0), rtol=1e-6)
+    assert saved == []
+
+    monkeypatch.setattr(profiles, "fetch_liked_ids", lambda cur, user_id: liked)
+    engine.refresh(7)
+    assert saved == [7]
+
+
+def test_update_subtracts_removed_likes():
+    engine, dense, movie_ids = random_engine()
+    profile, _ = engine.reconcile(None, movie_ids[[1, 2, 5]])
+    profile, changed = engine.reconcile(profile, movie_ids[[2, 6]])
+    assert changed
+    np.testing.assert_allclose(profile.vector(dense.shape[1]).toarray()[0], dense[[2, 6]].sum(axis=0),
+                               rtol=1e-5, atol=1e-6)
+
+
+def test_profiles_rebuilt_for_a_new_version_are_saved_once_in_the_background(monkeypatch):
+    engine, dense, movie_ids = random_engine()
+    liked = [movie_ids[3], movie_ids[8]]
+    old, _ = engine.reconcile(None, liked)
+    old.model_version = engine.version - 1
+    stored = {7: old}
+    saves = []
+
+    def save_rebuilt(cur, user_id, profile):
+        saves.append(user_id)
+        stored[user_id] = profile
+
+    monkeypatch.setattr(profiles, "load_profile", lambda cur, user_id, for_update=False: stored.get(user_id))
+    monkeypatch.setattr(profiles, "save_rebuilt_profile", save_rebuilt)
+    monkeypatch.setattr(profiles, "save_profile", lambda cur, user_id, profile: None)
+
+    profile = engine.profile_for(7, liked)
+    assert profile.model_version == engine.version
+    # A user with no stored profile is saved as well
+    engine.profile_for(9, liked)
+    engine.flush()
+    assert sorted(saves) == [7, 9]
+    assert stored[7].model_version == engine.version
+    np.testing.assert_allclose(stored[7].vector(dense.shape[1]).toarray()[0], dense[[3, 8]].sum(axis=0), rtol=1e-6)
+
+    # Later reads use the saved profile and write nothing
+    engine.profile_for(7, liked)
+    engine.flush()
+    assert sorted(saves) == [7, 9]
+
+
+def test_a_failed_background_save_is_retried_on_the_next_read(monkeypatch):
+    engine, _, movie_ids = random_engine()
+    attempts = []
+
+    def failing_save(cur, user_id, profile):
+        attempts.append(user_id)
+        raise RuntimeError("database unavailable")
+
+    monkeypatch.setattr(profiles, "load_profile", lambda cur, user_id, for_update=False: None)
+    monkeypatch.setattr(profiles, "save_rebuilt_profile", failing_save)
+    engine.profile_for(7, [movie_ids[1]])
+    engine.flush()
+    engine.profile_for(7, [movie_ids[1]])
+    engine.flush()
+    assert attempts == [7, 7]
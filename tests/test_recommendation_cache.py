@@ -0,0 +1,207 @@
+import threading
+import time
+
+import pytest
+
+from recommendation_cache import RecommendationCache, SingleFlight
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entry_written_before_an_invalidation_is_not_served():
+    cache = RecommendationCache()
+    cache.put(1, "v1", ["a"], cache.token())
+    cache.put(2, "v1", ["b"], cache.token())
+    cache.invalidate_user(1)
+    assert cache.get(1, "v1") is None
+    assert cache.get(2, "v1") == ["b"]
+
+
+def test_compute_racing_an_invalidation_is_not_stored():
+    cache = RecommendationCache()
+    started, invalidated = threading.Event(), threading.Event()
+    stored = []
+
+    def compute():
+        token = cache.token()
+        started.set()
+        # The user likes a movie while their recommendations are computed
+        invalidated.wait()
+        stored.append(cache.put(1, "v1", ["stale"], token))
+
+    thread = threading.Thread(target=compute)
+    thread.start()
+    started.wait()
+    cache.invalidate_user(1)
+    invalidated.set()
+    thread.join()
+    assert stored == [False]
+    assert cache.get(1, "v1") is None
+    # A computation starting after the invalidation is stored
+    assert cache.put(1, "v1", ["fresh"], cache.token())
+    assert cache.get(1, "v1") == ["fresh"]
+
+
+def test_invalidations_of_other_users_do_not_reject_a_result():
+    cache = RecommendationCache()
+    token = cache.token()
+    cache.invalidate_user(2)
+    assert cache.put(1, "v1", ["a"], token)
+    assert cache.get(1, "v1") == ["a"]
+
+
+def test_forgotten_invalidations_raise_the_floor():
+    cache = RecommendationCache(max_size=2)
+    token = cache.token()
+    for user_id in (1, 2, 3):
+        cache.invalidate_user(user_id)
+    # User 1's invalidation was evicted; its in-flight result is still rejected
+    assert not cache.put(1, "v1", ["stale"], token)
+    assert cache.get(1, "v1") is None
+    assert cache.generation(1) > 0
+
+
+def test_clear_rejects_results_in_flight():
+    cache = RecommendationCache()
+    token = cache.token()
+    cache.put(1, "v1", ["a"])
+    cache.clear()
+    assert cache.get(1, "v1") is None
+    assert not cache.put(1, "v2", ["stale"], token)
+
+
+def test_entries_expire_and_are_keyed_by_model_version():
+    clock = Clock()
+    cache = RecommendationCache(ttl=10, clock=clock)
+    cache.put(1, "v1", ["a"])
+    assert cache.get(1, "v2") is None
+    cache.put(1, "v1", ["a"])
+    clock.now = 11
+    assert cache.get(1, "v1") is None
+
+
+def test_service_never_serves_a_result_computed_before_an_invalidation(monkeypatch):
+    import get_recommendations
+    import recommendation_service
+
+    service = recommendation_service.RecommendationService()
+    monkeypatch.setattr(service, "refresh_catalog", lambda force=False: None)
+    monkeypatch.setattr(service, "refresh_model", lambda force=False: None)
+    service.engine = type("Engine", (), {"version": 1})()
+    service.catalog = type("Catalog", (), {"empty": False})()
+
+    likes = {"ids": [10]}
+    reading, release = threading.Event(), threading.Event()
+
+    def get_liked_movies(user_id):
+        liked = list(likes["ids"])
+        if liked == [10]:
+            # The first request read the old likes and is still scoring
+            reading.set()
+            release.wait()
+        return liked
+
+    monkeypatch.setattr(get_recommendations, "get_liked_movies", get_liked_movies)
+    monkeypatch.setattr(get_recommendations, "recommend",
+                        lambda liked, movies, engine, user_id=None: [f"for {liked}"])
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(service.recommend(1)))
+    first.start()
+    reading.wait()
+    likes["ids"] = [10, 20]
+    service.cache.invalidate_user(1)
+    # A request after the invalidation starts its own computation
+    assert service.recommend(1) == ["for [10, 20]"]
+    release.set()
+    first.join()
+    assert results == [["for [10]"]]
+    assert service.recommend(1) == ["for [10, 20]"]
+
+
+def run_concurrently(flight, key, func, n_callers):
+    """Start n_callers threads on flight.do(key, func); returns their outcomes"""
+    outcomes = [None] * n_callers
+
+    def call(i):
+        try:
+            outcomes[i] = flight.do(key, func)
+        except Exception as e:
+            outcomes[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(n_callers)]
+    for thread in threads:
+        thread.start()
+    return threads, outcomes
+
+
+def wait_for_waiters(flight, n_waiters, timeout=5):
+    deadline = time.monotonic() + timeout
+    while flight.stats()["coalesced"] < n_waiters:
+        assert time.monotonic() < deadline, "callers did not join the flight"
+        time.sleep(0.001)
+
+
+def test_single_flight_shares_one_computation():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return ["m1", "m2"]
+
+    threads, outcomes = run_concurrently(flight, 1, compute, 8)
+    # Let every caller reach the flight before the leader finishes
+    wait_for_waiters(flight, 7)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert calls == [1]
+    assert all(result == ["m1", "m2"] for result, _ in outcomes)
+    assert sorted(shared for _, shared in outcomes) == [False] + [True] * 7
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_single_flight_exception_reaches_every_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+    error = RuntimeError("model unavailable")
+
+    def compute():
+        release.wait(5)
+        raise error
+
+    threads, outcomes = run_concurrently(flight, 1, compute, 5)
+    wait_for_waiters(flight, 4)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert all(outcome is error for outcome in outcomes)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_single_flight_releases_the_key_afterwards():
+    flight = SingleFlight()
+
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        flight.do(1, fail)
+    # Neither a failed nor a finished call leaves the key taken
+    assert flight.stats()["in_flight"] == 0
+    assert flight.do(1, lambda: "fresh") == ("fresh", False)
+    assert flight.do(1, lambda: "again") == ("again", False)
+    assert flight.stats()["coalesced"] == 0
+    # Other keys never wait on each other
+    assert flight.do(2, lambda: flight.do(3, lambda: "nested")) == (("nested", False), False)
@@ -0,0 +1,79 @@
+import numpy as np
+from scipy import sparse
+
+from model_store import CSRArrays, SimilarityModel
+from scoring import RowIndex, ScoringEngine, lookup_rows, recency_weights, sparse_row_sum
+
+
+def random_similarity(n=50, density=0.2, seed=0):
+    matrix = sparse.random(n, n, density=density, random_state=seed, format="csr", dtype=np.float64)
+    matrix.setdiag(0)
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def test_row_index_matches_a_dict():
+    rng = np.random.default_rng(0)
+    for movie_ids in (np.arange(1, 200, 3), rng.permutation(1000)[:300] + 5):
+        expected = {int(movie_id): row for row, movie_id in enumerate(movie_ids)}
+        index = RowIndex(movie_ids)
+        queries = rng.integers(0, 1100, size=500)
+        assert index.find(queries).tolist() == [expected.get(int(q), -1) for q in queries]
+        assert all(index.get(movie_id) == row for movie_id, row in expected.items())
+        assert index.get(-7) is None
+
+
+def test_row_index_of_an_empty_model():
+    index = RowIndex([])
+    assert index.find([1, 2]).tolist() == [-1, -1]
+    assert 1 not in index
+
+
+def test_lookup_rows_keeps_positions_of_known_ids():
+    model = SimilarityModel(np.eye(3), [30, 10, 20])
+    rows, positions = lookup_rows(model.row_of, [20, 99, 30])
+    assert rows.tolist() == [2, 0]
+    assert positions.tolist() == [0, 2]
+
+
+def test_sparse_row_sum_matches_dense_product():
+    matrix = random_similarity()
+    rng = np.random.default_rng(1)
+    # Repeated and empty rows included
+    rows = np.array([3, 3, 0, 17, 49, 8])
+    weights = rng.random(len(rows))
+    expected = weights @ matrix.toarray()[rows]
+    got = sparse_row_sum(matrix.indptr, matrix.indices, matrix.data, rows, weights, matrix.shape[1])
+    np.testing.assert_allclose(got, expected)
+
+
+def test_sparse_row_sum_of_rows_without_entries():
+    matrix = sparse.csr_matrix((4, 4))
+    got = sparse_row_sum(matrix.indptr, matrix.indices, matrix.data, np.array([1, 2]), np.ones(2), 4)
+    assert got.tolist() == [0, 0, 0, 0]
+
+
+def brute_force_scores(dense, movie_ids, liked, weights, n):
+    """Top n (movie_id, score) by scoring every candidate movie on its own"""
+    row_of = {movie_id: row for row, movie_id in enumerate(movie_ids)}
+    scores = []
+    for row, movie_id in enumerate(movie_ids):
+        if movie_id in liked:
+            continue
+        score = sum(weight * dense[row_of[like], row] for like, weight in zip(liked, weights) if like in row_of)
+        if score > 0:
+            scores.append((-score, row, movie_id))
+    return [(movie_id, -score) for score, _, movie_id in sorted(scores)[:n]]
+
+
+def test_engine_matches_brute_force_for_sparse_and_dense_models():
+    matrix = random_similarity(seed=2)
+    movie_ids = np.arange(100, 150)
+    liked = [104, 131, 145, 999]
+    weights = recency_weights(len(liked), half_life=2)
+    expected = brute_force_scores(matrix.toarray(), movie_ids.tolist(), liked, weights, 10)
+    csr = CSRArrays(matrix.data, matrix.indices, matrix.indptr, matrix.shape)
+    for similarity in (matrix.toarray(), csr):
+        got = ScoringEngine(SimilarityModel(similarity, movie_ids)).score(liked, n=10, weights=weights)
+        assert [movie_id for movie_id, _ in got] == [movie_id for movie_id, _ in expected]
+        np.testing.assert_allclose([score for _, score in got], [score for _, score in expected])
@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+from scipy import sparse
+
+import model_store
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TRAINING_ONLY_MODULES = ("pandas", "scipy", "sklearn")
+
+
+def loaded_modules(code, env=None):
+    """Top-level modules imported by a fresh interpreter running code"""
+    probe = code + "\nimport json, sys\nprint(json.dumps(sorted({name.split('.')[0] for name in sys.modules})))"
+    output = subprocess.run(
+        [sys.executable, "-c", probe], check=True, capture_output=True, text=True, cwd=REPO_ROOT,
+        env={**os.environ, **(env or {})},
+    ).stdout
+    return set(json.loads(output.strip().splitlines()[-1]))
+
+
+def test_serving_modules_import_without_training_libraries():
+    loaded = loaded_modules("import get_recommendations, recommendation_service")
+    assert not loaded & set(TRAINING_ONLY_MODULES)
+
+
+def test_scoring_a_sparse_model_needs_no_training_libraries(tmp_path):
+    similarity = sparse.random(20, 20, density=0.3, random_state=0, format="csr")
+    arrays = model_store.neighbor_arrays(np.arange(1, 21), similarity)
+    model_store.write_artifact(arrays, {"kind": "content"}, root=str(tmp_path))
+    loaded = loaded_modules(
+        "from get_recommendations import build_engine\n"
+        "from model_store import load_artifact\n"
+        f"model = load_artifact({str(tmp_path)!r}).similarity_model()\n"
+        "assert build_engine(model).score([1, 2], n=5)\n",
+        env={"CF_BLEND_WEIGHT": "0", "ALS_BLEND_WEIGHT": "0", "CONTENT_SCORING": "neighbors"},
+    )
+    assert not loaded & set(TRAINING_ONLY_MODULES)
@@ -0,0 +1,108 @@
+import numpy as np
+import pandas as pd
+
+import model_store
+from neighbors import merge_top_k, top_k_neighbors
+from train_model import combined_features, train
+from update_model import update
+
+WORDS = ["space", "love", "war", "robot", "ocean", "heist", "ghost", "king", "dragon", "city",
+         "storm", "secret", "family", "desert", "island", "prison", "music", "winter"]
+GENRES = ["Drama", "Comedy", "Action", "Horror"]
+
+
+def catalog(ids, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "id": ids,
+        "title": [f"Movie {movie_id}" for movie_id in ids],
+        "description": [" ".join(rng.choice(WORDS, size=6)) for _ in ids],
+        "genre": [GENRES[movie_id % len(GENRES)] for movie_id in ids],
+    })
+
+
+def brute_force_merge(rows, cols, scores, k):
+    best = {}
+    for row, col, score in zip(rows, cols, scores):
+        best.setdefault(row, {}).setdefault(col, score)
+    kept = set()
+    for row, entries in best.items():
+        ranked = sorted(entries.items(), key=lambda entry: (-entry[1], entry[0]))[:k]
+        kept |= {(row, col, score) for col, score in ranked}
+    return kept
+
+
+def test_merge_top_k_matches_brute_force():
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, 20, size=400)
+    cols = rng.integers(0, 30, size=400)
+    scores = rng.random(400).astype(np.float32)
+    got = merge_top_k(rows, cols, scores, 5)
+    assert set(zip(*(array.tolist() for array in got))) == {
+        (int(row), int(col), float(score)) for row, col, score in brute_force_merge(rows, cols, scores, 5)
+    }
+
+
+def neighbour_lists(artifact):
+    index = artifact.similarity(dequantize=True)
+    ids = np.asarray(artifact.movie_ids)
+    return {
+        int(ids[row]): {
+            int(ids[col]): float(score)
+            for col, score in zip(index.indices[index.indptr[row]:index.indptr[row + 1]],
+                                  index.data[index.indptr[row]:index.indptr[row + 1]])
+        }
+        for row in range(len(ids))
+    }
+
+
+def assert_same_neighbours(got, expected):
+    assert got.keys() == expected.keys()
+    for movie_id in expected:
+        assert got[movie_id].keys() == expected[movie_id].keys(), movie_id
+        for neighbour, score in expected[movie_id].items():
+            assert abs(got[movie_id][neighbour] - score) < 1e-5
+
+
+def test_patched_model_matches_a_rebuilt_index(tmp_path):
+    model_dir = str(tmp_path)
+    movies = catalog(list(range(1, 81)))
+    train(movies.copy(), top_k=5, model_dir=model_dir)
+
+    # Change two movies, remove three and add four
+    updated = movies[~movies["id"].isin([7, 30, 55])].copy()
+    updated.loc[updated["id"] == 12, "description"] = "dragon dragon king winter"
+    updated.loc[updated["id"] == 40, "description"] = "robot ocean heist"
+    updated = pd.concat([updated, catalog([101, 102, 103, 104], seed=1)], ignore_index=True)
+    version = update(updated.copy(), model_dir=model_dir)
+
+    artifact = model_store.load_artifact(model_dir)
+    assert artifact.version == version == 2
+    assert artifact.manifest["params"]["incremental"]["added"] == 4
+    assert sorted(artifact.movie_ids.tolist()) == sorted(updated["id"].tolist())
+
+    # Neighbours computed from scratch with the same fitted vocabulary
+    rebuilt = top_k_neighbors(artifact.tfidf_matrix(), k=5)
+    ids = np.asarray(artifact.movie_ids)
+    expected = {
+        int(ids[row]): {
+            int(ids[col]): float(score)
+            for col, score in zip(rebuilt.indices[rebuilt.indptr[row]:rebuilt.indptr[row + 1]],
+                                  rebuilt.data[rebuilt.indptr[row]:rebuilt.indptr[row + 1]])
+        }
+        for row in range(len(ids))
+    }
+    assert_same_neighbours(neighbour_lists(artifact), expected)
+
+    # The patched TF-IDF rows equal a fresh transform of the new catalog
+    tfidf = artifact.vectorizer()
+    order = pd.Index(updated["id"]).get_indexer(ids)
+    fresh = tfidf.transform(combined_features(updated.iloc[order]))
+    assert abs(fresh - artifact.tfidf_matrix()).max() < 1e-6
+
+
+def test_unchanged_catalog_keeps_the_version(tmp_path):
+    model_dir = str(tmp_path)
+    movies = catalog(list(range(1, 31)))
+    train(movies.copy(), top_k=3, model_dir=model_dir)
+    assert update(movies.copy(), model_dir=model_dir) == 1
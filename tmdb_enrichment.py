@@ -0,0 +1,194 @@
+"""Concurrent, rate-limited and cached TMDB lookups for the MovieLens import.
+
+One TMDB search per distinct title/year provides both the description and
+the poster. Searches run on a thread pool over a pooled requests.Session,
+throttled by a token bucket, and their results (including "not found")
+are kept in an SQLite cache so re-imports skip movies already fetched.
+
+TMDB_BASE_URL can point the client at a local stand-in server.
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+TMDB_BASE_URL = os.environ.get("TMDB_BASE_URL", "https://api.themoviedb.org/3")
+TMDB_IMAGE_URL = "https://image.tmdb.org/t/p/w500"
+
+DEFAULT_CACHE_PATH = os.path.join("data", "tmdb_cache.sqlite")
+DEFAULT_WORKERS = 8
+# TMDB allows roughly 40 requests per second per client
+DEFAULT_RATE = 40.0
+MAX_RETRIES = 3
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` calls per second on average"""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a token is available and take it"""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+
+class SearchCache:
+    """Persistent cache of TMDB search results keyed by title and year"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS tmdb_search (
+                    title TEXT NOT NULL,
+                    year TEXT NOT NULL,
+                    overview TEXT,
+                    poster_path TEXT,
+                    fetched_at REAL NOT NULL,
+                    PRIMARY KEY (title, year)
+                )
+            """)
+            self._conn.commit()
+
+    def get_many(self, keys):
+        """Cached (overview, poster_path) for each known (title, year) key"""
+        found = {}
+        with self._lock:
+            for title, year in keys:
+                row = self._conn.execute(
+                    "SELECT overview, poster_path FROM tmdb_search WHERE title = ? AND year = ?",
+                    (title, year),
+                ).fetchone()
+                if row is not None:
+                    found[(title, year)] = row
+        return found
+
+    def put(self, title, year, overview, poster_path):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tmdb_search VALUES (?, ?, ?, ?, ?)",
+                (title, year, overview, poster_path, time.time()),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_session(pool_size=DEFAULT_WORKERS):
+    """requests.Session reusing up to pool_size connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def search_movie(session, title, year=None, api_key=None, base_url=TMDB_BASE_URL, limiter=None):
+    """First TMDB search result for a title and year, or None
+
+    Rate-limited responses (HTTP 429) are retried after Retry-After.
+    """
+    params = {"api_key": api_key, "query": title}
+    if year:
+        params["year"] = year
+    for attempt in range(MAX_RETRIES):
+        if limiter is not None:
+            limiter.acquire()
+        response = session.get(f"{base_url}/search/movie", params=params, timeout=10)
+        if response.status_code == 429 and attempt < MAX_RETRIES - 1:
+            time.sleep(float(response.headers.get("Retry-After", 1)))
+            continue
+        response.raise_for_status()
+        results = response.json().get("results") or []
+        return results[0] if results else None
+    return None
+
+
+def placeholder_description(title):
+    return f"No description available for {title}."
+
+
+def placeholder_poster(title):
+    return f"https://via.placeholder.com/500x750.png?text={title.replace(' ', '+')}"
+
+
+def _year_key(year):
+    return "" if year is None or pd.isna(year) else str(year)
+
+
+def enrich_movies(movies_df, api_key, base_url=TMDB_BASE_URL, cache_path=DEFAULT_CACHE_PATH,
+                  max_workers=DEFAULT_WORKERS, rate=DEFAULT_RATE):
+    """Fill the description and poster_url columns from TMDB
+
+    Each distinct title/year is searched at most once, and never again
+    once it is in the cache.
+    """
+    keys = list(dict.fromkeys(zip(movies_df["title"], movies_df["release_year"].map(_year_key))))
+    cache = SearchCache(cache_path)
+    try:
+        results = cache.get_many(keys)
+        missing = [key for key in keys if key not in results]
+        logging.info(f"TMDB: {len(results)} cached, {len(missing)} to fetch")
+
+        if missing:
+            session = create_session(max_workers)
+            limiter = TokenBucket(rate)
+
+            def fetch(key):
+                title, year = key
+                try:
+                    movie = search_movie(session, title, year or None, api_key, base_url, limiter)
+                except Exception as e:
+                    # Failures are not cached so the next import retries them
+                    logging.error(f"Error fetching TMDB data for {title}: {e}")
+                    return key, None, False
+                overview = (movie or {}).get("overview") or None
+                poster_path = (movie or {}).get("poster_path") or None
+                cache.put(title, year, overview, poster_path)
+                return key, (overview, poster_path), True
+
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for key, result, fetched in executor.map(fetch, missing):
+                    if fetched:
+                        results[key] = result
+            session.close()
+    finally:
+        cache.close()
+
+    descriptions, posters = [], []
+    for title, year in zip(movies_df["title"], movies_df["release_year"].map(_year_key)):
+        overview, poster_path = results.get((title, year), (None, None))
+        descriptions.append(overview or placeholder_description(title))
+        posters.append(f"{TMDB_IMAGE_URL}{poster_path}" if poster_path else placeholder_poster(title))
+
+    movies_df = movies_df.copy()
+    movies_df["description"] = descriptions
+    movies_df["poster_url"] = posters
+    return movies_df
@@ -1,61 +1,236 @@
 import pandas as pd
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
+from scipy import sparse
+import argparse
 import os
 import csv  # Added for quoting parameter
+import pickle
 
-# Debugging: Print current working directory
-print("Current Working Directory:", os.getcwd())
-
-# Check if the file exists
-if not os.path.exists("movies.csv"):
-    raise FileNotFoundError("The file 'movies.csv' does not exist in the current directory.")
-
-# Load movie data
-try:
-    movies = pd.read_csv(
-        "movies.csv", 
-        sep=',', 
-        quoting=csv.QUOTE_MINIMAL, 
-        encoding='utf-8', 
-        on_bad_lines='skip'  # Use 'skip' to skip bad lines or 'warn' to warn and skip
-    )
-except Exception as e:
-    raise Exception(f"Error loading 'movies.csv': {e}")
-
-# Debugging: Print the first few rows of the DataFrame
-print("Loaded Data:")
-print(movies.head())
-
-# Verify required columns exist
-required_columns = ["id", "title", "description", "genre"]
-for column in required_columns:
-    if column not in movies.columns:
-        raise KeyError(f"Column '{column}' not found in 'movies.csv'. Please check the file.")
-
-# Combine features into a single text column
-movies["combined_features"] = (
-    movies["title"] + " " + movies["description"] + " " + movies["genre"]
+from model_store import (
+    DEFAULT_PRECISION, MODEL_DIR, PRECISIONS, off_diagonal_peak, quantize, ranking_agreement, row_hashes,
+    save_content_model,
 )
+from neighbors import DEFAULT_TOP_K, top_k_neighbors
+import ann_index
 
-# Debugging: Print the combined features
-print("Combined Features:")
-print(movies["combined_features"].head())
 
-# Convert text to TF-IDF vectors
-tfidf = TfidfVectorizer(stop_words="english")
-tfidf_matrix = tfidf.fit_transform(movies["combined_features"])
+def load_movies(path="movies.csv"):
+    """Load movie data from a CSV file"""
+    # Debugging: Print current working directory
+    print("Current Working Directory:", os.getcwd())
 
-# Calculate cosine similarity
-cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
+    # Check if the file exists
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"The file '{path}' does not exist in the current directory.")
 
-# Save the model and similarity matrix
-import pickle
+    # Load movie data
+    try:
+        movies = pd.read_csv(
+            path,
+            sep=',',
+            quoting=csv.QUOTE_MINIMAL,
+            encoding='utf-8',
+            on_bad_lines='skip'  # Use 'skip' to skip bad lines or 'warn' to warn and skip
+        )
+    except Exception as e:
+        raise Exception(f"Error loading '{path}': {e}")
+
+    # Debugging: Print the first few rows of the DataFrame
+    print("Loaded Data:")
+    print(movies.head())
+
+    # Verify required columns exist
+    required_columns = ["id", "title", "description", "genre"]
+    for column in required_columns:
+        if column not in movies.columns:
+            raise KeyError(f"Column '{column}' not found in '{path}'. Please check the file.")
+
+    return movies
+
+
+def combined_features(movies):
+    """Text the TF-IDF model is trained on for each movie"""
+    return (movies["title"] + " " + movies["description"] + " " + movies["genre"]).fillna("")
+
+
+def build_tfidf(movies):
+    """Fit the TF-IDF model over the combined text features"""
+    # Combine features into a single text column
+    movies["combined_features"] = combined_features(movies)
+
+    # Debugging: Print the combined features
+    print("Combined Features:")
+    print(movies["combined_features"].head())
+
+    # Convert text to TF-IDF vectors
+    tfidf = TfidfVectorizer(stop_words="english")
+    tfidf_matrix = tfidf.fit_transform(movies["combined_features"])
+    return tfidf, tfidf_matrix
+
+
+TFIDF_PARAMS = {"stop_words": "english"}
+
+
+def build_ann_index(tfidf_matrix, top_k, ann=None, recall_sample=ann_index.DEFAULT_RECALL_SAMPLE):
+    """Approximate top-K index plus its parameters and measured recall"""
+    ann = dict(ann or {})
+    similarity = ann_index.ann_neighbors(tfidf_matrix, k=top_k, **ann)
+    if recall_sample:
+        ann["recall"] = ann_index.measure_recall(tfidf_matrix, similarity, top_k, recall_sample)
+        sampled = min(recall_sample, tfidf_matrix.shape[0])
+        print(f"ANN recall@{top_k} on {sampled} sampled movies: {ann['recall']:.3f}")
+    return similarity, ann
+
+
+def train(movies, top_k=None, block_size=None, workers=1, max_memory_mb=None,
+          model_dir=MODEL_DIR, source="movies.csv", neighbors="exact", ann=None,
+          recall_sample=ann_index.DEFAULT_RECALL_SAMPLE, precision=DEFAULT_PRECISION):
+    """Fit the model on a catalog and publish it as a new artifact version
+
+    With neighbors="ann" the top-K index is built approximately (see
+    ann_index.py); ann holds its tuning parameters. Similarity scores are
+    stored in the given precision, and how well the stored scores keep the
+    float64 neighbour ranking is printed and recorded in the manifest.
+    """
+    tfidf, tfidf_matrix = build_tfidf(movies)
+    params = {"tfidf": TFIDF_PARAMS, "top_k": top_k, "source": source, "precision": precision}
+
+    if neighbors == "ann":
+        top_k = top_k or DEFAULT_TOP_K
+        similarity, ann = build_ann_index(tfidf_matrix, top_k, ann, recall_sample)
+        params.update(top_k=top_k, neighbors="ann", ann=ann)
+        print(f"Built approximate top-{top_k} neighbour index ({similarity.nnz} entries)")
+    elif top_k:
+        # Sparse top-K neighbour index, O(N * K) memory
+        similarity = top_k_neighbors(
+            tfidf_matrix,
+            k=top_k,
+            block_size=block_size,
+            n_jobs=workers,
+            max_memory_mb=max_memory_mb,
+        )
+        print(f"Built top-{top_k} neighbour index ({similarity.nnz} entries)")
+    else:
+        # Calculate cosine similarity
+        similarity = cosine_similarity(tfidf_matrix, tfidf_matrix)
+
+    params["ranking_agreement"] = precision_report(similarity, precision)
+    version = save_content_model(
+        movies["id"].to_numpy(),
+        row_hashes(movies),
+        similarity,
+        tfidf=tfidf,
+        tfidf_matrix=tfidf_matrix,
+        params=params,
+        root=model_dir,
+        precision=precision,
+    )
+    print(f"Saved model version {version} to '{model_dir}'")
+    return version
+
+
+def precision_report(similarity, precision):
+    """Stored size and ranking agreement of the scores quantised to precision"""
+    if sparse.issparse(similarity):
+        stored = sparse.csr_matrix(similarity, copy=True)
+        stored.data, scale = quantize(stored.data, precision)
+        size = stored.data.nbytes
+    else:
+        stored, scale = quantize(similarity, precision, off_diagonal_peak(similarity))
+        size = stored.nbytes
+    agreement = ranking_agreement(similarity, stored, scale)
+    print(f"Storing scores as {precision} ({size / 1024 / 1024:.1f} MiB); top-10 overlap "
+          f"{agreement['overlap']:.4f}, identical order {agreement['exact_order']:.1%} "
+          f"of {agreement['rows']} sampled movies")
+    return dict(agreement, score_bytes=size)
+
+
+def train_legacy(movies, top_k=None, block_size=None, workers=1, max_memory_mb=None):
+    """Fit the model and write the legacy pickle / npz files"""
+    tfidf, tfidf_matrix = build_tfidf(movies)
+
+    # Save the model and similarity matrix
+    with open("tfidf_model.pkl", "wb") as f:
+        pickle.dump(tfidf, f)
+
+    if top_k:
+        neighbors = top_k_neighbors(
+            tfidf_matrix,
+            k=top_k,
+            block_size=block_size,
+            n_jobs=workers,
+            max_memory_mb=max_memory_mb,
+        )
+        sparse.save_npz("neighbors.npz", neighbors)
+    else:
+        cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
+        with open("cosine_sim.pkl", "wb") as f:
+            pickle.dump(cosine_sim, f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the content-based recommendation model")
+    parser.add_argument("--movies", default="movies.csv")
+    parser.add_argument("--from-db", action="store_true",
+                        help="Train on the movies table instead of a CSV file")
+    parser.add_argument("--model-dir", default=MODEL_DIR,
+                        help="Directory holding the versioned model artifacts")
+    parser.add_argument("--legacy-pickle", action="store_true",
+                        help="Write tfidf_model.pkl / cosine_sim.pkl / neighbors.npz instead of an artifact")
+    parser.add_argument("--top-k", type=int, default=None,
+                        help=f"Keep only the K most similar movies per movie (e.g. {DEFAULT_TOP_K}) "
+                             "and save a sparse neighbour index instead of the dense matrix")
+    parser.add_argument("--block-size", type=int, default=None,
+                        help="Rows per similarity block in top-K mode")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Processes computing similarity blocks in top-K mode")
+    parser.add_argument("--max-memory-mb", type=int, default=None,
+                        help="Memory ceiling for similarity blocks and TF-IDF copies across all workers")
+    parser.add_argument("--neighbors", choices=["exact", "ann"], default="exact",
+                        help="Compute the top-K index exactly or with the approximate IVF index")
+    parser.add_argument("--ann-components", type=int, default=ann_index.DEFAULT_COMPONENTS,
+                        help="TruncatedSVD dimensions the ANN index searches in")
+    parser.add_argument("--ann-lists", type=int, default=None,
+                        help="Number of IVF lists (default: sqrt of the catalog size)")
+    parser.add_argument("--ann-probes", type=int, default=ann_index.DEFAULT_PROBES,
+                        help="Lists searched per movie; higher is slower with better recall")
+    parser.add_argument("--ann-rerank", type=int, default=ann_index.DEFAULT_RERANK,
+                        help="Candidates rescored exactly, as a multiple of K")
+    parser.add_argument("--precision", choices=PRECISIONS, default=DEFAULT_PRECISION,
+                        help="Storage type of similarity scores; int8 is quantised with a scale")
+    parser.add_argument("--recall-sample", type=int, default=ann_index.DEFAULT_RECALL_SAMPLE,
+                        help="Movies whose exact neighbours are used to measure ANN recall (0 to skip)")
+    args = parser.parse_args(argv)
+
+    if args.from_db:
+        from get_recommendations import get_movies_from_db
+        movies = get_movies_from_db()
+    else:
+        movies = load_movies(args.movies)
+
+    options = dict(
+        top_k=args.top_k,
+        block_size=args.block_size,
+        workers=args.workers,
+        max_memory_mb=args.max_memory_mb,
+    )
+    if args.legacy_pickle:
+        train_legacy(movies, **options)
+    else:
+        ann = dict(
+            n_components=args.ann_components,
+            n_lists=args.ann_lists,
+            n_probe=args.ann_probes,
+            rerank=args.ann_rerank,
+        )
+        train(movies, model_dir=args.model_dir,
+              source="database" if args.from_db else args.movies,
+              neighbors=args.neighbors, ann=ann, recall_sample=args.recall_sample,
+              precision=args.precision, **options)
 
-with open("tfidf_model.pkl", "wb") as f:
-    pickle.dump(tfidf, f)
+    print("Model training completed successfully!")
 
-with open("cosine_sim.pkl", "wb") as f:
-    pickle.dump(cosine_sim, f)
 
-print("Model training completed successfully!")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+"""Incremental model updates for catalog changes.
+
+New and changed movies are transformed with the already-fitted TF-IDF
+model stored in the current artifact and only their neighbour rows are
+computed. Existing neighbour lists are patched: rows that pointed at a
+removed or changed movie are recomputed, every other row merges in the
+new candidates. The result is published as the next artifact version.
+
+A full refit runs with --full, when the artifact cannot be patched
+(dense similarity, no stored TF-IDF model), or when the share of
+unknown words in the new text passes --drift-threshold. Refits keep the
+neighbour settings recorded in the manifest; --top-k only applies when
+no model is published yet.
+
+Usage:
+    python update_model.py --movies movies.csv
+    python update_model.py --from-db
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+from scipy import sparse
+
+import model_store
+from neighbors import assemble_index, merge_top_k, rows_top_k
+from train_model import TFIDF_PARAMS, combined_features, load_movies, train
+
+DEFAULT_DRIFT_THRESHOLD = 0.2
+
+
+def catalog_changes(artifact, movies):
+    """Compare a catalog with the one an artifact was built from
+
+    Returns (hashes, changed, added, removed): the catalog's row hashes,
+    positions in movies of changed and of new movies, and artifact rows of
+    movies that are gone.
+    """
+    old_ids = np.asarray(artifact.movie_ids)
+    old_hashes = np.asarray(artifact.array("row_hashes"))
+    old_row_of = {int(movie_id): row for row, movie_id in enumerate(old_ids)}
+
+    hashes = model_store.row_hashes(movies)
+    changed, added = [], []
+    seen = np.zeros(len(old_ids), dtype=bool)
+    for position, movie_id in enumerate(movies["id"].to_numpy()):
+        row = old_row_of.get(int(movie_id))
+        if row is None:
+            added.append(position)
+        else:
+            seen[row] = True
+            if hashes[position] != old_hashes[row]:
+                changed.append(position)
+    removed = np.flatnonzero(~seen)
+    return hashes, np.asarray(changed, dtype=np.int64), np.asarray(added, dtype=np.int64), removed
+
+
+def vocabulary_drift(tfidf, texts):
+    """Share of tokens in texts that the fitted vocabulary does not know"""
+    analyzer = tfidf.build_analyzer()
+    total = unknown = 0
+    for text in texts:
+        tokens = analyzer(text)
+        total += len(tokens)
+        unknown += sum(1 for token in tokens if token not in tfidf.vocabulary_)
+    return unknown / total if total else 0.0
+
+
+def patch_model(artifact, movies, hashes, changed, added, removed, tfidf, block_size=None):
+    """Build the neighbour index and TF-IDF matrix of the updated catalog
+
+    Rows of movies that stay keep their relative order, new movies are
+    appended. Returns (movie_ids, hashes, tfidf_matrix, neighbors).
+    """
+    top_k = artifact.manifest["params"]["top_k"]
+    old_ids = np.asarray(artifact.movie_ids)
+    old_matrix = artifact.tfidf_matrix()
+    old_neighbors = artifact.similarity(dequantize=True)
+    n_old = len(old_ids)
+
+    catalog_ids = movies["id"].to_numpy()
+    position_of = {int(movie_id): position for position, movie_id in enumerate(catalog_ids)}
+
+    # Old rows that survive keep their order, then the new movies follow
+    kept_old_rows = np.setdiff1d(np.arange(n_old), removed)
+    kept_positions = np.array([position_of[int(old_ids[row])] for row in kept_old_rows], dtype=np.int64)
+    new_positions = np.concatenate([kept_positions, added])
+    new_ids = catalog_ids[new_positions]
+    n_new = len(new_ids)
+
+    old_to_new = np.full(n_old, -1, dtype=np.int64)
+    old_to_new[kept_old_rows] = np.arange(len(kept_old_rows))
+
+    # Only new and changed movies are run through the TF-IDF model
+    dirty_positions = np.concatenate([changed, added])
+    texts = combined_features(movies.iloc[dirty_positions])
+    dirty_matrix = tfidf.transform(texts) if len(dirty_positions) else None
+
+    new_row_of_position = np.full(len(movies), -1, dtype=np.int64)
+    new_row_of_position[new_positions] = np.arange(n_new)
+    dirty_rows = new_row_of_position[dirty_positions]
+
+    # Select every new row from the old matrix stacked on the re-transformed rows
+    selector = np.empty(n_new, dtype=np.int64)
+    selector[: len(kept_old_rows)] = kept_old_rows
+    if len(dirty_positions):
+        selector[dirty_rows] = n_old + np.arange(len(dirty_positions))
+        stacked = sparse.vstack([old_matrix, dirty_matrix], format="csr")
+    else:
+        stacked = sparse.csr_matrix(old_matrix)
+    tfidf_matrix = stacked[selector]
+
+    # Unchanged rows whose old neighbour list points at a removed or changed
+    # movie may have lost a true neighbour, so they are recomputed in full
+    stale = np.zeros(n_old, dtype=bool)
+    stale[removed] = True
+    stale[np.isin(old_ids, catalog_ids[changed])] = True
+    neighbor_owner = np.repeat(np.arange(n_old), np.diff(old_neighbors.indptr))
+    affected = np.zeros(n_old, dtype=bool)
+    affected[neighbor_owner[stale[old_neighbors.indices]]] = True
+    affected &= old_to_new >= 0
+
+    recompute_rows = np.unique(np.concatenate([dirty_rows, old_to_new[affected]]))
+    recomputed = rows_top_k(tfidf_matrix, recompute_rows, top_k, block_size)
+
+    # Every other row keeps its old neighbours, renumbered ...
+    coo = old_neighbors.tocoo()
+    rows, cols = old_to_new[coo.row], old_to_new[coo.col]
+    keep = (rows >= 0) & (cols >= 0) & ~np.isin(rows, recompute_rows)
+    rows, cols, scores = rows[keep], cols[keep], coo.data[keep]
+    for block_rows, block_cols, block_scores in recomputed:
+        rows = np.concatenate([rows, block_rows])
+        cols = np.concatenate([cols, block_cols])
+        scores = np.concatenate([scores, block_scores])
+
+    # ... and merges in its similarity to the new and changed movies
+    chunk = block_size or 1000
+    for start in range(0, len(dirty_rows), chunk):
+        targets = dirty_rows[start:start + chunk]
+        cross = (tfidf_matrix @ tfidf_matrix[targets].T).tocoo()
+        candidate = (cross.data > 0) & ~np.isin(cross.row, recompute_rows)
+        rows, cols, scores = merge_top_k(
+            np.concatenate([rows, cross.row[candidate]]),
+            np.concatenate([cols, targets[cross.col[candidate]]]),
+            np.concatenate([scores, cross.data[candidate].astype(np.float32)]),
+            top_k,
+        )
+
+    neighbors = assemble_index([rows], [cols], [scores], n_new)
+    return new_ids, hashes[new_positions], tfidf_matrix, neighbors
+
+
+def ann_settings(params):
+    """ANN tuning parameters recorded in a manifest, without measured results"""
+    ann = params.get("ann")
+    return {key: value for key, value in ann.items() if key != "recall"} if ann else None
+
+
+def update(movies, model_dir=model_store.MODEL_DIR, full=False,
+           drift_threshold=DEFAULT_DRIFT_THRESHOLD, block_size=None, source="movies.csv",
+           top_k=None):
+    """Bring the published model up to date with a catalog
+
+    top_k is the neighbour count of a model trained from scratch because
+    none is published. Returns the new version, or the current one if
+    nothing changed.
+    """
+    try:
+        artifact = model_store.load_artifact(model_dir)
+    except FileNotFoundError:
+        print("No published model, training from scratch")
+        return train(movies, top_k=top_k, model_dir=model_dir, source=source)
+
+    params = artifact.manifest.get("params", {})
+    top_k = params.get("top_k")
+    # Full refits keep building the index the same way
+    method = dict(
+        neighbors=params.get("neighbors", "exact"),
+        ann=ann_settings(params),
+        precision=params.get("precision", model_store.DEFAULT_PRECISION),
+    )
+    patchable = top_k and artifact.has("tfidf_idf") and artifact.has("tfidf_data")
+    if full or not patchable:
+        if not full:
+            print("Current model cannot be patched, running a full refit")
+        return train(movies, top_k=top_k, model_dir=model_dir, source=source, **method)
+
+    hashes, changed, added, removed = catalog_changes(artifact, movies)
+    if not (len(changed) or len(added) or len(removed)):
+        print(f"Model version {artifact.version} is up to date")
+        return artifact.version
+
+    tfidf = artifact.vectorizer()
+    drift = vocabulary_drift(tfidf, combined_features(movies.iloc[np.concatenate([changed, added])]))
+    print(f"{len(added)} added, {len(changed)} changed, {len(removed)} removed; "
+          f"vocabulary drift {drift:.1%}")
+    if drift > drift_threshold:
+        print(f"Vocabulary drift above {drift_threshold:.0%}, running a full refit")
+        return train(movies, top_k=top_k, model_dir=model_dir, source=source, **method)
+
+    movie_ids, new_hashes, tfidf_matrix, neighbors = patch_model(
+        artifact, movies, hashes, changed, added, removed, tfidf, block_size
+    )
+    precision = params.get("precision", model_store.DEFAULT_PRECISION)
+    arrays, files = model_store.content_arrays(
+        movie_ids, new_hashes, neighbors, tfidf, tfidf_matrix, precision
+    )
+    # The vocabulary is unchanged, so it is written as-is
+    manifest = {
+        "kind": "content",
+        "n_movies": len(movie_ids),
+        "catalog_fingerprint": model_store.catalog_fingerprint(movie_ids, new_hashes),
+        "params": {
+            "tfidf": params.get("tfidf", TFIDF_PARAMS),
+            "top_k": top_k,
+            "source": source,
+            "neighbors": method["neighbors"],
+            "ann": method["ann"],
+            "precision": precision,
+            "incremental": {
+                "base_version": artifact.version,
+                "added": len(added),
+                "changed": len(changed),
+                "removed": len(removed),
+                "vocabulary_drift": drift,
+            },
+        },
+    }
+    version = model_store.write_artifact(arrays, manifest, root=model_dir, files=files)
+    print(f"Saved model version {version} to '{model_dir}'")
+    return version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Update the recommendation model for catalog changes")
+    parser.add_argument("--movies", default="movies.csv")
+    parser.add_argument("--from-db", action="store_true",
+                        help="Read the catalog from the movies table instead of a CSV file")
+    parser.add_argument("--model-dir", default=model_store.MODEL_DIR)
+    parser.add_argument("--full", action="store_true", help="Refit the TF-IDF model from scratch")
+    parser.add_argument("--drift-threshold", type=float, default=DEFAULT_DRIFT_THRESHOLD,
+                        help="Share of unknown words in new text that triggers a full refit")
+    parser.add_argument("--block-size", type=int, default=None)
+    parser.add_argument("--top-k", type=int, default=None,
+                        help="Neighbours kept per movie when no model is published yet")
+    args = parser.parse_args(argv)
+
+    if args.from_db:
+        from get_recommendations import get_movies_from_db
+        movies = get_movies_from_db()
+    else:
+        movies = load_movies(args.movies)
+    if movies.empty:
+        print("Catalog is empty, nothing to update", file=sys.stderr)
+        sys.exit(1)
+
+    update(
+        movies,
+        model_dir=args.model_dir,
+        full=args.full,
+        drift_threshold=args.drift_threshold,
+        block_size=args.block_size,
+        source="database" if args.from_db else os.path.basename(args.movies),
+        top_k=args.top_k,
+    )
+
+
+if __name__ == "__main__":
+    main()